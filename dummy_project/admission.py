@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+
+import dummy_project.deadline as deadline
+
+from dummy_project.errors import OverloadError
+
+from dummy_project.metrics import Metrics
+
+
+class AdmissionClass:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        name: str,
+        concurrency: int,
+        queue_size: int,
+        deadline: float,
+        timeout: float,
+    ):
+        self._active = 0
+        self._concurrency = concurrency
+        self._deadline = deadline
+        self._log = log
+        self._metrics = metrics
+        self._name = name
+        self._queue_size = queue_size
+        self._service_time = 0.0
+        self._timeout = timeout
+        self._waiters = collections.deque()
+
+    @property
+    def active(self):
+        return self._active
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    @property
+    def deadline(self):
+        return self._deadline
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    @property
+    def queue_size(self):
+        return self._queue_size
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    def _shed(self, reason: str) -> None:
+        self.metrics.inc("admission_shed_total", cls=self.name, reason=reason)
+        raise OverloadError
+
+    async def acquire(self) -> None:
+        if self._active < self.concurrency and not self._waiters:
+            self._active += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            self._shed("queue_full")
+        queue_deadline = self.deadline
+        remaining = deadline.remaining()
+        if remaining is not None:
+            queue_deadline = min(queue_deadline, remaining)
+        expected = (len(self._waiters) + 1) * self._service_time / self.concurrency
+        if expected > queue_deadline:
+            self._shed("deadline")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, timeout=queue_deadline)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as err:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(err, asyncio.CancelledError):
+                raise
+            self._shed("timeout")
+        finally:
+            self.metrics.observe(
+                "admission_wait_seconds", time.monotonic() - start, cls=self.name
+            )
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._active -= 1
+
+    @contextlib.asynccontextmanager
+    async def admit(self):
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - start
+            self._service_time = 0.9 * self._service_time + 0.1 * duration
+            self.release()
+
+
+class Admission:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        classes: dict[str, AdmissionClass],
+        enabled: bool = True,
+    ):
+        self._classes = classes
+        self._enabled = enabled
+        self._log = log
+        self._metrics = metrics
+        self.metrics.register(self._metrics_collect)
+
+    @property
+    def classes(self):
+        return self._classes
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def _metrics_collect(self, metrics: Metrics) -> None:
+        for name, admission_class in self.classes.items():
+            metrics.set("admission_active", admission_class.active, cls=name)
+            metrics.set("admission_queued", admission_class.queued, cls=name)
+
+    def dependency(self, name: str):
+        admission_class = self.classes[name]
+
+        async def admit():
+            deadline.route_default(admission_class.timeout)
+            if not self.enabled:
+                yield
+                return
+            async with admission_class.admit():
+                yield
+
+        return admit
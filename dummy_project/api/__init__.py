@@ -3,6 +3,7 @@ import logging
 import httpx
 from fastapi import APIRouter
 
+from dummy_project.admission import Admission
 from dummy_project.authorize import Authorize
 
 from dummy_project.api.authenticate import ApiAuthenticate
@@ -10,22 +11,36 @@ from dummy_project.api.teams import ApiTeams
 from dummy_project.api.users import ApiUsers
 from dummy_project.api.users_credentials import ApiUsersCredentials
 
+from dummy_project.crud.audit import CrudAudit
 from dummy_project.crud.credentials import CrudCredentials
+from dummy_project.crud.jobs import CrudJobs
 from dummy_project.crud.ldap import CrudLdap
 from dummy_project.crud.teams import CrudTeams
 from dummy_project.crud.users import CrudUsers
 
+from dummy_project.ratelimit import RateLimits
+
+from dummy_project.teamjobs import TeamJobWorker
+
+from dummy_project.userdelete import UserDeletion
+
 
 class Api:
     def __init__(
         self,
         log: logging.Logger,
+        admission: Admission,
         authorize: Authorize,
+        crud_audit: CrudAudit,
+        crud_jobs: CrudJobs,
         crud_ldap: CrudLdap,
         crud_teams: CrudTeams,
         crud_users: CrudUsers,
         crud_users_credentials: CrudCredentials,
         http: httpx.AsyncClient,
+        ratelimits: RateLimits,
+        team_job_worker: TeamJobWorker,
+        user_deletion: UserDeletion,
     ):
         self._log = log
         self._router = APIRouter()
@@ -33,9 +48,12 @@ class Api:
         self.router.include_router(
             ApiAuthenticate(
                 log=log,
+                admission=admission,
                 authorize=authorize,
+                crud_audit=crud_audit,
                 crud_users=crud_users,
                 http=http,
+                ratelimits=ratelimits,
             ).router,
             responses={404: {"description": "Not found"}},
         )
@@ -43,9 +61,12 @@ class Api:
         self.router.include_router(
             ApiTeams(
                 log=log,
+                admission=admission,
                 authorize=authorize,
+                crud_jobs=crud_jobs,
                 crud_teams=crud_teams,
                 crud_ldap=crud_ldap,
+                team_job_worker=team_job_worker,
             ).router,
             responses={404: {"description": "Not found"}},
         )
@@ -53,10 +74,12 @@ class Api:
         self.router.include_router(
             ApiUsers(
                 log=log,
+                admission=admission,
                 authorize=authorize,
                 crud_teams=crud_teams,
                 crud_users=crud_users,
                 crud_users_credentials=crud_users_credentials,
+                user_deletion=user_deletion,
             ).router,
             responses={404: {"description": "Not found"}},
         )
@@ -64,6 +87,7 @@ class Api:
         self.router.include_router(
             ApiUsersCredentials(
                 log=log,
+                admission=admission,
                 authorize=authorize,
                 crud_users=crud_users,
                 crud_users_credentials=crud_users_credentials,
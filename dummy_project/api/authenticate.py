@@ -2,12 +2,15 @@ import logging
 
 
 from fastapi import APIRouter
+from fastapi import Depends
 from fastapi import Request
 from fastapi_versionizer import api_version
 
 import httpx
 
+from dummy_project.admission import Admission
 from dummy_project.authorize import Authorize
+from dummy_project.crud.audit import CrudAudit
 from dummy_project.crud.users import CrudUsers
 
 from dummy_project.errors import AuthenticationError
@@ -16,26 +19,37 @@ from dummy_project.model.common import DataDelete
 from dummy_project.model.authenticate import AuthenticateGetUser
 from dummy_project.model.authenticate import AuthenticatePost
 
+from dummy_project.ratelimit import RateLimits
+
 
 class ApiAuthenticate:
     def __init__(
         self,
         log: logging.Logger,
+        admission: Admission,
         authorize: Authorize,
+        crud_audit: CrudAudit,
         crud_users: CrudUsers,
         http: httpx.AsyncClient,
+        ratelimits: RateLimits,
     ):
         self._authorize = authorize
+        self._crud_audit = crud_audit
         self._crud_users = crud_users
         self._http = http
         self._log = log
+        self._ratelimits = ratelimits
         self._router = APIRouter(
             prefix="/authenticate",
             tags=["authenticate"],
         )
 
         self.router.add_api_route(
-            "", self.get, response_model=AuthenticateGetUser, methods=["GET"]
+            "",
+            self.get,
+            response_model=AuthenticateGetUser,
+            methods=["GET"],
+            dependencies=[Depends(admission.dependency("read"))],
         )
         self.router.add_api_route(
             "",
@@ -43,15 +57,24 @@ class ApiAuthenticate:
             response_model=AuthenticateGetUser,
             methods=["POST"],
             status_code=201,
+            dependencies=[Depends(admission.dependency("auth"))],
         )
         self.router.add_api_route(
-            "", self.delete, response_model=DataDelete, methods=["DELETE"]
+            "",
+            self.delete,
+            response_model=DataDelete,
+            methods=["DELETE"],
+            dependencies=[Depends(admission.dependency("write"))],
         )
 
     @property
     def authorize(self):
         return self._authorize
 
+    @property
+    def crud_audit(self):
+        return self._crud_audit
+
     @property
     def crud_users(self):
         return self._crud_users
@@ -64,6 +87,10 @@ class ApiAuthenticate:
     def log(self):
         return self._log
 
+    @property
+    def ratelimits(self):
+        return self._ratelimits
+
     @property
     def router(self):
         return self._router
@@ -81,7 +108,16 @@ class ApiAuthenticate:
         data: AuthenticatePost,
         request: Request,
     ):
-        user = await self.crud_users.check_credentials(credentials=data)
+        self.ratelimits.check("client", self.ratelimits.client(request))
+        self.ratelimits.check("user", data.user)
+        try:
+            user = await self.crud_users.check_credentials(credentials=data)
+        except AuthenticationError:
+            self.crud_audit.record(
+                event="login", request=request, user=data.user, success=False
+            )
+            raise
+        self.crud_audit.record(event="login", request=request, user=user)
         request.session["username"] = user
         return {"user": user}
 
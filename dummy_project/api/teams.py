@@ -2,17 +2,22 @@ import logging
 from typing import Set
 
 from fastapi import APIRouter
+from fastapi import Depends
 from fastapi import Query
 from fastapi import Request
+from fastapi.responses import JSONResponse
 from fastapi_versionizer import api_version
 
+from dummy_project.admission import Admission
 from dummy_project.authorize import Authorize
 
+from dummy_project.crud.jobs import CrudJobs
 from dummy_project.crud.teams import CrudTeams
 from dummy_project.crud.ldap import CrudLdap
 
 from dummy_project.model.common import DataDelete
 from dummy_project.model.common import sort_order_literal
+from dummy_project.model.jobs import JobGet
 from dummy_project.model.teams import filter_list
 from dummy_project.model.teams import filter_literal
 from dummy_project.model.teams import sort_literal
@@ -20,20 +25,28 @@ from dummy_project.model.teams import TeamGet
 from dummy_project.model.teams import TeamGetMulti
 from dummy_project.model.teams import TeamPost
 from dummy_project.model.teams import TeamPut
+from dummy_project.model.teams import TeamUsersGetMulti
+
+from dummy_project.teamjobs import TeamJobWorker
 
 
 class ApiTeams:
     def __init__(
         self,
         log: logging.Logger,
+        admission: Admission,
         authorize: Authorize,
+        crud_jobs: CrudJobs,
         crud_teams: CrudTeams,
         crud_ldap: CrudLdap,
+        team_job_worker: TeamJobWorker,
     ):
         self._authorize = authorize
+        self._crud_jobs = crud_jobs
         self._crud_teams = crud_teams
         self._crud_ldap = crud_ldap
         self._log = log
+        self._team_job_worker = team_job_worker
         self._router = APIRouter(
             prefix="/teams",
             tags=["teams"],
@@ -45,6 +58,7 @@ class ApiTeams:
             response_model=TeamGetMulti,
             response_model_exclude_unset=True,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("search"))],
         )
         self.router.add_api_route(
             "/{team_id}",
@@ -53,6 +67,8 @@ class ApiTeams:
             response_model_exclude_unset=True,
             methods=["POST"],
             status_code=201,
+            responses={202: {"model": JobGet}},
+            dependencies=[Depends(admission.dependency("ldap"))],
         )
         self.router.add_api_route(
             "/{team_id}",
@@ -60,6 +76,7 @@ class ApiTeams:
             response_model=DataDelete,
             response_model_exclude_unset=True,
             methods=["DELETE"],
+            dependencies=[Depends(admission.dependency("write"))],
         )
         self.router.add_api_route(
             "/{team_id}",
@@ -67,6 +84,7 @@ class ApiTeams:
             response_model=TeamGet,
             response_model_exclude_unset=True,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("read"))],
         )
         self.router.add_api_route(
             "/{team_id}",
@@ -74,12 +92,33 @@ class ApiTeams:
             response_model=TeamGet,
             response_model_exclude_unset=True,
             methods=["PUT"],
+            responses={202: {"model": JobGet}},
+            dependencies=[Depends(admission.dependency("ldap"))],
+        )
+        self.router.add_api_route(
+            "/{team_id}/users",
+            self.get_users,
+            response_model=TeamUsersGetMulti,
+            methods=["GET"],
+            dependencies=[Depends(admission.dependency("read"))],
+        )
+        self.router.add_api_route(
+            "/{team_id}/jobs/{job_id}",
+            self.get_job,
+            response_model=JobGet,
+            response_model_exclude_unset=True,
+            methods=["GET"],
+            dependencies=[Depends(admission.dependency("read"))],
         )
 
     @property
     def authorize(self):
         return self._authorize
 
+    @property
+    def crud_jobs(self):
+        return self._crud_jobs
+
     @property
     def crud_teams(self):
         return self._crud_teams
@@ -96,6 +135,25 @@ class ApiTeams:
     def router(self):
         return self._router
 
+    @property
+    def team_job_worker(self):
+        return self._team_job_worker
+
+    async def _job_accepted(
+        self, request: Request, team_id: str, ldap_group: str
+    ) -> JSONResponse:
+        job = await self.crud_jobs.create(team=team_id, ldap_group=ldap_group)
+        self.team_job_worker.notify()
+        return JSONResponse(
+            status_code=202,
+            content=job.model_dump(exclude_none=True),
+            headers={
+                "Location": str(
+                    request.url_for("get_job", team_id=team_id, job_id=job.id)
+                )
+            },
+        )
+
     @api_version(1)
     async def create(
         self,
@@ -103,8 +161,18 @@ class ApiTeams:
         data: TeamPost,
         team_id: str,
         fields: Set[filter_literal] = Query(default=filter_list),
+        background: bool = Query(
+            default=False,
+            description="resolve ldap group members in the background, returns 202",
+        ),
     ):
         await self.authorize.require_admin(request=request)
+        if data.ldap_group and background:
+            data.users = []
+            await self.crud_teams.create(_id=team_id, payload=data, fields=["id"])
+            return await self._job_accepted(
+                request=request, team_id=team_id, ldap_group=data.ldap_group
+            )
         if data.ldap_group:
             data.users = await self.crud_ldap.get_logins_from_group(
                 group=data.ldap_group
@@ -139,6 +207,32 @@ class ApiTeams:
         await self.authorize.require_admin(request=request)
         return await self.crud_teams.get(_id=team_id, fields=list(fields))
 
+    @api_version(1)
+    async def get_job(
+        self,
+        team_id: str,
+        job_id: str,
+        request: Request,
+    ):
+        await self.authorize.require_admin(request=request)
+        return await self.crud_jobs.get(_id=job_id, team=team_id)
+
+    @api_version(1)
+    async def get_users(
+        self,
+        team_id: str,
+        request: Request,
+        page: int = Query(default=0, ge=0, description="pagination index"),
+        limit: int = Query(
+            default=100,
+            ge=10,
+            le=10000,
+            description="pagination limit, min value 10, max value 10000",
+        ),
+    ):
+        await self.authorize.require_admin(request=request)
+        return await self.crud_teams.users(_id=team_id, page=page, limit=limit)
+
     @api_version(1)
     async def search(
         self,
@@ -178,12 +272,24 @@ class ApiTeams:
         team_id: str,
         request: Request,
         fields: Set[filter_literal] = Query(default=filter_list),
+        background: bool = Query(
+            default=False,
+            description="resolve ldap group members in the background, returns 202",
+        ),
     ):
         await self.authorize.require_admin(request=request)
         current_group = await self.crud_teams.get(
             _id=team_id,
             fields=["ldap_group", "users"],
         )
+        ldap_group = data.ldap_group or current_group.ldap_group
+        if ldap_group and background:
+            data.users = None
+            if data.ldap_group:
+                await self.crud_teams.update(_id=team_id, payload=data, fields=["id"])
+            return await self._job_accepted(
+                request=request, team_id=team_id, ldap_group=ldap_group
+            )
         if data.ldap_group:
             data.users = await self.crud_ldap.get_logins_from_group(
                 group=data.ldap_group
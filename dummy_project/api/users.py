@@ -2,41 +2,48 @@ import logging
 from typing import Set
 
 from fastapi import APIRouter
+from fastapi import Depends
 from fastapi import Query
 from fastapi import Request
 from fastapi_versionizer import api_version
 
+from dummy_project.admission import Admission
 from dummy_project.authorize import Authorize
 
 from dummy_project.crud.teams import CrudTeams
 from dummy_project.crud.users import CrudUsers
 from dummy_project.crud.credentials import CrudCredentials
 
-from dummy_project.model.common import DataDelete
 from dummy_project.model.common import sort_order_literal
 from dummy_project.model.users import filter_list
 from dummy_project.model.users import filter_literal
 from dummy_project.model.users import sort_literal
+from dummy_project.model.users import UserDelete
 from dummy_project.model.users import UserGet
 from dummy_project.model.users import UserGetMulti
 from dummy_project.model.users import UserPost
 from dummy_project.model.users import UserPut
 
+from dummy_project.userdelete import UserDeletion
+
 
 class ApiUsers:
     def __init__(
         self,
         log: logging.Logger,
+        admission: Admission,
         authorize: Authorize,
         crud_teams: CrudTeams,
         crud_users: CrudUsers,
         crud_users_credentials: CrudCredentials,
+        user_deletion: UserDeletion,
     ):
         self._authorize = authorize
         self._crud_teams = crud_teams
         self._crud_users = crud_users
         self._crud_users_credentials = crud_users_credentials
         self._log = log
+        self._user_deletion = user_deletion
         self._router = APIRouter(
             prefix="/users",
             tags=["users"],
@@ -48,6 +55,7 @@ class ApiUsers:
             response_model=UserGetMulti,
             response_model_exclude_unset=True,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("search"))],
         )
         self.router.add_api_route(
             "/{user_id}",
@@ -56,13 +64,15 @@ class ApiUsers:
             response_model_exclude_unset=True,
             methods=["POST"],
             status_code=201,
+            dependencies=[Depends(admission.dependency("auth"))],
         )
         self.router.add_api_route(
             "/{user_id}",
             self.delete,
-            response_model=DataDelete,
+            response_model=UserDelete,
             response_model_exclude_unset=True,
             methods=["DELETE"],
+            dependencies=[Depends(admission.dependency("write"))],
         )
         self.router.add_api_route(
             "/{user_id}",
@@ -70,6 +80,7 @@ class ApiUsers:
             response_model=UserGet,
             response_model_exclude_unset=True,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("read"))],
         )
         self.router.add_api_route(
             "/{user_id}",
@@ -77,6 +88,7 @@ class ApiUsers:
             response_model=UserGet,
             response_model_exclude_unset=True,
             methods=["PUT"],
+            dependencies=[Depends(admission.dependency("auth"))],
         )
 
     @property
@@ -103,6 +115,10 @@ class ApiUsers:
     def router(self):
         return self._router
 
+    @property
+    def user_deletion(self):
+        return self._user_deletion
+
     @api_version(1)
     async def create(
         self,
@@ -119,10 +135,7 @@ class ApiUsers:
     @api_version(1)
     async def delete(self, request: Request, user_id: str):
         await self.authorize.require_admin(request=request)
-        await self.crud_users.delete_mark(_id=user_id)
-        await self.curd_users_credentials.delete_all_from_owner(owner=user_id)
-        await self.crud_teams.delete_user_from_teams(user_id=user_id)
-        return await self.crud_users.delete(_id=user_id)
+        return await self.user_deletion.delete(_id=user_id)
 
     @api_version(1)
     async def get(
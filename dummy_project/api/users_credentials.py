@@ -1,11 +1,14 @@
+import datetime
 import logging
 from typing import Set
 
 from fastapi import APIRouter
+from fastapi import Depends
 from fastapi import Query
 from fastapi import Request
 from fastapi_versionizer import api_version
 
+from dummy_project.admission import Admission
 from dummy_project.authorize import Authorize
 
 from dummy_project.crud.credentials import CrudCredentials
@@ -27,6 +30,7 @@ class ApiUsersCredentials:
     def __init__(
         self,
         log: logging.Logger,
+        admission: Admission,
         authorize: Authorize,
         crud_users: CrudUsers,
         crud_users_credentials: CrudCredentials,
@@ -47,6 +51,7 @@ class ApiUsersCredentials:
             response_model_exclude_unset=True,
             methods=["POST"],
             status_code=201,
+            dependencies=[Depends(admission.dependency("auth"))],
         )
         self.router.add_api_route(
             "",
@@ -54,6 +59,7 @@ class ApiUsersCredentials:
             response_model=CredentialGetMulti,
             response_model_exclude_unset=True,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("search"))],
         )
         self.router.add_api_route(
             "/{credential_id}",
@@ -61,6 +67,7 @@ class ApiUsersCredentials:
             response_model=DataDelete,
             response_model_exclude_unset=True,
             methods=["DELETE"],
+            dependencies=[Depends(admission.dependency("write"))],
         )
         self.router.add_api_route(
             "/{credential_id}",
@@ -68,6 +75,7 @@ class ApiUsersCredentials:
             response_model=CredentialGet,
             response_model_exclude_unset=True,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("read"))],
         )
         self.router.add_api_route(
             "/{credential_id}",
@@ -75,6 +83,7 @@ class ApiUsersCredentials:
             response_model=CredentialGet,
             response_model_exclude_unset=True,
             methods=["PUT"],
+            dependencies=[Depends(admission.dependency("write"))],
         )
 
     @property
@@ -153,6 +162,10 @@ class ApiUsersCredentials:
         self,
         request: Request,
         user_id: str,
+        expires_before: datetime.datetime = Query(
+            description="filter: credentials expiring before this time",
+            default=None,
+        ),
         fields: Set[filter_literal] = Query(default=filter_list),
         sort: sort_literal = Query(default="id"),
         sort_order: sort_order_literal = Query(default="ascending"),
@@ -171,6 +184,7 @@ class ApiUsersCredentials:
             await self.authorize.require_admin(request=request)
         result = await self._crud_users_credentials.search(
             owner=user_id,
+            expires_before=expires_before,
             fields=list(fields),
             sort=sort,
             sort_order=sort_order,
@@ -3,30 +3,50 @@ import typing
 
 from fastapi import Request
 
+from dummy_project.crud.audit import CrudAudit
 from dummy_project.crud.users import CrudUsers
 from dummy_project.crud.credentials import CrudCredentials
 from dummy_project.crud.teams import CrudTeams
 
 from dummy_project.errors import AdminError
 from dummy_project.errors import CredentialError
+from dummy_project.errors import CredentialExpiredError
 from dummy_project.errors import ResourceNotFound
 from dummy_project.errors import SessionCredentialError
 
 from dummy_project.model.users import UserGet
 
+from dummy_project.ratelimit import RateLimits
+
+from dummy_project.sharedcache import SharedAuthCache
+
+from dummy_project.singleflight import SingleFlight
+
 
 class Authorize:
     def __init__(
         self,
         log: logging.Logger,
+        crud_audit: CrudAudit,
         crud_teams: CrudTeams,
         crud_users: CrudUsers,
         crud_users_credentials: CrudCredentials,
+        ratelimits: RateLimits,
+        shared_cache: typing.Optional[SharedAuthCache] = None,
+        singleflight: typing.Optional[SingleFlight] = None,
     ):
+        self._crud_audit = crud_audit
         self._crud_teams = crud_teams
         self._crud_users = crud_users
         self._crud_users_credentials = crud_users_credentials
         self._log = log
+        self._ratelimits = ratelimits
+        self._shared_cache = shared_cache
+        self._singleflight = singleflight
+
+    @property
+    def crud_audit(self) -> CrudAudit:
+        return self._crud_audit
 
     @property
     def crud_teams(self) -> CrudTeams:
@@ -44,13 +64,47 @@ class Authorize:
     def log(self):
         return self._log
 
+    @property
+    def ratelimits(self):
+        return self._ratelimits
+
+    @property
+    def shared_cache(self):
+        return self._shared_cache
+
+    @property
+    def singleflight(self):
+        return self._singleflight
+
+    async def _get_user(self, _id: str) -> UserGet:
+        if self.shared_cache is not None:
+            admin = self.shared_cache.admin_get(user=_id)
+            if admin is not None:
+                return UserGet(id=_id, admin=admin)
+        if self.singleflight is not None:
+            return await self.singleflight.do(_id, self._lookup_user, _id=_id)
+        return await self._lookup_user(_id=_id)
+
+    async def _lookup_user(self, _id: str) -> UserGet:
+        generation = None
+        if self.shared_cache is not None:
+            generation = self.shared_cache.users_generation
+        doc_id, user = await self.crud_users.get_with_obj_id(
+            _id=_id, fields=["id", "admin"]
+        )
+        if self.shared_cache is not None:
+            self.shared_cache.admin_put(
+                user=_id, doc_id=doc_id, admin=bool(user.admin), generation=generation
+            )
+        return user
+
     async def get_user(self, request: Request) -> UserGet:
         user = self.get_user_from_session(request=request)
         if not user:
             user = await self.get_user_from_credentials(request=request)
         if not user:
             raise SessionCredentialError
-        user = await self.crud_users.get(_id=user, fields=["id", "admin"])
+        user = await self._get_user(_id=user)
         user = await self.get_user_override(request=request, user=user)
         return user
 
@@ -61,23 +115,65 @@ class Authorize:
         if not x_user_override:
             return user
         try:
-            _user = await self.crud_users.get(
-                _id=x_user_override, fields=["id", "admin"]
-            )
+            _user = await self._get_user(_id=x_user_override)
             self.log.info(f"user {user.id} assumes user {_user.id}")
+            self.crud_audit.record(
+                event="user_override",
+                request=request,
+                user=user.id,
+                override=_user.id,
+            )
             return _user
         except ResourceNotFound:
             self.log.error(f"cannot assume user {x_user_override}, user not found")
+            self.crud_audit.record(
+                event="user_override",
+                request=request,
+                user=user.id,
+                success=False,
+                override=x_user_override,
+            )
             raise SessionCredentialError
 
     async def get_user_from_credentials(self, request: Request) -> UserGet:
+        x_secret_id = request.headers.get("x-secret-id")
+        if not x_secret_id or not request.headers.get("x-secret"):
+            self.log.debug("no credentials present")
+            return None
+        client = self.ratelimits.client(request)
+        self.ratelimits.peek("credentialclient", client)
+        self.ratelimits.peek("credential", x_secret_id)
         try:
             self.log.info("trying to get user from credentials")
             user = await self.crud_users_credentials.check_credential(request=request)
             self.log.debug(f"received user {user} from credentials")
+            self.crud_audit.record(
+                event="credential",
+                request=request,
+                user=user,
+                credential=x_secret_id,
+            )
             return user
+        except CredentialExpiredError:
+            self.log.debug("trying to get user from credentials, expired")
+            self.crud_audit.record(
+                event="credential",
+                request=request,
+                success=False,
+                credential=x_secret_id,
+                reason="expired",
+            )
+            raise
         except (CredentialError, ResourceNotFound):
             self.log.debug("trying to get user from credentials, failed")
+            self.ratelimits.charge("credentialclient", client)
+            self.ratelimits.charge("credential", x_secret_id)
+            self.crud_audit.record(
+                event="credential",
+                request=request,
+                success=False,
+                credential=x_secret_id,
+            )
 
     def get_user_from_session(self, request: Request) -> typing.Optional[str]:
         self.log.debug("trying to get user from session")
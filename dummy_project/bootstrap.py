@@ -0,0 +1,75 @@
+import logging
+import typing
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.config import Mongodb as SettingsMongodb
+from dummy_project.config import Teams as SettingsTeams
+
+from dummy_project.crud.cache import DocCache
+from dummy_project.crud.team_members import CrudTeamMembers
+from dummy_project.crud.teams import CrudTeams
+
+
+def setup_logging(log_level):
+    log = logging.getLogger("uvicorn")
+    log.info(f"setting loglevel to: {log_level}")
+    log.setLevel(log_level)
+    return log
+
+
+def setup_mongodb(
+    log: logging.Logger, settings_mongodb: SettingsMongodb
+) -> AsyncIOMotorDatabase:
+    log.info("setting up mongodb client")
+    options = {
+        "maxPoolSize": settings_mongodb.maxpoolsize,
+        "minPoolSize": settings_mongodb.minpoolsize,
+        "serverSelectionTimeoutMS": settings_mongodb.serverselectiontimeoutms,
+    }
+    if settings_mongodb.compressors:
+        options["compressors"] = settings_mongodb.compressors
+    if settings_mongodb.journal is not None:
+        options["journal"] = settings_mongodb.journal
+    if settings_mongodb.maxidletimems is not None:
+        options["maxIdleTimeMS"] = settings_mongodb.maxidletimems
+    if settings_mongodb.writeconcern:
+        w = settings_mongodb.writeconcern
+        options["w"] = int(w) if w.isdigit() else w
+    pool = AsyncIOMotorClient(settings_mongodb.url, **options)
+    db = pool.get_database(settings_mongodb.database)
+    log.info("setting up mongodb client, done")
+    return db
+
+
+async def setup_teams(
+    log: logging.Logger,
+    mongo_db: AsyncIOMotorDatabase,
+    breaker: typing.Optional[CircuitBreaker],
+    cache: typing.Optional[DocCache],
+    settings_mongodb: SettingsMongodb,
+    settings_teams: SettingsTeams,
+) -> CrudTeams:
+    crud_team_members = None
+    if settings_teams.memberscollection:
+        log.info("team members are stored in the team_members collection")
+        crud_team_members = CrudTeamMembers(
+            log=log,
+            coll=mongo_db["team_members"],
+            chunk_size=settings_teams.chunksize,
+            search_read_preference=settings_mongodb.searchreadpreference,
+            breaker=breaker,
+        )
+        await crud_team_members.index_create()
+    return CrudTeams(
+        log=log,
+        coll=mongo_db["teams"],
+        search_read_preference=settings_mongodb.searchreadpreference,
+        breaker=breaker,
+        cache=cache,
+        users_chunk_size=settings_teams.chunksize,
+        crud_team_members=crud_team_members,
+    )
@@ -0,0 +1,233 @@
+import collections
+import contextlib
+import logging
+import math
+import time
+import typing
+
+import dummy_project.deadline as deadline
+
+from dummy_project.errors import BackendUnavailable
+
+from dummy_project.metrics import Metrics
+
+
+class CircuitBreakerBucket:
+    __slots__ = ("start", "total", "failures")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.total = 0
+        self.failures = 0
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATES = (CLOSED, HALF_OPEN, OPEN)
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        name: str,
+        enabled: bool = True,
+        failure_rate: float = 0.5,
+        min_requests: int = 10,
+        window: float = 30.0,
+        open_duration: float = 30.0,
+        half_open_requests: int = 1,
+    ):
+        self._buckets = collections.deque()
+        self._enabled = enabled
+        self._failure_rate = failure_rate
+        self._half_open_requests = half_open_requests
+        self._log = log
+        self._metrics = metrics
+        self._min_requests = min_requests
+        self._name = name
+        self._open_duration = open_duration
+        self._opened = 0.0
+        self._state = self.CLOSED
+        self._trials = 0
+        self._trials_passed = 0
+        self._window = window
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def failure_rate(self):
+        return self._failure_rate
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def min_requests(self):
+        return self._min_requests
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def open_duration(self):
+        return self._open_duration
+
+    @property
+    def state(self):
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened >= self.open_duration
+        ):
+            self._transition(self.HALF_OPEN)
+        return self._state
+
+    @property
+    def window(self):
+        return self._window
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        self.log.warning(f"circuit breaker {self.name}: {self._state} -> {state}")
+        self.metrics.inc(
+            "circuit_breaker_transitions_total", breaker=self.name, state=state
+        )
+        self._state = state
+        self._buckets.clear()
+        self._trials = 0
+        self._trials_passed = 0
+        if state == self.OPEN:
+            self._opened = time.monotonic()
+
+    def _bucket(self) -> CircuitBreakerBucket:
+        now = time.monotonic()
+        while self._buckets and now - self._buckets[0].start > self.window:
+            self._buckets.popleft()
+        if not self._buckets or now - self._buckets[-1].start >= self.window / 10:
+            self._buckets.append(CircuitBreakerBucket(start=now))
+        return self._buckets[-1]
+
+    def allow(self) -> None:
+        if not self.enabled:
+            return
+        state = self.state
+        if state == self.CLOSED:
+            return
+        if state == self.HALF_OPEN and self._trials < self._half_open_requests:
+            self._trials += 1
+            return
+        self.metrics.inc("circuit_breaker_rejected_total", breaker=self.name)
+        retry_after = self.open_duration - (time.monotonic() - self._opened)
+        raise BackendUnavailable(retry_after=max(1, math.ceil(retry_after)))
+
+    def success(self) -> None:
+        if not self.enabled:
+            return
+        if self._state == self.HALF_OPEN:
+            self._trials_passed += 1
+            if self._trials_passed >= self._half_open_requests:
+                self._transition(self.CLOSED)
+            return
+        if self._state == self.OPEN:
+            return
+        self._bucket().total += 1
+
+    def failure(self) -> None:
+        if not self.enabled:
+            return
+        if self._state == self.HALF_OPEN:
+            self._transition(self.OPEN)
+            return
+        if self._state == self.OPEN:
+            return
+        bucket = self._bucket()
+        bucket.total += 1
+        bucket.failures += 1
+        total = sum(bucket.total for bucket in self._buckets)
+        failures = sum(bucket.failures for bucket in self._buckets)
+        if total >= self.min_requests and failures / total >= self.failure_rate:
+            self._transition(self.OPEN)
+
+    def ignore(self) -> None:
+        if self._state == self.HALF_OPEN and self._trials > self._trials_passed:
+            self._trials -= 1
+
+    @contextlib.contextmanager
+    def guard(self, errors: tuple):
+        self.allow()
+        try:
+            yield
+        except errors:
+            if deadline.exceeded():
+                self.ignore()
+            else:
+                self.failure()
+            raise
+        except Exception:
+            self.success()
+            raise
+        except BaseException:
+            self.ignore()
+            raise
+        else:
+            self.success()
+
+
+class CircuitBreakers:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        breakers: dict[str, CircuitBreaker],
+    ):
+        self._breakers = breakers
+        self._log = log
+        self._metrics = metrics
+        self.metrics.register(self._metrics_collect)
+
+    @property
+    def breakers(self):
+        return self._breakers
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    def _metrics_collect(self, metrics: Metrics) -> None:
+        for name, breaker in self.breakers.items():
+            state = breaker.state
+            for candidate in CircuitBreaker.STATES:
+                metrics.set(
+                    "circuit_breaker_state",
+                    int(candidate == state),
+                    breaker=name,
+                    state=candidate,
+                )
+
+    def add(self, breaker: CircuitBreaker) -> CircuitBreaker:
+        self.breakers[breaker.name] = breaker
+        return breaker
+
+    def states(self) -> dict[str, str]:
+        return {name: breaker.state for name, breaker in self.breakers.items()}
+
+    def ready(self, required: typing.Iterable[str] = ("mongodb",)) -> bool:
+        return all(
+            self.breakers[name].state != CircuitBreaker.OPEN
+            for name in required
+            if name in self.breakers
+        )
@@ -7,22 +7,143 @@ log_levels = typing.Literal[
 ]
 
 
+class AdmissionClass(BaseModel):
+    concurrency: int
+    queuesize: int
+    deadline: float
+    timeout: float
+
+
+class Admission(BaseModel):
+    enabled: bool = True
+    auth: AdmissionClass = AdmissionClass(
+        concurrency=8, queuesize=64, deadline=2.0, timeout=10.0
+    )
+    ldap: AdmissionClass = AdmissionClass(
+        concurrency=4, queuesize=32, deadline=5.0, timeout=25.0
+    )
+    search: AdmissionClass = AdmissionClass(
+        concurrency=16, queuesize=128, deadline=2.0, timeout=10.0
+    )
+    read: AdmissionClass = AdmissionClass(
+        concurrency=64, queuesize=512, deadline=1.0, timeout=5.0
+    )
+    write: AdmissionClass = AdmissionClass(
+        concurrency=16, queuesize=128, deadline=2.0, timeout=10.0
+    )
+
+
 class App(BaseModel):
     loglevel: log_levels = "INFO"
     secretkey: str = "secret"
 
 
+class Audit(BaseModel):
+    enabled: bool = True
+    batchsize: int = 500
+    flushinterval: float = 2.0
+    queuesize: int = 10000
+    retention: int = 90 * 24 * 3600
+
+
+class Cache(BaseModel):
+    enabled: bool = True
+    maxentries: int = 10000
+    ttl: float = 30.0
+
+
+class CircuitBreaker(BaseModel):
+    enabled: bool = True
+    failurerate: float = 0.5
+    halfopenrequests: int = 1
+    minrequests: int = 10
+    openduration: float = 30.0
+    window: float = 30.0
+
+
+class CircuitBreakers(BaseModel):
+    ldap: CircuitBreaker = CircuitBreaker()
+    mongodb: CircuitBreaker = CircuitBreaker()
+    oauth: CircuitBreaker = CircuitBreaker()
+
+
+class Credentials(BaseModel):
+    usageflushinterval: float = 10.0
+
+
+class Deadline(BaseModel):
+    default: float = 30.0
+    header: str = "x-request-timeout"
+    max: float = 60.0
+
+
+class Http(BaseModel):
+    http2: bool = False
+    keepaliveexpiry: float = 30.0
+    maxconnections: int = 100
+    maxkeepalive: int = 20
+    timeoutconnect: float = 5.0
+    timeoutpool: float = 5.0
+    timeoutread: float = 10.0
+    timeoutwrite: float = 10.0
+
+
+class Invalidation(BaseModel):
+    enabled: bool = True
+    mode: typing.Literal["auto", "changestream", "poll"] = "auto"
+    pollinterval: float = 1.0
+
+
 class Ldap(BaseModel):
     url: typing.Optional[str] = None
+    urls: list[str] = []
     basedn: typing.Optional[str] = None
+    batchsize: int = 100
     binddn: typing.Optional[str] = None
+    hedge: bool = False
+    hedgedelay: float = 0.1
+    hedgemindelay: float = 0.01
+    hedgepercentile: float = 95.0
+    matchingruleinchain: bool = True
+    nestedconcurrency: int = 8
+    nestedgroups: bool = False
+    pagesize: int = 500
     password: typing.Optional[str] = None
+    poolcheckouttimeout: float = 5.0
+    poolhealthcheck: float = 30.0
+    poolmaxidle: float = 300.0
+    poolmaxsize: int = 30
+    poolminsize: int = 0
+    serverfailures: int = 3
+    serverretry: float = 30.0
     userpattern: typing.Optional[str] = None
 
 
+class LdapSync(BaseModel):
+    enabled: bool = True
+    concurrency: int = 4
+    fullinterval: int = 12
+    interval: float = 300.0
+    jitter: float = 30.0
+    leasettl: float = 900.0
+    timeout: float = 300.0
+
+
 class Mongodb(BaseModel):
     url: str = "mongodb://localhost:27017"
     database: str = "dummy_project"
+    causalconsistency: bool = True
+    compressors: typing.Optional[str] = None
+    journal: typing.Optional[bool] = None
+    maxidletimems: typing.Optional[int] = None
+    maxpoolsize: int = 100
+    minpoolsize: int = 0
+    searchreadpreference: typing.Literal[
+        "primary", "primaryPreferred", "secondary", "secondaryPreferred", "nearest"
+    ] = "primary"
+    serverselectiontimeoutms: int = 30000
+    transactions: bool = True
+    writeconcern: typing.Optional[str] = None
 
 
 class OAuthClient(BaseModel):
@@ -31,12 +152,16 @@ class OAuthClient(BaseModel):
 
 
 class OAuthUrl(BaseModel):
-    authorize: str
-    accesstoken: str
+    authorize: typing.Optional[str] = None
+    accesstoken: typing.Optional[str] = None
+    discovery: typing.Optional[str] = None
     userinfo: typing.Optional["str"] = None
+    useremails: typing.Optional[str] = None
 
 
 class OAuth(BaseModel):
+    loginclaim: str = "preferred_username"
+    metadatattl: int = 3600
     override: bool = False
     scope: str
     type: str
@@ -44,9 +169,76 @@ class OAuth(BaseModel):
     url: OAuthUrl
 
 
+class RateLimitBucket(BaseModel):
+    rate: float
+    burst: int
+
+
+class RateLimit(BaseModel):
+    enabled: bool = True
+    maxkeys: int = 100000
+    sharded: bool = False
+    syncinterval: float = 1.0
+    window: int = 60
+    user: RateLimitBucket = RateLimitBucket(rate=0.1, burst=10)
+    client: RateLimitBucket = RateLimitBucket(rate=1.0, burst=30)
+    credential: RateLimitBucket = RateLimitBucket(rate=10.0, burst=100)
+    credentialclient: RateLimitBucket = RateLimitBucket(rate=20.0, burst=200)
+    trustedproxies: list[str] = []
+
+
+class SharedCache(BaseModel):
+    enabled: bool = False
+    name: str = "dummy_project"
+    slots: int = 65536
+    ttl: float = 30.0
+
+
+class SingleFlight(BaseModel):
+    enabled: bool = True
+    timeout: float = 10.0
+
+
+class Teams(BaseModel):
+    chunksize: int = 1000
+    memberscollection: bool = False
+
+
+class TeamJobs(BaseModel):
+    concurrency: int = 2
+    heartbeatinterval: float = 10.0
+    maxattempts: int = 3
+    pollinterval: float = 5.0
+    retention: int = 7 * 24 * 3600
+    timeout: float = 900.0
+
+
+class Reaper(BaseModel):
+    enabled: bool = True
+    batchsize: int = 100
+    grace: float = 600.0
+    interval: float = 300.0
+    leasettl: float = 300.0
+
+
 class Settings(BaseSettings):
+    admission: Admission = Admission()
     app: App = App()
+    audit: Audit = Audit()
+    cache: typing.Optional[dict[str, Cache]] = {}
+    circuitbreaker: CircuitBreakers = CircuitBreakers()
+    credentials: Credentials = Credentials()
+    deadline: Deadline = Deadline()
+    http: Http = Http()
+    invalidation: Invalidation = Invalidation()
     ldap: Ldap = Ldap()
+    ldapsync: LdapSync = LdapSync()
     mongodb: Mongodb = Mongodb()
     oauth: typing.Optional[dict[str, OAuth]] = {}
+    ratelimit: RateLimit = RateLimit()
+    reaper: Reaper = Reaper()
+    sharedcache: SharedCache = SharedCache()
+    singleflight: SingleFlight = SingleFlight()
+    teamjobs: TeamJobs = TeamJobs()
+    teams: Teams = Teams()
     model_config = SettingsConfigDict(env_file=".env", env_nested_delimiter="_")
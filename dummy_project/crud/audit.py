@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import datetime
+import logging
+import typing
+
+from fastapi import Request
+from motor.motor_asyncio import AsyncIOMotorCollection
+import pymongo
+import pymongo.errors
+
+from dummy_project.crud.common import CrudMongo
+
+from dummy_project.metrics import Metrics
+
+
+class CrudAudit(CrudMongo):
+    def __init__(
+        self,
+        log: logging.Logger,
+        coll: AsyncIOMotorCollection,
+        metrics: Metrics,
+        enabled: bool = True,
+        batch_size: int = 500,
+        flush_interval: float = 2.0,
+        queue_size: int = 10000,
+        retention: int = 90 * 24 * 3600,
+    ):
+        super(CrudAudit, self).__init__(log=log, coll=coll)
+        self._batch_size = batch_size
+        self._enabled = enabled
+        self._flush_event = asyncio.Event()
+        self._flush_interval = flush_interval
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._metrics = metrics
+        self._queue = collections.deque()
+        self._queue_size = queue_size
+        self._retention = retention
+        self._stopping = False
+        self.metrics.register(self._metrics_collect)
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def flush_interval(self):
+        return self._flush_interval
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def queue_size(self):
+        return self._queue_size
+
+    @property
+    def retention(self):
+        return self._retention
+
+    def _metrics_collect(self, metrics: Metrics) -> None:
+        metrics.set("audit_events_queued", len(self._queue))
+
+    async def index_create(self) -> None:
+        self.log.info(f"creating {self.resource_type} indices")
+        await self.coll.create_index(
+            [("created", pymongo.ASCENDING)], expireAfterSeconds=self.retention
+        )
+        self.log.info(f"creating {self.resource_type} indices, done")
+
+    def record(
+        self,
+        event: str,
+        request: Request,
+        user: typing.Optional[str] = None,
+        success: bool = True,
+        **details,
+    ) -> None:
+        if not self.enabled:
+            return
+        if len(self._queue) >= self.queue_size:
+            self.metrics.inc("audit_events_dropped_total", event=event)
+            return
+        self._queue.append(
+            {
+                "created": datetime.datetime.utcnow(),
+                "event": event,
+                "user": user,
+                "success": success,
+                "client": request.client.host if request.client else None,
+                "details": details,
+            }
+        )
+        if len(self._queue) >= self.batch_size:
+            self._flush_event.set()
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            while self._queue:
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+                try:
+                    await self.coll.insert_many(batch, ordered=False)
+                    self.metrics.inc("audit_events_written_total", len(batch))
+                except pymongo.errors.PyMongoError as err:
+                    self.log.error(f"audit flush failed, dropping batch: {err}")
+                    self.metrics.inc(
+                        "audit_events_dropped_total", len(batch), event="flush"
+                    )
+
+    async def _flush_loop(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(
+                    self._flush_event.wait(), timeout=self.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if not self.enabled:
+            self.log.info("audit log disabled")
+            return
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        self._stopping = True
+        self._flush_event.set()
+        if self._flush_task:
+            await self._flush_task
+            self._flush_task = None
+        self.log.info(f"flushing {len(self._queue)} pending audit events")
+        await self.flush()
@@ -0,0 +1,141 @@
+import collections
+import copy
+import logging
+import time
+import typing
+
+import bson
+from bson import json_util
+
+from dummy_project.metrics import Metrics
+
+
+class DocCacheEntry:
+    __slots__ = ("value", "expires", "size", "doc_id")
+
+    def __init__(self, value: dict, expires: float, size: int, doc_id: typing.Any):
+        self.value = value
+        self.expires = expires
+        self.size = size
+        self.doc_id = doc_id
+
+
+class DocCache:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        name: str,
+        max_entries: int = 10000,
+        ttl: float = 30.0,
+    ):
+        self._cleared = 0
+        self._docs = {}
+        self._entries = collections.OrderedDict()
+        self._generation = 0
+        self._hits = 0
+        self._invalidated = {}
+        self._log = log
+        self._max_entries = max_entries
+        self._metrics = metrics
+        self._misses = 0
+        self._name = name
+        self._size = 0
+        self._ttl = ttl
+        self.metrics.register(self._metrics_collect)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def max_entries(self):
+        return self._max_entries
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def _metrics_collect(self, metrics: Metrics) -> None:
+        total = self._hits + self._misses
+        metrics.set("doc_cache_entries", len(self._entries), resource=self.name)
+        metrics.set("doc_cache_bytes", self._size, resource=self.name)
+        metrics.set(
+            "doc_cache_hit_ratio",
+            self._hits / total if total else 0.0,
+            resource=self.name,
+        )
+
+    @staticmethod
+    def key(query: dict, fields: typing.Optional[list]) -> str:
+        return json_util.dumps(
+            [query, sorted(fields) if fields else None], sort_keys=True
+        )
+
+    def _evict(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+        keys = self._docs.get(entry.doc_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._docs[entry.doc_id]
+
+    def get(self, key: str) -> typing.Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= time.monotonic():
+            self._evict(key)
+            entry = None
+        if entry is None:
+            self._misses += 1
+            self.metrics.inc("doc_cache_misses_total", resource=self.name)
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        self.metrics.inc("doc_cache_hits_total", resource=self.name)
+        return copy.deepcopy(entry.value)
+
+    def put(self, key: str, value: dict, generation: int) -> None:
+        doc_id = value.get("_id")
+        if self._cleared > generation:
+            return
+        if self._invalidated.get(doc_id, generation) > generation:
+            return
+        if key in self._entries:
+            self._evict(key)
+        size = len(key) + len(bson.encode(value))
+        self._entries[key] = DocCacheEntry(
+            value=copy.deepcopy(value),
+            expires=time.monotonic() + self.ttl,
+            size=size,
+            doc_id=doc_id,
+        )
+        self._docs.setdefault(doc_id, set()).add(key)
+        self._size += size
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+    def invalidate(self, doc_id: typing.Any = None) -> None:
+        self._generation += 1
+        if doc_id is None or len(self._invalidated) >= self.max_entries:
+            self._cleared = self._generation
+            self._docs.clear()
+            self._entries.clear()
+            self._invalidated.clear()
+            self._size = 0
+            return
+        self._invalidated[doc_id] = self._generation
+        for key in list(self._docs.get(doc_id, ())):
+            self._evict(key)
@@ -1,21 +1,44 @@
+import contextlib
+import contextvars
+import datetime
 import logging
 import typing
 
 from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClientSession
 from motor.motor_asyncio import AsyncIOMotorCollection
 import pymongo
 import pymongo.errors
+from pymongo.read_preferences import ReadPreference
 
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.crud.cache import DocCache
 from dummy_project.crud.mixins import FilterMixIn
 from dummy_project.crud.mixins import Format
 from dummy_project.crud.mixins import PaginationSkipMixIn
 from dummy_project.crud.mixins import ProjectionMixIn
 from dummy_project.crud.mixins import SortMixIn
 
+import dummy_project.deadline as deadline
+
+from dummy_project.errors import DeadlineExceeded
 from dummy_project.errors import DuplicateResource
 from dummy_project.errors import ResourceNotFound
 from dummy_project.errors import BackendError
 
+from dummy_project.singleflight import SingleFlight
+
+read_preferences = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+mongo_session = contextvars.ContextVar("mongo_session", default=None)
+
 
 class Crud:
     def __init__(self, log: logging.Logger):
@@ -29,69 +52,244 @@ class Crud:
 class CrudMongo(
     Crud, FilterMixIn, Format, PaginationSkipMixIn, ProjectionMixIn, SortMixIn
 ):
-    def __init__(self, log: logging.Logger, coll: AsyncIOMotorCollection):
+    def __init__(
+        self,
+        log: logging.Logger,
+        coll: AsyncIOMotorCollection,
+        search_read_preference: typing.Optional[str] = None,
+        breaker: typing.Optional[CircuitBreaker] = None,
+        cache: typing.Optional[DocCache] = None,
+        singleflight: typing.Optional[SingleFlight] = None,
+    ):
         super().__init__(log)
+        self._breaker = breaker
+        self._cache = cache
+        self._singleflight = singleflight
+        self._write_listeners = []
         self._resource_type = coll.name
         self._coll = coll
+        self._coll_search = coll
+        if search_read_preference is not None:
+            self._coll_search = coll.with_options(
+                read_preference=read_preferences[search_read_preference]
+            )
+
+    @property
+    def breaker(self):
+        return self._breaker
+
+    @property
+    def cache(self):
+        return self._cache
 
     @property
     def coll(self):
         return self._coll
 
+    @property
+    def coll_search(self):
+        return self._coll_search
+
+    @property
+    def session(self) -> typing.Optional[AsyncIOMotorClientSession]:
+        return mongo_session.get()
+
+    @property
+    def singleflight(self):
+        return self._singleflight
+
     @property
     def resource_type(self):
         return self._resource_type
 
+    def _guard(self, write: bool = False) -> contextlib.ExitStack:
+        deadline.check()
+        stack = contextlib.ExitStack()
+        if write:
+            stack.callback(self._written)
+        if self.breaker is not None:
+            stack.enter_context(
+                self.breaker.guard(errors=(pymongo.errors.ConnectionFailure,))
+            )
+        timeout = deadline.remaining()
+        if timeout is not None:
+            timeout = max(timeout, 0.001)
+        stack.enter_context(pymongo.timeout(timeout))
+        return stack
+
+    def _written(self) -> None:
+        if self.cache is not None:
+            self.cache.invalidate()
+        for callback in self._write_listeners:
+            callback()
+
+    def on_write(self, callback: typing.Callable[[], None]) -> None:
+        self._write_listeners.append(callback)
+
+    async def _collapse(self, key: typing.Hashable, func: typing.Callable, **kwargs):
+        if self.singleflight is None or (
+            self.session is not None and self.session.in_transaction
+        ):
+            return await func(**kwargs)
+        return await self.singleflight.do(key, func, **kwargs)
+
+    def _backend_error(self, err: pymongo.errors.PyMongoError) -> typing.NoReturn:
+        if err.timeout and (
+            deadline.exceeded()
+            or not isinstance(err, pymongo.errors.ServerSelectionTimeoutError)
+        ):
+            self.log.warning(f"deadline exceeded: {err}")
+            raise DeadlineExceeded
+        if isinstance(err, pymongo.errors.ConnectionFailure):
+            self.log.error(f"backend error: {err}")
+            raise BackendError
+        raise err
+
     async def _create(
         self,
         payload: dict,
         fields: list = None,
+        deleting: bool = False,
     ) -> dict:
-        payload["deleting"] = False
+        payload["deleting"] = deleting
+        if deleting:
+            payload["deleting_since"] = datetime.datetime.utcnow()
         try:
-            _id = await self._coll.insert_one(payload)
-            return await self._get_by_obj_id(_id=_id.inserted_id, fields=fields)
+            with self._guard(write=True):
+                await self._coll.insert_one(payload, session=self.session)
+                return self._format(self._project(payload, fields))
         except pymongo.errors.DuplicateKeyError:
             raise DuplicateResource
-        except pymongo.errors.ConnectionFailure as err:
-            self.log.error(f"backend error: {err}")
-            raise BackendError()
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
 
     async def _delete(self, query: dict) -> dict:
         try:
-            result = await self._coll.delete_one(filter=query)
-        except pymongo.errors.ConnectionFailure as err:
-            self.log.error(f"backend error: {err}")
-            raise BackendError()
+            with self._guard(write=True):
+                result = await self._coll.delete_one(filter=query, session=self.session)
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
         if result.deleted_count == 0:
             raise ResourceNotFound
         return {}
 
+    async def _delete_many(self, query: dict) -> int:
+        try:
+            with self._guard(write=True):
+                result = await self._coll.delete_many(
+                    filter=query, session=self.session
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        return result.deleted_count
+
     async def _delete_mark(self, query: dict) -> None:
-        update = {"$set": {"deleting": True}}
+        update = {
+            "$set": {"deleting": True},
+            "$min": {"deleting_since": datetime.datetime.utcnow()},
+        }
         try:
-            await self._coll.update_one(
-                filter=query,
-                update=update,
-            )
-        except pymongo.errors.ConnectionFailure as err:
-            self.log.error(f"backend error: {err}")
-            raise BackendError
+            with self._guard(write=True):
+                result = await self._coll.update_one(
+                    filter=query,
+                    update=update,
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        if result.matched_count == 0:
+            raise ResourceNotFound
+
+    async def _delete_unmark(self, query: dict) -> None:
+        update = {"$set": {"deleting": False}, "$unset": {"deleting_since": ""}}
+        try:
+            with self._guard(write=True):
+                result = await self._coll.update_one(
+                    filter={**query, "deleting": True},
+                    update=update,
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        if result.matched_count == 0:
+            raise ResourceNotFound
+
+    async def _deleting(self, grace: float, limit: int) -> list:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace)
+        try:
+            with self._guard():
+                cursor = self._coll.find(
+                    filter={
+                        "deleting": True,
+                        "deleting_since": {"$not": {"$gte": cutoff}},
+                    },
+                    projection={"_id": 0, "id": 1},
+                    limit=limit,
+                    session=self.session,
+                )
+                return [item["id"] for item in await cursor.to_list(limit)]
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+
+    async def _deleting_index_create(self) -> None:
+        await self.coll.create_index(
+            [("deleting", pymongo.ASCENDING), ("deleting_since", pymongo.ASCENDING)],
+            partialFilterExpression={"deleting": True},
+        )
+
+    async def _find_one_and_update(
+        self,
+        query: dict,
+        update: typing.Union[dict, list],
+        fields: list,
+        upsert: bool = False,
+        return_document: bool = pymongo.ReturnDocument.AFTER,
+        sort: typing.Optional[list] = None,
+    ) -> typing.Optional[dict]:
+        try:
+            with self._guard(write=True):
+                return await self._coll.find_one_and_update(
+                    filter=query,
+                    update=update,
+                    projection=self._projection(fields=fields),
+                    upsert=upsert,
+                    return_document=return_document,
+                    sort=sort,
+                    session=self.session,
+                )
+        except pymongo.errors.DuplicateKeyError:
+            raise DuplicateResource
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
 
-    async def _get(self, query: dict, fields: list) -> dict:
+    async def _get(self, query: dict, fields: list, obj_id: bool = False) -> dict:
         query["deleting"] = False
+        cache = self.cache
+        if cache is not None and self.session is not None:
+            if self.session.in_transaction:
+                cache = None
+        if cache is not None:
+            key = cache.key(query, fields)
+            result = cache.get(key)
+            if result is not None:
+                return result if obj_id else self._format(result)
+            generation = cache.generation
         try:
-            result = await self._coll.find_one(
-                filter=query, projection=self._projection(fields)
-            )
-        except pymongo.errors.ConnectionFailure as err:
-            self.log.error(f"backend error: {err}")
-            raise BackendError
+            with self._guard():
+                result = await self._coll.find_one(
+                    filter=query,
+                    projection=self._projection(fields),
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
         if result is None:
             raise ResourceNotFound(
                 details=f"Resource {self.resource_type} {query} not found"
             )
-        return self._format(result)
+        if cache is not None:
+            cache.put(key, result, generation=generation)
+        return result if obj_id else self._format(result)
 
     async def _get_by_obj_id(self, _id, fields: list) -> dict:
         query = {"_id": _id, "deleting": False}
@@ -112,17 +310,25 @@ class CrudMongo(
     ) -> dict:
         query["deleting"] = False
         try:
-            count = await self._coll.count_documents(filter=query)
-            cursor = self._coll.find(filter=query, projection=self._projection(fields))
-            if sort and sort_order:
-                cursor.sort(self._sort(sort=sort, sort_order=sort_order))
-            if page and limit:
-                cursor.skip(self._pagination_skip(page, limit))
-                cursor.limit(limit)
-            return self._format_multi(list(await cursor.to_list(limit)), count=count)
-        except pymongo.errors.ConnectionFailure as err:
-            self.log.error(f"backend error: {err}")
-            raise BackendError
+            with self._guard():
+                count = await self.coll_search.count_documents(
+                    filter=query, session=self.session
+                )
+                cursor = self.coll_search.find(
+                    filter=query,
+                    projection=self._projection(fields),
+                    session=self.session,
+                )
+                if sort and sort_order:
+                    cursor.sort(self._sort(sort=sort, sort_order=sort_order))
+                if page and limit:
+                    cursor.skip(self._pagination_skip(page, limit))
+                    cursor.limit(limit)
+                return self._format_multi(
+                    list(await cursor.to_list(limit)), count=count
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
 
     async def _update(self, query: dict, payload: dict, fields: list) -> dict:
         query["deleting"] = False
@@ -131,16 +337,18 @@ class CrudMongo(
             if v is None:
                 continue
             update["$set"][k] = v
-        try:
-            result = await self._coll.find_one_and_update(
-                filter=query,
-                update=update,
-                projection=self._projection(fields=fields),
-                return_document=pymongo.ReturnDocument.AFTER,
-            )
-        except pymongo.errors.ConnectionFailure as err:
-            self.log.error(f"backend error: {err}")
-            raise BackendError
+        result = await self._find_one_and_update(
+            query=query, update=update, fields=fields
+        )
+        if result is None:
+            raise ResourceNotFound
+        return self._format(result)
+
+    async def _update_pipeline(self, query: dict, pipeline: list, fields: list) -> dict:
+        query["deleting"] = False
+        result = await self._find_one_and_update(
+            query=query, update=pipeline, fields=fields
+        )
         if result is None:
             raise ResourceNotFound
         return self._format(result)
@@ -1,4 +1,6 @@
+import asyncio
 import datetime
+import hashlib
 import logging
 import random
 import string
@@ -9,11 +11,15 @@ from fastapi import Request
 from motor.motor_asyncio import AsyncIOMotorCollection
 from passlib.hash import pbkdf2_sha512
 import pymongo
+import pymongo.errors
 
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.crud.cache import DocCache
 from dummy_project.crud.common import CrudMongo
 
 from dummy_project.errors import CredentialError
-from dummy_project.errors import ResourceNotFound
+from dummy_project.errors import CredentialExpiredError
 
 from dummy_project.model.common import DataDelete
 from dummy_project.model.common import sort_order_literal
@@ -23,10 +29,53 @@ from dummy_project.model.credentials import CredentialPost
 from dummy_project.model.credentials import CredentialPostResult
 from dummy_project.model.credentials import CredentialPut
 
+from dummy_project.sharedcache import SharedAuthCache
+
+from dummy_project.singleflight import SingleFlight
+
 
 class CrudCredentials(CrudMongo):
-    def __init__(self, log: logging.Logger, coll: AsyncIOMotorCollection):
-        super(CrudCredentials, self).__init__(log=log, coll=coll)
+    USAGE_FIELDS = ("last_used", "use_count")
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        coll: AsyncIOMotorCollection,
+        usage_flush_interval: float = 10.0,
+        search_read_preference: typing.Optional[str] = None,
+        breaker: typing.Optional[CircuitBreaker] = None,
+        cache: typing.Optional[DocCache] = None,
+        singleflight: typing.Optional[SingleFlight] = None,
+        shared_cache: typing.Optional[SharedAuthCache] = None,
+    ):
+        super(CrudCredentials, self).__init__(
+            log=log,
+            coll=coll,
+            search_read_preference=search_read_preference,
+            breaker=breaker,
+            cache=cache,
+            singleflight=singleflight,
+        )
+        self._shared_cache = shared_cache
+        self._usage = {}
+        self._usage_flush_interval = usage_flush_interval
+        self._usage_flush_lock = asyncio.Lock()
+        self._usage_flush_task = None
+        self._usage_stopping = asyncio.Event()
+
+    @property
+    def shared_cache(self):
+        return self._shared_cache
+
+    @property
+    def usage_flush_interval(self):
+        return self._usage_flush_interval
+
+    @staticmethod
+    def _format_dates(item: dict) -> None:
+        for field in ("created", "expires", "last_used"):
+            if item.get(field) is not None:
+                item[field] = str(item[field])
 
     @staticmethod
     def _create_secret(token) -> str:
@@ -37,21 +86,148 @@ class CrudCredentials(CrudMongo):
         await self.coll.create_index(
             [("id", pymongo.ASCENDING), ("owner", pymongo.ASCENDING)], unique=True
         )
+        await self.coll.create_index(
+            [("expires", pymongo.ASCENDING)], expireAfterSeconds=0
+        )
+        await self.coll.create_index(
+            [("owner", pymongo.ASCENDING), ("expires", pymongo.ASCENDING)]
+        )
+        await self.coll.create_index(
+            [("owner", pymongo.ASCENDING), ("last_used", pymongo.ASCENDING)]
+        )
+        await self.coll.create_index(
+            [("owner", pymongo.ASCENDING), ("use_count", pymongo.ASCENDING)]
+        )
         self.log.info(f"creating {self.resource_type} indices, done")
 
     async def check_credential(self, request: Request):
         x_secret = request.headers.get("x-secret")
         x_secret_id = request.headers.get("x-secret-id")
+        if not x_secret or not x_secret_id:
+            raise CredentialError
 
-        query = {"id": x_secret_id}
+        shared_cache = self.shared_cache
+        owner = None
+        if shared_cache is not None:
+            owner = shared_cache.credential_get(_id=x_secret_id, secret=x_secret)
+        if owner is None:
+            owner = await self._collapse(
+                (x_secret_id, hashlib.sha256(x_secret.encode()).digest()),
+                self._check_credential,
+                _id=x_secret_id,
+                secret=x_secret,
+                shared_cache=shared_cache,
+            )
+        self._usage_record(_id=x_secret_id)
+        return owner
+
+    async def _check_credential(
+        self,
+        _id: str,
+        secret: str,
+        shared_cache: typing.Optional[SharedAuthCache],
+    ) -> str:
+        query = {"id": _id}
+
+        generation = None
+        if shared_cache is not None:
+            generation = shared_cache.credentials_generation
+        result = await self._get(
+            query=query, fields=["secret", "owner", "expires"], obj_id=True
+        )
 
-        result = await self._get(query=query, fields=["secret", "owner"])
+        expires = result.get("expires")
+        if expires is not None and expires <= datetime.datetime.utcnow():
+            raise CredentialExpiredError
 
-        if not pbkdf2_sha512.verify(x_secret, result["secret"]):
+        if not pbkdf2_sha512.verify(secret, result["secret"]):
             raise CredentialError
 
+        if shared_cache is not None:
+            if expires is not None:
+                expires = expires.replace(tzinfo=datetime.timezone.utc).timestamp()
+            shared_cache.credential_put(
+                _id=_id,
+                doc_id=result["_id"],
+                secret=secret,
+                owner=result["owner"],
+                expires=expires,
+                generation=generation,
+            )
         return result["owner"]
 
+    def _usage_record(self, _id: str) -> None:
+        now = datetime.datetime.utcnow()
+        usage = self._usage.get(_id)
+        if usage is None:
+            self._usage[_id] = [now, 1]
+        else:
+            usage[0] = max(usage[0], now)
+            usage[1] += 1
+
+    async def usage_flush(self) -> None:
+        async with self._usage_flush_lock:
+            if not self._usage:
+                return
+            usage, self._usage = self._usage, {}
+            ids = list(usage)
+            requests = []
+            for _id in ids:
+                last_used, use_count = usage[_id]
+                requests.append(
+                    pymongo.UpdateOne(
+                        filter={"id": _id},
+                        update={
+                            "$max": {"last_used": last_used},
+                            "$inc": {"use_count": use_count},
+                        },
+                    )
+                )
+            try:
+                await self.coll.bulk_write(requests, ordered=False)
+            except pymongo.errors.BulkWriteError as err:
+                failed = [error["index"] for error in err.details["writeErrors"]]
+                self.log.error(
+                    f"flushing credential usage failed for {len(failed)} "
+                    f"credentials, retrying: {err}"
+                )
+                for index in failed:
+                    self._usage_requeue(ids[index], *usage[ids[index]])
+            except pymongo.errors.PyMongoError as err:
+                self.log.error(
+                    f"flushing credential usage failed, the usage counts may "
+                    f"or may not have been applied and are dropped: {err}"
+                )
+                for _id, (last_used, _) in usage.items():
+                    self._usage_requeue(_id, last_used, 0)
+
+    def _usage_requeue(
+        self, _id: str, last_used: datetime.datetime, use_count: int
+    ) -> None:
+        pending = self._usage.setdefault(_id, [last_used, 0])
+        pending[0] = max(pending[0], last_used)
+        pending[1] += use_count
+
+    async def _usage_flush_loop(self) -> None:
+        while not self._usage_stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._usage_stopping.wait(), timeout=self.usage_flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            await self.usage_flush()
+
+    def start(self) -> None:
+        self._usage_flush_task = asyncio.create_task(self._usage_flush_loop())
+
+    async def stop(self) -> None:
+        self._usage_stopping.set()
+        if self._usage_flush_task:
+            await self._usage_flush_task
+            self._usage_flush_task = None
+        await self.usage_flush()
+
     async def create(
         self,
         owner: str,
@@ -68,6 +244,8 @@ class CrudCredentials(CrudMongo):
         data["secret"] = self._create_secret(str(secret))
         data["created"] = created
         data["owner"] = owner
+        if data["expires"] is None:
+            data.pop("expires")
         await self._create(payload=data, fields=["id"])
         result = {
             "id": str(_id),
@@ -75,6 +253,8 @@ class CrudCredentials(CrudMongo):
             "description": payload.description,
             "secret": str(secret),
         }
+        if payload.expires is not None:
+            result["expires"] = str(payload.expires)
         return CredentialPostResult(**result)
 
     async def delete(self, _id: str, owner: str) -> DataDelete:
@@ -82,25 +262,21 @@ class CrudCredentials(CrudMongo):
         await self._delete(query=query)
         return DataDelete()
 
-    async def delete_all_from_owner(self, owner: str) -> DataDelete:
+    async def delete_all_from_owner(self, owner: str) -> int:
         query = {"owner": owner}
-        try:
-            await self._delete(query=query)
-        except ResourceNotFound:
-            pass
-        return DataDelete()
+        return await self._delete_many(query=query)
 
     async def get(self, _id: str, owner: str, fields: list) -> CredentialGet:
         query = {"id": str(_id), "owner": owner}
         result = await self._get(query=query, fields=fields)
-        if "created" in result:
-            result["created"] = str(result["created"])
+        self._format_dates(result)
         self.log.info(result)
         return CredentialGet(**result)
 
     async def search(
         self,
         owner: typing.Optional[str] = None,
+        expires_before: typing.Optional[datetime.datetime] = None,
         fields: typing.Optional[list] = None,
         sort: typing.Optional[str] = None,
         sort_order: typing.Optional[sort_order_literal] = None,
@@ -108,6 +284,8 @@ class CrudCredentials(CrudMongo):
         limit: typing.Optional[int] = None,
     ) -> CredentialGetMulti:
         query = {"owner": owner}
+        if expires_before is not None:
+            query["expires"] = {"$lte": expires_before}
 
         result = await self._search(
             query=query,
@@ -118,8 +296,7 @@ class CrudCredentials(CrudMongo):
             limit=limit,
         )
         for item in result["result"]:
-            if "created" in item:
-                item["created"] = str(item["created"])
+            self._format_dates(item)
         self.log.info(result)
         return CredentialGetMulti(**result)
 
@@ -129,6 +306,5 @@ class CrudCredentials(CrudMongo):
         query = {"id": _id, "owner": owner}
         data = payload.model_dump()
         result = await self._update(query=query, fields=fields, payload=data)
-        if "created" in result:
-            result["created"] = str(result["created"])
+        self._format_dates(result)
         return CredentialGet(**result)
@@ -0,0 +1,180 @@
+import datetime
+import logging
+import typing
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+import pymongo
+import pymongo.errors
+
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.crud.common import CrudMongo
+
+from dummy_project.model.jobs import JobGet
+
+
+class CrudJobs(CrudMongo):
+    def __init__(
+        self,
+        log: logging.Logger,
+        coll: AsyncIOMotorCollection,
+        retention: int = 7 * 24 * 3600,
+        breaker: typing.Optional[CircuitBreaker] = None,
+    ):
+        super(CrudJobs, self).__init__(log=log, coll=coll, breaker=breaker)
+        self._retention = retention
+
+    @property
+    def retention(self):
+        return self._retention
+
+    @staticmethod
+    def _format_dates(item: dict) -> None:
+        for field in ("created", "started", "finished"):
+            if item.get(field) is not None:
+                item[field] = str(item[field])
+
+    async def index_create(self) -> None:
+        self.log.info(f"creating {self.resource_type} indices")
+        await self.coll.create_index([("id", pymongo.ASCENDING)], unique=True)
+        await self.coll.create_index(
+            [("status", pymongo.ASCENDING), ("created", pymongo.ASCENDING)]
+        )
+        await self.coll.create_index(
+            [("finished", pymongo.ASCENDING)], expireAfterSeconds=self.retention
+        )
+        self.log.info(f"creating {self.resource_type} indices, done")
+
+    async def create(self, team: str, ldap_group: str) -> JobGet:
+        data = {
+            "id": str(uuid.uuid4()),
+            "team": team,
+            "ldap_group": ldap_group,
+            "status": "queued",
+            "attempts": 0,
+            "created": datetime.datetime.utcnow(),
+        }
+        result = await self._create(payload=data)
+        self._format_dates(result)
+        return JobGet(**result)
+
+    async def get(self, _id: str, team: str) -> JobGet:
+        query = {"id": _id, "team": team}
+        result = await self._get(query=query, fields=list(JobGet.model_fields))
+        self._format_dates(result)
+        return JobGet(**result)
+
+    async def _fail_exhausted(
+        self, stale: datetime.datetime, max_attempts: int
+    ) -> None:
+        try:
+            with self._guard(write=True):
+                result = await self._coll.update_many(
+                    filter={
+                        "status": "running",
+                        "heartbeat": {"$lt": stale},
+                        "attempts": {"$gte": max_attempts},
+                    },
+                    update={
+                        "$set": {
+                            "status": "failed",
+                            "error": "worker lost, maximum attempts reached",
+                            "finished": datetime.datetime.utcnow(),
+                        },
+                        "$unset": {"worker": "", "heartbeat": ""},
+                    },
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        if result.modified_count:
+            self.log.warning(
+                f"failed {result.modified_count} stale team jobs "
+                f"after {max_attempts} attempts"
+            )
+
+    async def claim(
+        self, worker: str, stale_after: float, max_attempts: int
+    ) -> typing.Optional[dict]:
+        now = datetime.datetime.utcnow()
+        stale = now - datetime.timedelta(seconds=stale_after)
+        await self._fail_exhausted(stale=stale, max_attempts=max_attempts)
+        return await self._find_one_and_update(
+            query={
+                "$or": [
+                    {"status": "queued"},
+                    {
+                        "status": "running",
+                        "heartbeat": {"$lt": stale},
+                        "attempts": {"$lt": max_attempts},
+                    },
+                ],
+                "deleting": False,
+            },
+            update={
+                "$set": {
+                    "status": "running",
+                    "worker": worker,
+                    "heartbeat": now,
+                    "started": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            fields=["id", "team", "ldap_group", "attempts"],
+            sort=[("created", pymongo.ASCENDING)],
+        )
+
+    async def _update_owned(self, _id: str, worker: str, update: dict) -> None:
+        try:
+            with self._guard(write=True):
+                await self._coll.update_one(
+                    filter={"id": _id, "worker": worker, "status": "running"},
+                    update=update,
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+
+    async def heartbeat(self, _id: str, worker: str, members: int) -> None:
+        await self._update_owned(
+            _id=_id,
+            worker=worker,
+            update={
+                "$set": {"heartbeat": datetime.datetime.utcnow(), "members": members}
+            },
+        )
+
+    async def finish(
+        self,
+        _id: str,
+        worker: str,
+        status: str,
+        error: typing.Optional[str] = None,
+        **result,
+    ) -> None:
+        await self._update_owned(
+            _id=_id,
+            worker=worker,
+            update={
+                "$set": {
+                    "status": status,
+                    "error": error,
+                    "finished": datetime.datetime.utcnow(),
+                    **result,
+                },
+                "$unset": {"worker": "", "heartbeat": ""},
+            },
+        )
+
+    async def release(
+        self, _id: str, worker: str, error: typing.Optional[str] = None
+    ) -> None:
+        await self._update_owned(
+            _id=_id,
+            worker=worker,
+            update={
+                "$set": {"status": "queued", "error": error},
+                "$unset": {"worker": "", "heartbeat": ""},
+            },
+        )
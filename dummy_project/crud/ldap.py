@@ -1,32 +1,67 @@
 import asyncio
+import contextlib
 import logging
+import time
+import typing
 
-import bonsai.asyncio
+import bonsai
 import bonsai.errors
-import bonsai.pool
+
+import dummy_project.deadline as deadline
+
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.crud.ldap_pool import LdapPool
+from dummy_project.crud.ldap_pool import LdapPools
 
 from dummy_project.errors import AuthenticationError
+from dummy_project.errors import DeadlineExceeded
 from dummy_project.errors import LdapInvalidDN
 from dummy_project.errors import LdapResourceNotFound
 from dummy_project.errors import LdapNoBackend
 
+from dummy_project.singleflight import SingleFlight
+
 
 class CrudLdap:
+    CHAIN_UNSUPPORTED_CODES = (-7, 0x0C, 0x12)
+
     def __init__(
         self,
         log: logging.Logger,
         ldap_base_dn: str,
         ldap_bind_dn: str,
-        ldap_pool: bonsai.asyncio.AIOConnectionPool,
-        ldap_url: str,
+        ldap_pool: typing.Optional[LdapPools],
         ldap_user_pattern: str,
+        breaker: typing.Optional[CircuitBreaker] = None,
+        nested_groups: bool = False,
+        nested_concurrency: int = 8,
+        matching_rule_in_chain: bool = True,
+        batch_size: int = 100,
+        page_size: int = 500,
+        singleflight: typing.Optional[SingleFlight] = None,
     ):
+        self._batch_size = batch_size
+        self._breaker = breaker
         self._log = log
         self._ldap_base_dn = ldap_base_dn
         self._ldap_bind_dn = ldap_bind_dn
         self._ldap_pool = ldap_pool
-        self._ldap_url = ldap_url
         self._ldap_user_pattern = ldap_user_pattern
+        self._matching_rule_in_chain = matching_rule_in_chain
+        self._nested_concurrency = nested_concurrency
+        self._nested_semaphore = asyncio.Semaphore(nested_concurrency)
+        self._nested_groups = nested_groups
+        self._page_size = page_size
+        self._singleflight = singleflight
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @property
+    def breaker(self):
+        return self._breaker
 
     @property
     def log(self):
@@ -46,80 +81,474 @@ class CrudLdap:
             raise LdapNoBackend
         return self._ldap_pool
 
-    @property
-    def ldap_url(self):
-        return self._ldap_url
-
     @property
     def ldap_user_pattern(self):
         return self._ldap_user_pattern
 
+    @property
+    def singleflight(self):
+        return self._singleflight
+
+    @property
+    def matching_rule_in_chain(self):
+        return self._matching_rule_in_chain
+
+    @property
+    def nested_concurrency(self):
+        return self._nested_concurrency
+
+    @property
+    def nested_groups(self):
+        return self._nested_groups
+
+    @property
+    def page_size(self):
+        return self._page_size
+
+    @staticmethod
+    def _timeout() -> typing.Optional[float]:
+        deadline.check()
+        remaining = deadline.remaining()
+        if remaining is None:
+            return None
+        return max(remaining, 0.001)
+
+    def _guard(self):
+        if self.breaker is None:
+            return contextlib.nullcontext()
+        return self.breaker.guard(
+            errors=(
+                bonsai.errors.ConnectionError,
+                bonsai.errors.TimeoutError,
+                DeadlineExceeded,
+            )
+        )
+
+    async def _ldap_search_pool(
+        self,
+        pool: LdapPool,
+        base_dn: str,
+        scope: bonsai.LDAPSearchScope,
+        query: str,
+        attrlist: typing.Optional[list] = None,
+    ):
+        start = time.monotonic()
+        try:
+            async with pool.connection() as conn:
+                result = await conn.search(
+                    base_dn, scope, query, attrlist=attrlist, timeout=self._timeout()
+                )
+        except bonsai.errors.TimeoutError:
+            if deadline.exceeded():
+                raise DeadlineExceeded
+            pool.record_failure()
+            raise
+        except bonsai.errors.ConnectionError:
+            pool.record_failure()
+            raise
+        except asyncio.CancelledError:
+            pool.record_abandoned(time.monotonic() - start)
+            raise
+        pool.record_success(time.monotonic() - start)
+        return result
+
+    async def _ldap_search_hedged(
+        self,
+        pools: list[LdapPool],
+        base_dn: str,
+        scope: bonsai.LDAPSearchScope,
+        query: str,
+        attrlist: typing.Optional[list],
+        failed: set,
+    ):
+        started = {
+            asyncio.create_task(
+                self._ldap_search_pool(pools[0], base_dn, scope, query, attrlist)
+            ): pools[0]
+        }
+        tasks = set(started)
+        try:
+            done, tasks = await asyncio.wait(
+                tasks, timeout=self.ldap_pool.hedge_delay(pools[0])
+            )
+            if done:
+                task = done.pop()
+                if task.exception() is not None:
+                    failed.add(pools[0])
+                return task.result()
+            self.ldap_pool.metrics.inc("ldap_hedged_searches_total")
+            task = asyncio.create_task(
+                self._ldap_search_pool(pools[1], base_dn, scope, query, attrlist)
+            )
+            started[task] = pools[1]
+            tasks.add(task)
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    failed.add(started[task])
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
     async def _ldap_search(
         self,
         base_dn: str,
         scope: bonsai.LDAPSearchScope,
         query: str,
+        attrlist: typing.Optional[list] = None,
+        hedge: bool = False,
     ):
-        counter = self.ldap_pool.max_connection + 3
-        while counter >= 0:
-            conn = await self.ldap_pool.get()
+        counter = 3
+        tried = set()
+        while True:
+            pools = self.ldap_pool.select(exclude=tried)
+            failed = set()
             try:
-                return await conn.search(base_dn, scope, query)
-            except bonsai.pool.EmptyPool:
-                self.log.warning("ldap pool empty, waiting 1 second")
-                await asyncio.sleep(1)
+                with self._guard():
+                    if hedge and self.ldap_pool.hedge and len(pools) > 1:
+                        return await self._ldap_search_hedged(
+                            pools, base_dn, scope, query, attrlist, failed
+                        )
+                    failed.add(pools[0])
+                    return await self._ldap_search_pool(
+                        pools[0], base_dn, scope, query, attrlist
+                    )
             except bonsai.errors.ConnectionError:
-                conn.close()
                 if counter == 0:
                     self.log.error("lost ldap connection, no more retries left")
-                else:
-                    self.log.error(f"lost ldap connection, {counter} retries left")
-                    counter -= 1
-            finally:
-                await self.ldap_pool.put(conn)
+                    raise
+                self.log.error(f"lost ldap connection, {counter} retries left")
+                counter -= 1
+                tried |= failed
+
+    async def _ldap_search_paged(
+        self,
+        base_dn: str,
+        scope: bonsai.LDAPSearchScope,
+        query: str,
+        attrlist: typing.Optional[list] = None,
+    ) -> typing.AsyncIterator:
+        pool = self.ldap_pool.select()[0]
+        try:
+            with self._guard():
+                async with pool.connection() as conn:
+                    results = await conn.paged_search(
+                        base_dn,
+                        scope,
+                        query,
+                        attrlist=attrlist,
+                        timeout=self._timeout(),
+                        page_size=self.page_size,
+                    )
+                    async for entry in results:
+                        yield entry
+        except bonsai.errors.TimeoutError:
+            if deadline.exceeded():
+                raise DeadlineExceeded
+            pool.record_failure()
+            raise
+        except bonsai.errors.ConnectionError:
+            pool.record_failure()
+            raise
 
     async def check_user_credentials(self, user: str, password: str):
-        client = bonsai.LDAPClient(self.ldap_url)
+        counter = 3
+        tried = set()
+        while True:
+            pool = self.ldap_pool.select(exclude=tried)[0]
+            try:
+                return await self._check_user_credentials_pool(pool, user, password)
+            except bonsai.errors.ConnectionError:
+                if counter == 0:
+                    self.log.error("lost ldap connection, no more retries left")
+                    raise
+                self.log.error(f"lost ldap connection, {counter} retries left")
+                counter -= 1
+                tried.add(pool)
+
+    async def _check_user_credentials_pool(
+        self, pool: LdapPool, user: str, password: str
+    ):
+        client = bonsai.LDAPClient(pool.client.url)
         user_name = self.ldap_user_pattern.format(user)
         client.set_credentials("SIMPLE", user_name, password)
         try:
-            async with client.connect(is_async=True) as conn:
-                user = await conn.search(
-                    self.ldap_base_dn,
-                    bonsai.LDAPSearchScope.SUBTREE,
-                    f"(userPrincipalName={user_name})",
-                )
+            with self._guard():
+                async with client.connect(
+                    is_async=True, timeout=self._timeout()
+                ) as conn:
+                    user = await conn.search(
+                        self.ldap_base_dn,
+                        bonsai.LDAPSearchScope.SUBTREE,
+                        f"(userPrincipalName={user_name})",
+                        timeout=self._timeout(),
+                    )
         except bonsai.errors.AuthenticationError:
             raise AuthenticationError
+        except bonsai.errors.TimeoutError:
+            if deadline.exceeded():
+                raise DeadlineExceeded
+            pool.record_failure()
+            raise
+        except bonsai.errors.ConnectionError:
+            pool.record_failure()
+            raise
         return user[0]
 
-    async def get_login(self, user: str):
-        user_cn, user_base = user.split(",", maxsplit=1)
-        user = await self._ldap_search(
-            base_dn=user_base, scope=bonsai.LDAPSearchScope.ONELEVEL, query=user_cn
-        )
-        return user[0]["sAMAccountName"]
-
-    async def get_logins_from_group(self, group: str):
+    @staticmethod
+    def _split_dn(dn: str) -> tuple[str, str]:
         try:
-            group_cn, group_base = group.split(",", maxsplit=1)
+            dn_cn, dn_base = dn.split(",", maxsplit=1)
         except ValueError:
             raise LdapInvalidDN
+        return dn_cn, dn_base
+
+    @staticmethod
+    def _member_range(entry) -> tuple[list, typing.Optional[int]]:
+        for key in entry.keys():
+            name = key.lower()
+            if name == "member":
+                return entry[key], None
+            if name.startswith("member;range="):
+                end = name.rsplit("-", maxsplit=1)[-1]
+                if end == "*":
+                    return entry[key], None
+                return entry[key], int(end) + 1
+        return [], None
+
+    async def iter_group_members(
+        self, group: str, start: int = 0
+    ) -> typing.AsyncIterator[str]:
+        group_cn, group_base = self._split_dn(group)
+        while True:
+            result = await self._ldap_search(
+                base_dn=group_base,
+                scope=bonsai.LDAPSearchScope.ONELEVEL,
+                query=group_cn,
+                attrlist=[f"member;range={start}-*" if start else "member"],
+                hedge=True,
+            )
+            if not result:
+                if start == 0:
+                    raise LdapResourceNotFound
+                return
+            members, start = self._member_range(result[0])
+            for member in members:
+                yield str(member)
+            if start is None:
+                return
+
+    async def get_logins_batch(self, members: list[str]) -> list[str]:
+        query = "".join(
+            f"(distinguishedName={bonsai.escape_filter_exp(member)})"
+            for member in members
+        )
+        result = await self._ldap_search(
+            base_dn=self.ldap_base_dn,
+            scope=bonsai.LDAPSearchScope.SUBTREE,
+            query=f"(|{query})",
+            attrlist=["sAMAccountName"],
+            hedge=True,
+        )
+        logins = []
+        for user in result:
+            if user.get("sAMAccountName"):
+                logins.append(str(user["sAMAccountName"][0]))
+        return logins
+
+    async def get_group_changed(self, group: str) -> typing.Optional[str]:
+        if self.nested_groups:
+            return None
+        group_cn, group_base = self._split_dn(group)
         ldap_group = await self._ldap_search(
-            base_dn=group_base, scope=bonsai.LDAPSearchScope.ONELEVEL, query=group_cn
+            base_dn=group_base,
+            scope=bonsai.LDAPSearchScope.ONELEVEL,
+            query=group_cn,
+            attrlist=["modifyTimestamp", "uSNChanged"],
         )
         try:
             ldap_group = ldap_group[0]
         except IndexError:
             raise LdapResourceNotFound
-        jobs = []
-        for user in ldap_group["member"]:
-            jobs.append(asyncio.create_task(self.get_login(user=user)))
-        if not jobs:
+        changed = []
+        for attr in ("modifyTimestamp", "uSNChanged"):
+            if ldap_group.get(attr):
+                changed.append(str(ldap_group[attr][0]))
+        return ":".join(changed) or None
+
+    async def _get_logins_in_chain(self, group: str) -> typing.Optional[list]:
+        group_filter = bonsai.escape_filter_exp(group)
+        logins = []
+        try:
+            async for user in self._ldap_search_paged(
+                base_dn=self.ldap_base_dn,
+                scope=bonsai.LDAPSearchScope.SUBTREE,
+                query=(
+                    "(&(objectCategory=person)"
+                    f"(memberOf:1.2.840.113556.1.4.1941:={group_filter}))"
+                ),
+                attrlist=["sAMAccountName"],
+            ):
+                if user.get("sAMAccountName"):
+                    logins.append(str(user["sAMAccountName"][0]))
+        except (bonsai.errors.ConnectionError, bonsai.errors.TimeoutError):
+            raise
+        except bonsai.errors.LDAPError as err:
+            if err.code not in self.CHAIN_UNSUPPORTED_CODES:
+                self.log.warning(
+                    f"ldap matching rule in chain failed, falling back: {err}"
+                )
+                return None
+            self.log.warning(
+                f"ldap matching rule in chain not supported, falling back: {err}"
+            )
+            self._matching_rule_in_chain = False
+            return None
+        return logins
+
+    async def _get_member(self, member: str):
+        member_cn, member_base = self._split_dn(member)
+        async with self._nested_semaphore:
+            result = await self._ldap_search(
+                base_dn=member_base,
+                scope=bonsai.LDAPSearchScope.ONELEVEL,
+                query=member_cn,
+                attrlist=["objectClass", "sAMAccountName", "member"],
+                hedge=True,
+            )
+        if not result:
+            return None
+        return result[0]
+
+    async def _get_member_memo(self, member: str, memo: dict):
+        task = memo.get(member)
+        if task is None:
+            task = asyncio.ensure_future(self._get_member(member=member))
+            memo[member] = task
+        return await asyncio.shield(task)
+
+    async def _resolve_member(self, member: str, memo: dict, path: frozenset) -> set:
+        entry = await self._get_member_memo(member=member, memo=memo)
+        if entry is None:
+            return set()
+        if not self._is_group(entry):
+            return {str(login) for login in entry.get("sAMAccountName", [])[:1]}
+        path = path | {member}
+        values, start = self._member_range(entry)
+        if start is not None:
+            values = list(values)
+            async for value in self.iter_group_members(group=member, start=start):
+                values.append(value)
+        members = []
+        for value in values:
+            if str(value) in path:
+                self.log.warning(f"ldap group cycle detected at {value}")
+                continue
+            members.append(str(value))
+        results = await asyncio.gather(
+            *(
+                self._resolve_member(member=value, memo=memo, path=path)
+                for value in members
+            )
+        )
+        return set().union(*results)
+
+    @staticmethod
+    def _is_group(entry) -> bool:
+        object_classes = {str(value).lower() for value in entry.get("objectClass", [])}
+        return bool(object_classes & {"group", "groupofnames"})
+
+    async def get_logins_from_group(
+        self,
+        group: str,
+        memo: typing.Optional[dict] = None,
+        progress: typing.Optional[typing.Callable[[int], None]] = None,
+    ):
+        if self.singleflight is not None and memo is None and progress is None:
+            return await self.singleflight.do(
+                group, self._get_logins_from_group, group=group
+            )
+        return await self._get_logins_from_group(
+            group=group, memo=memo, progress=progress
+        )
+
+    async def _get_logins_from_group(
+        self,
+        group: str,
+        memo: typing.Optional[dict] = None,
+        progress: typing.Optional[typing.Callable[[int], None]] = None,
+    ):
+        if self.nested_groups:
+            logins = await self.get_logins_from_group_nested(group=group, memo=memo)
+            if progress:
+                progress(len(logins))
+            return logins
+        jobs = {}
+        results = []
+        batch = []
+        members = 0
+        try:
+            async for member in self.iter_group_members(group=group):
+                batch.append(member)
+                members += 1
+                if progress:
+                    progress(members)
+                if len(batch) >= self.batch_size:
+                    await self._logins_batch_submit(jobs, results, batch)
+                    batch = []
+            if batch:
+                await self._logins_batch_submit(jobs, results, batch)
+            await self._logins_batch_wait(jobs, results, limit=0)
+        except BaseException:
+            for job in jobs:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+            raise
+        if not results:
             self.log.warning(f"ldap group has no members: {group}")
             return []
-        done, _ = await asyncio.wait(jobs, return_when=asyncio.ALL_COMPLETED)
         logins = []
-        for job in done:
-            logins.append(job.result()[0])
+        for result in results:
+            logins.extend(result)
         return logins
+
+    async def _logins_batch_submit(
+        self, jobs: dict, results: list, members: list[str]
+    ) -> None:
+        await self._logins_batch_wait(jobs, results, limit=self.nested_concurrency - 1)
+        job = asyncio.create_task(self.get_logins_batch(members=members))
+        jobs[job] = len(results)
+        results.append(None)
+
+    async def _logins_batch_wait(self, jobs: dict, results: list, limit: int) -> None:
+        while len(jobs) > limit:
+            done, _ = await asyncio.wait(jobs, return_when=asyncio.FIRST_COMPLETED)
+            for job in done:
+                results[jobs.pop(job)] = job.result()
+
+    async def get_logins_from_group_nested(
+        self, group: str, memo: typing.Optional[dict] = None
+    ):
+        if memo is None:
+            memo = {}
+        logins = None
+        if self.matching_rule_in_chain:
+            logins = await self._get_logins_in_chain(group=group)
+            if logins:
+                return logins
+        if await self._get_member_memo(member=group, memo=memo) is None:
+            raise LdapResourceNotFound
+        if logins is None:
+            logins = await self._resolve_member(
+                member=group, memo=memo, path=frozenset()
+            )
+        if not logins:
+            self.log.warning(f"ldap group has no members: {group}")
+        return sorted(logins)
@@ -0,0 +1,387 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import time
+import typing
+
+import bonsai
+import bonsai.errors
+
+import dummy_project.deadline as deadline
+
+from dummy_project.errors import DeadlineExceeded
+from dummy_project.errors import OverloadError
+
+from dummy_project.metrics import Metrics
+
+
+class LdapPoolEntry:
+    __slots__ = ("conn", "checked", "released")
+
+    def __init__(self, conn, checked: float, released: float):
+        self.conn = conn
+        self.checked = checked
+        self.released = released
+
+
+class LdapPool:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        client: bonsai.LDAPClient,
+        name: str,
+        min_size: int = 0,
+        max_size: int = 30,
+        max_idle: float = 300.0,
+        health_check_interval: float = 30.0,
+        checkout_timeout: float = 5.0,
+        reap_interval: float = 30.0,
+        max_failures: int = 3,
+        retry_down: float = 30.0,
+    ):
+        self._checkout_timeout = checkout_timeout
+        self._client = client
+        self._down_until = 0.0
+        self._failures = 0
+        self._health_check_interval = health_check_interval
+        self._idle = collections.deque()
+        self._in_use = 0
+        self._latencies = collections.deque(maxlen=256)
+        self._latency = 0.0
+        self._log = log
+        self._max_failures = max_failures
+        self._max_idle = max_idle
+        self._max_size = max_size
+        self._metrics = metrics
+        self._min_size = min_size
+        self._name = name
+        self._reap_interval = reap_interval
+        self._reap_stopping = asyncio.Event()
+        self._reap_task = None
+        self._retry_down = retry_down
+        self._size = 0
+        self._waiters = collections.deque()
+        self.metrics.register(self._metrics_collect)
+
+    @property
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    @property
+    def checkout_timeout(self):
+        return self._checkout_timeout
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def down_until(self):
+        return self._down_until
+
+    @property
+    def health_check_interval(self):
+        return self._health_check_interval
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    @property
+    def latency(self):
+        return self._latency
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def max_connection(self):
+        return self._max_size
+
+    @property
+    def max_failures(self):
+        return self._max_failures
+
+    @property
+    def max_idle(self):
+        return self._max_idle
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def min_size(self):
+        return self._min_size
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def retry_down(self):
+        return self._retry_down
+
+    @property
+    def size(self):
+        return self._size
+
+    def _metrics_collect(self, metrics: Metrics) -> None:
+        metrics.set("ldap_pool_in_use", self.in_use, pool=self.name)
+        metrics.set("ldap_pool_idle", len(self._idle), pool=self.name)
+        metrics.set("ldap_pool_size", self.size, pool=self.name)
+        metrics.set("ldap_pool_waiters", len(self._waiters), pool=self.name)
+        metrics.set("ldap_server_latency_seconds", self.latency, pool=self.name)
+        metrics.set("ldap_server_up", int(self.available), pool=self.name)
+
+    def latency_percentile(self, percentile: float) -> typing.Optional[float]:
+        if len(self._latencies) < 20:
+            return None
+        latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def record_success(self, duration: float) -> None:
+        if self._latencies:
+            self._latency = 0.8 * self._latency + 0.2 * duration
+        else:
+            self._latency = duration
+        self._latencies.append(duration)
+        self._failures = 0
+        self._down_until = 0.0
+
+    def record_abandoned(self, duration: float) -> None:
+        if duration > self._latency:
+            self._latency = 0.8 * self._latency + 0.2 * duration
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures < self.max_failures:
+            return
+        if self.available:
+            self.log.error(
+                f"ldap server {self.name} failed {self._failures} times, "
+                f"skipping it for {self.retry_down} seconds"
+            )
+            self.metrics.inc("ldap_server_down_total", pool=self.name)
+        self._down_until = time.monotonic() + self.retry_down
+
+    async def _connect(self):
+        timeout = deadline.remaining()
+        if timeout is None:
+            timeout = self.checkout_timeout
+        return await self.client.connect(is_async=True, timeout=max(timeout, 0.001))
+
+    async def _healthy(self, conn) -> bool:
+        try:
+            await conn.whoami(timeout=self.checkout_timeout)
+            return True
+        except bonsai.errors.LDAPError as err:
+            self.log.warning(f"ldap pool {self.name} health check failed: {err}")
+            return False
+
+    def _release(self, entry: typing.Optional[LdapPoolEntry]) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(entry)
+                return
+        if entry is None:
+            self._size -= 1
+        else:
+            self._idle.append(entry)
+
+    async def _wait(self) -> typing.Optional[LdapPoolEntry]:
+        timeout = self.checkout_timeout
+        remaining = deadline.remaining()
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(waiter, timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as err:
+            if waiter.done() and not waiter.cancelled():
+                self._release(waiter.result())
+            else:
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(err, asyncio.CancelledError):
+                raise
+            self.metrics.inc("ldap_pool_timeouts_total", pool=self.name)
+            if deadline.exceeded():
+                raise DeadlineExceeded
+            raise OverloadError
+
+    async def get(self):
+        start = time.monotonic()
+        if self._idle and not self._waiters:
+            entry = self._idle.pop()
+        elif self._size < self._max_size and not self._waiters:
+            self._size += 1
+            entry = None
+        else:
+            entry = await self._wait()
+        self.metrics.observe(
+            "ldap_pool_checkout_wait_seconds", time.monotonic() - start, pool=self.name
+        )
+        self._in_use += 1
+        try:
+            if entry is None:
+                return await self._connect()
+            if time.monotonic() - entry.checked <= self.health_check_interval:
+                return entry.conn
+            if await self._healthy(entry.conn):
+                return entry.conn
+            entry.conn.close()
+            self.metrics.inc("ldap_pool_reconnects_total", pool=self.name)
+            return await self._connect()
+        except BaseException:
+            self._in_use -= 1
+            self._release(None)
+            raise
+
+    async def put(self, conn, discard: bool = False) -> None:
+        self._in_use -= 1
+        if discard or conn.closed:
+            conn.close()
+            self.metrics.inc("ldap_pool_reconnects_total", pool=self.name)
+            self._release(None)
+            return
+        now = time.monotonic()
+        self._release(LdapPoolEntry(conn=conn, checked=now, released=now))
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        conn = await self.get()
+        try:
+            yield conn
+        except (bonsai.errors.ConnectionError, asyncio.CancelledError):
+            await self.put(conn, discard=True)
+            raise
+        except BaseException:
+            await self.put(conn)
+            raise
+        else:
+            await self.put(conn)
+
+    async def _reap(self) -> None:
+        now = time.monotonic()
+        while (
+            self._idle
+            and self._size > self.min_size
+            and now - self._idle[0].released > self.max_idle
+        ):
+            entry = self._idle.popleft()
+            entry.conn.close()
+            self._size -= 1
+        while self._size < self.min_size and not self._waiters:
+            self._size += 1
+            try:
+                conn = await self._connect()
+            except bonsai.errors.LDAPError as err:
+                self.log.error(f"ldap pool {self.name} cannot connect: {err}")
+                self._release(None)
+                return
+            now = time.monotonic()
+            self._release(LdapPoolEntry(conn=conn, checked=now, released=now))
+
+    async def _reap_loop(self) -> None:
+        while not self._reap_stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._reap_stopping.wait(), timeout=self._reap_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            await self._reap()
+
+    async def open(self) -> None:
+        await self._reap()
+        self._reap_task = asyncio.create_task(self._reap_loop())
+
+    async def close(self) -> None:
+        self._reap_stopping.set()
+        if self._reap_task:
+            await self._reap_task
+            self._reap_task = None
+        while self._idle:
+            entry = self._idle.popleft()
+            entry.conn.close()
+            self._size -= 1
+
+
+class LdapPools:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        pools: list[LdapPool],
+        hedge: bool = False,
+        hedge_delay: float = 0.1,
+        hedge_min_delay: float = 0.01,
+        hedge_percentile: float = 95.0,
+    ):
+        self._hedge = hedge
+        self._hedge_delay = hedge_delay
+        self._hedge_min_delay = hedge_min_delay
+        self._hedge_percentile = hedge_percentile
+        self._log = log
+        self._metrics = metrics
+        self._pools = pools
+
+    @property
+    def hedge(self):
+        return self._hedge
+
+    @property
+    def hedge_min_delay(self):
+        return self._hedge_min_delay
+
+    @property
+    def hedge_percentile(self):
+        return self._hedge_percentile
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def pools(self):
+        return self._pools
+
+    def hedge_delay(self, pool: LdapPool) -> float:
+        delay = pool.latency_percentile(self.hedge_percentile)
+        if delay is None:
+            return self._hedge_delay
+        return max(self.hedge_min_delay, delay)
+
+    def select(self, exclude: typing.Collection[LdapPool] = ()) -> list[LdapPool]:
+        pools = [pool for pool in self.pools if pool not in exclude]
+        if not pools:
+            pools = list(self.pools)
+        available = sorted(
+            (pool for pool in pools if pool.available), key=lambda pool: pool.latency
+        )
+        down = sorted(
+            (pool for pool in pools if not pool.available),
+            key=lambda pool: pool.down_until,
+        )
+        return available + down
+
+    async def open(self) -> None:
+        for pool in self.pools:
+            await pool.open()
+
+    async def close(self) -> None:
+        for pool in self.pools:
+            await pool.close()
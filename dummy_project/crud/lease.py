@@ -0,0 +1,60 @@
+import datetime
+import logging
+import typing
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+import pymongo
+import pymongo.errors
+
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.crud.common import CrudMongo
+
+from dummy_project.errors import DuplicateResource
+
+
+class CrudLease(CrudMongo):
+    def __init__(
+        self,
+        log: logging.Logger,
+        coll: AsyncIOMotorCollection,
+        breaker: typing.Optional[CircuitBreaker] = None,
+    ):
+        super(CrudLease, self).__init__(log=log, coll=coll, breaker=breaker)
+
+    async def index_create(self) -> None:
+        self.log.info(f"creating {self.resource_type} indices")
+        await self.coll.create_index([("name", pymongo.ASCENDING)], unique=True)
+        self.log.info(f"creating {self.resource_type} indices, done")
+
+    async def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        now = datetime.datetime.utcnow()
+        try:
+            await self._find_one_and_update(
+                query={
+                    "name": name,
+                    "$or": [{"holder": holder}, {"expires": {"$lt": now}}],
+                },
+                update={
+                    "$set": {
+                        "holder": holder,
+                        "expires": now + datetime.timedelta(seconds=ttl),
+                    }
+                },
+                fields=["name"],
+                upsert=True,
+            )
+        except DuplicateResource:
+            return False
+        return True
+
+    async def release(self, name: str, holder: str) -> None:
+        try:
+            with self._guard(write=True):
+                await self._coll.update_one(
+                    filter={"name": name, "holder": holder},
+                    update={"$set": {"expires": datetime.datetime.utcnow()}},
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
@@ -69,6 +69,16 @@ class ProjectionMixIn:
             result[field] = 1
         return result
 
+    @staticmethod
+    def _project(item, fields):
+        if not fields:
+            return dict(item)
+        result = {}
+        for field in ["_id", *fields]:
+            if field in item:
+                result[field] = item[field]
+        return result
+
 
 class SortMixIn:
     @staticmethod
@@ -1,9 +1,20 @@
+import asyncio
+import contextlib
 import logging
+import time
+import typing
 
 from authlib.integrations.starlette_client import OAuth as authlibOauth
 
 import httpx
 
+import dummy_project.deadline as deadline
+
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.errors import AuthenticationError
+from dummy_project.errors import DeadlineExceeded
+
 
 class CrudOAuth:
     def __init__(
@@ -16,28 +27,40 @@ class CrudOAuth:
         scope: str,
         client_id: str,
         client_secret: str,
-        authorize_url: str,
-        access_token_url: str,
+        authorize_url: typing.Optional[str],
+        access_token_url: typing.Optional[str],
+        server_metadata_url: typing.Optional[str] = None,
+        breaker: typing.Optional[CircuitBreaker] = None,
     ):
         self._backend_override = backend_override
+        self._breaker = breaker
         self._http = http
         self._log = log
         self._name = name
         self._oauth = oauth
         self._scope = scope
-        self.oauth.register(
+        self._client = self.oauth.register(
             name=name,
             client_id=client_id,
             client_secret=client_secret,
             authorize_url=authorize_url,
             access_token_url=access_token_url,
-            client_kwargs={"scope": scope},
+            server_metadata_url=server_metadata_url,
+            client_kwargs={"scope": scope, "timeout": http.timeout},
         )
 
     @property
     def backend_override(self):
         return self._backend_override
 
+    @property
+    def breaker(self):
+        return self._breaker
+
+    @property
+    def client(self):
+        return self._client
+
     @property
     def http(self):
         return self._http
@@ -58,17 +81,48 @@ class CrudOAuth:
     def scope(self):
         return self._scope
 
+    def _guard(self):
+        if self.breaker is None:
+            return contextlib.nullcontext()
+        return self.breaker.guard(errors=(httpx.TransportError, DeadlineExceeded))
+
+    @contextlib.contextmanager
+    def _request(self):
+        try:
+            with self._guard():
+                yield
+        except httpx.HTTPError as err:
+            self.log.error(f"oauth {self.name} request failed: {err!r}")
+            raise AuthenticationError(msg="oauth provider request failed")
+
+    def _response_json(self, response: httpx.Response, kind: type):
+        try:
+            response.raise_for_status()
+            result = response.json()
+        except (httpx.HTTPStatusError, ValueError) as err:
+            self.log.error(f"oauth {self.name} {response.request.url} failed: {err}")
+            raise AuthenticationError(msg="oauth provider request failed")
+        if not isinstance(result, kind):
+            self.log.error(
+                f"oauth {self.name} {response.request.url} returned "
+                f"{type(result).__name__}, expected {kind.__name__}"
+            )
+            raise AuthenticationError(msg="oauth provider returned invalid data")
+        return result
+
     async def oauth_login(self, request):
         redirect_url = request.url_for("get_oauth_auth", provider=self.name)
-        provider = self.oauth.create_client(name=self.name)
-        return await provider.authorize_redirect(request, str(redirect_url))
+        with self._request():
+            return await deadline.wait_for(
+                self.client.authorize_redirect(request, str(redirect_url))
+            )
 
     async def oauth_auth(self, request):
-        provider = self.oauth.create_client(name=self.name)
-        token = await provider.authorize_access_token(request)
+        with self._request():
+            token = await deadline.wait_for(self.client.authorize_access_token(request))
         return token
 
-    async def get_user_info(self, token):
+    async def get_user_info(self, token: dict):
         raise NotImplementedError
 
 
@@ -86,6 +140,8 @@ class CrudOAuthGitHub(CrudOAuth):
         authorize_url: str,
         access_token_url: str,
         userinfo_url: str,
+        useremails_url: typing.Optional[str] = None,
+        breaker: typing.Optional[CircuitBreaker] = None,
     ):
         super(CrudOAuthGitHub, self).__init__(
             log=log,
@@ -98,16 +154,151 @@ class CrudOAuthGitHub(CrudOAuth):
             client_secret=client_secret,
             authorize_url=authorize_url,
             access_token_url=access_token_url,
+            breaker=breaker,
         )
 
+        self._useremails_url = useremails_url
         self._userinfo_url = userinfo_url
 
+    @property
+    def useremails_url(self):
+        return self._useremails_url
+
     @property
     def userinfo_url(self):
         return self._userinfo_url
 
-    async def get_user_info(self, token: str):
-        user_info = await self.http.get(
-            url=self.userinfo_url, headers={"Authorization": f"token {token}"}
+    def _user_info(self, response: httpx.Response) -> dict:
+        user_info = self._response_json(response, dict)
+        if not user_info.get("login") or not isinstance(user_info["login"], str):
+            self.log.error(f"oauth {self.name} user info has no login")
+            raise AuthenticationError(msg="oauth provider returned no login")
+        return user_info
+
+    async def get_user_info(self, token: dict):
+        headers = {"Authorization": f"token {token['access_token']}"}
+        if not self.useremails_url:
+            with self._request():
+                user_info = await deadline.wait_for(
+                    self.http.get(url=self.userinfo_url, headers=headers)
+                )
+            return self._user_info(user_info)
+        with self._request():
+            user_info, user_emails = await deadline.wait_for(
+                asyncio.gather(
+                    self.http.get(url=self.userinfo_url, headers=headers),
+                    self.http.get(url=self.useremails_url, headers=headers),
+                )
+            )
+        user_info = self._user_info(user_info)
+        if not user_info.get("email"):
+            for email in self._response_json(user_emails, list):
+                if not isinstance(email, dict):
+                    continue
+                if email.get("primary") and email.get("verified"):
+                    user_info["email"] = email["email"]
+                    break
+        return user_info
+
+
+class CrudOAuthOIDC(CrudOAuth):
+    def __init__(
+        self,
+        log: logging.Logger,
+        http: httpx.AsyncClient,
+        backend_override: bool,
+        name: str,
+        oauth: authlibOauth,
+        scope: str,
+        client_id: str,
+        client_secret: str,
+        discovery_url: str,
+        login_claim: str = "preferred_username",
+        metadata_ttl: int = 3600,
+        breaker: typing.Optional[CircuitBreaker] = None,
+    ):
+        super(CrudOAuthOIDC, self).__init__(
+            log=log,
+            http=http,
+            backend_override=backend_override,
+            name=name,
+            oauth=oauth,
+            scope=scope,
+            client_id=client_id,
+            client_secret=client_secret,
+            authorize_url=None,
+            access_token_url=None,
+            server_metadata_url=discovery_url,
+            breaker=breaker,
         )
-        return user_info.json()
+        self._discovery_url = discovery_url
+        self._jwks_loaded = None
+        self._login_claim = login_claim
+        self._metadata_loaded = None
+        self._metadata_ttl = metadata_ttl
+        self.client.fetch_jwk_set = self.jwks
+
+    @property
+    def discovery_url(self):
+        return self._discovery_url
+
+    @property
+    def login_claim(self):
+        return self._login_claim
+
+    @property
+    def metadata_ttl(self):
+        return self._metadata_ttl
+
+    def _expired(self, loaded: typing.Optional[float]) -> bool:
+        return loaded is None or time.monotonic() - loaded > self.metadata_ttl
+
+    async def metadata(self) -> dict:
+        if self._expired(self._metadata_loaded):
+            self.log.info(f"oauth {self.name} loading discovery document")
+            with self._request():
+                response = await deadline.wait_for(
+                    self.http.get(url=self.discovery_url)
+                )
+            metadata = self._response_json(response, dict)
+            metadata["_loaded_at"] = time.time()
+            self.client.server_metadata.update(metadata)
+            self._metadata_loaded = time.monotonic()
+        return self.client.server_metadata
+
+    async def jwks(self, force: bool = False) -> dict:
+        metadata = await self.metadata()
+        if force or self._expired(self._jwks_loaded) or "jwks" not in metadata:
+            self.log.info(f"oauth {self.name} loading jwks")
+            with self._request():
+                response = await deadline.wait_for(
+                    self.http.get(url=metadata["jwks_uri"])
+                )
+            metadata["jwks"] = self._response_json(response, dict)
+            self._jwks_loaded = time.monotonic()
+        return metadata["jwks"]
+
+    async def oauth_login(self, request):
+        await self.metadata()
+        return await super(CrudOAuthOIDC, self).oauth_login(request=request)
+
+    async def oauth_auth(self, request):
+        await self.jwks()
+        return await super(CrudOAuthOIDC, self).oauth_auth(request=request)
+
+    async def get_user_info(self, token: dict):
+        claims = token.get("userinfo")
+        if not claims:
+            self.log.error(f"oauth {self.name} returned no id_token")
+            raise AuthenticationError(msg="oauth provider returned no id_token")
+        login = claims.get(self.login_claim)
+        if not login:
+            self.log.error(f"oauth {self.name} id_token has no {self.login_claim}")
+            raise AuthenticationError(
+                msg=f"oauth provider returned no {self.login_claim} claim"
+            )
+        return {
+            "login": login,
+            "email": claims.get("email"),
+            "name": claims.get("name"),
+        }
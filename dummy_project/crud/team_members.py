@@ -0,0 +1,150 @@
+import logging
+import typing
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+import pymongo
+import pymongo.errors
+
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.crud.common import CrudMongo
+
+
+class CrudTeamMembers(CrudMongo):
+    def __init__(
+        self,
+        log: logging.Logger,
+        coll: AsyncIOMotorCollection,
+        chunk_size: int = 1000,
+        search_read_preference: typing.Optional[str] = None,
+        breaker: typing.Optional[CircuitBreaker] = None,
+    ):
+        super(CrudTeamMembers, self).__init__(
+            log=log,
+            coll=coll,
+            search_read_preference=search_read_preference,
+            breaker=breaker,
+        )
+        self._chunk_size = chunk_size
+
+    @property
+    def chunk_size(self):
+        return self._chunk_size
+
+    def _chunks(self, users: list) -> typing.Iterator[list]:
+        for index in range(0, len(users), self.chunk_size):
+            yield users[index : index + self.chunk_size]
+
+    async def index_create(self) -> None:
+        self.log.info(f"creating {self.resource_type} indices")
+        await self.coll.create_index(
+            [
+                ("team", pymongo.ASCENDING),
+                ("user", pymongo.ASCENDING),
+            ],
+            unique=True,
+        )
+        await self.coll.create_index(
+            [
+                ("user", pymongo.ASCENDING),
+                ("team", pymongo.ASCENDING),
+            ]
+        )
+        self.log.info(f"creating {self.resource_type} indices, done")
+
+    async def add(self, team: str, users: list) -> None:
+        for chunk in self._chunks(users):
+            try:
+                with self._guard(write=True):
+                    await self._coll.insert_many(
+                        [{"team": team, "user": user} for user in chunk],
+                        ordered=False,
+                        session=self.session,
+                    )
+            except pymongo.errors.BulkWriteError as err:
+                if any(error["code"] != 11000 for error in err.details["writeErrors"]):
+                    self._backend_error(err)
+            except pymongo.errors.PyMongoError as err:
+                self._backend_error(err)
+
+    async def remove(self, team: str, users: list) -> None:
+        for chunk in self._chunks(users):
+            try:
+                with self._guard(write=True):
+                    await self._coll.delete_many(
+                        filter={"team": team, "user": {"$in": chunk}},
+                        session=self.session,
+                    )
+            except pymongo.errors.PyMongoError as err:
+                self._backend_error(err)
+
+    async def delete_team(self, team: str) -> None:
+        try:
+            with self._guard(write=True):
+                await self._coll.delete_many(
+                    filter={"team": team},
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+
+    async def delete_user(self, user: str) -> None:
+        try:
+            with self._guard(write=True):
+                await self._coll.delete_many(
+                    filter={"user": user},
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+
+    async def users(self, team: str) -> list:
+        try:
+            with self._guard():
+                cursor = self._coll.find(
+                    filter={"team": team},
+                    projection={"_id": 0, "user": 1},
+                    sort=[("user", pymongo.ASCENDING)],
+                    session=self.session,
+                )
+                return [item["user"] async for item in cursor]
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+
+    async def users_page(self, team: str, page: int, limit: int) -> dict:
+        query = {"team": team}
+        try:
+            with self._guard():
+                count = await self.coll_search.count_documents(
+                    filter=query, session=self.session
+                )
+                cursor = self.coll_search.find(
+                    filter=query,
+                    projection={"_id": 0, "user": 1},
+                    sort=[("user", pymongo.ASCENDING)],
+                    skip=self._pagination_skip(page, limit),
+                    limit=limit,
+                    session=self.session,
+                )
+                return self._format_multi(
+                    [item["user"] for item in await cursor.to_list(limit)],
+                    count=count,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+
+    async def teams(self, users: str) -> list:
+        query = {}
+        if users.startswith("^"):
+            self._filter_re(query, "user", users)
+        else:
+            self._filter_list(query, "user", users)
+        try:
+            with self._guard():
+                return await self.coll_search.distinct(
+                    "team",
+                    filter=query,
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
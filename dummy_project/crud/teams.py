@@ -5,7 +5,14 @@ from motor.motor_asyncio import AsyncIOMotorCollection
 import pymongo
 import pymongo.errors
 
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.crud.cache import DocCache
 from dummy_project.crud.common import CrudMongo
+from dummy_project.crud.team_members import CrudTeamMembers
+
+from dummy_project.errors import ConflictError
+from dummy_project.errors import ResourceNotFound
 
 from dummy_project.model.common import DataDelete
 from dummy_project.model.common import sort_order_literal
@@ -13,11 +20,145 @@ from dummy_project.model.teams import TeamGet
 from dummy_project.model.teams import TeamGetMulti
 from dummy_project.model.teams import TeamPost
 from dummy_project.model.teams import TeamPut
+from dummy_project.model.teams import TeamUsersGetMulti
 
 
 class CrudTeams(CrudMongo):
-    def __init__(self, log: logging.Logger, coll: AsyncIOMotorCollection):
-        super(CrudTeams, self).__init__(log=log, coll=coll)
+    USERS_ATTEMPTS = 5
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        coll: AsyncIOMotorCollection,
+        search_read_preference: typing.Optional[str] = None,
+        breaker: typing.Optional[CircuitBreaker] = None,
+        cache: typing.Optional[DocCache] = None,
+        users_chunk_size: int = 1000,
+        crud_team_members: typing.Optional[CrudTeamMembers] = None,
+    ):
+        super(CrudTeams, self).__init__(
+            log=log,
+            coll=coll,
+            search_read_preference=search_read_preference,
+            breaker=breaker,
+            cache=cache,
+        )
+        self._crud_team_members = crud_team_members
+        self._users_chunk_size = users_chunk_size
+
+    @property
+    def crud_team_members(self):
+        return self._crud_team_members
+
+    @property
+    def users_chunk_size(self):
+        return self._users_chunk_size
+
+    @staticmethod
+    def _team_fields(fields: list) -> list:
+        return [field for field in fields if field != "users"] or ["id"]
+
+    def _users_chunks(self, users: list) -> typing.Iterator[list]:
+        for index in range(0, len(users), self.users_chunk_size):
+            yield users[index : index + self.users_chunk_size]
+
+    async def _users_claim(self, query: dict) -> typing.Optional[dict]:
+        projection = {"_id": 0, "id": 1, "users_version": 1}
+        if self.crud_team_members is None:
+            projection["users"] = 1
+        try:
+            with self._guard():
+                current = await self._coll.find_one(
+                    filter=query,
+                    projection=projection,
+                    session=self.session,
+                )
+                if current is None:
+                    return None
+                version = current.get("users_version")
+                result = await self._coll.update_one(
+                    filter={**query, "users_version": version},
+                    update={"$set": {"users_version": (version or 0) + 1}},
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        if result.matched_count == 0:
+            return {}
+        current["users_version"] = (version or 0) + 1
+        return current
+
+    async def _users_owned(self, query: dict, version: int) -> bool:
+        try:
+            with self._guard():
+                current = await self._coll.find_one(
+                    filter={**query, "users_version": version},
+                    projection={"_id": 1},
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        return current is not None
+
+    async def _users_write(
+        self, query: dict, current: dict, users: list
+    ) -> typing.Optional[dict]:
+        if self.crud_team_members is not None:
+            existing = set(await self.crud_team_members.users(team=current["id"]))
+        else:
+            existing = set(current.get("users") or [])
+        wanted = dict.fromkeys(users)
+        added = [user for user in wanted if user not in existing]
+        removed = sorted(user for user in existing if user not in wanted)
+        diff = {"users_added": len(added), "users_removed": len(removed)}
+        version = current["users_version"]
+        if self.crud_team_members is not None:
+            for chunk in self._users_chunks(removed):
+                await self.crud_team_members.remove(team=current["id"], users=chunk)
+                if not await self._users_owned(query, version):
+                    return None
+            for chunk in self._users_chunks(added):
+                await self.crud_team_members.add(team=current["id"], users=chunk)
+                if not await self._users_owned(query, version):
+                    return None
+            return diff
+        query = {**query, "users_version": version}
+        updates = [
+            {"$pull": {"users": {"$in": chunk}}}
+            for chunk in self._users_chunks(removed)
+        ]
+        updates += [
+            {"$addToSet": {"users": {"$each": chunk}}}
+            for chunk in self._users_chunks(added)
+        ]
+        try:
+            with self._guard(write=True):
+                for update in updates:
+                    result = await self._coll.update_one(
+                        filter=query,
+                        update=update,
+                        session=self.session,
+                    )
+                    if result.matched_count == 0:
+                        return None
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        return diff
+
+    async def _users_apply(self, query: dict, users: list) -> typing.Optional[dict]:
+        query = {**query, "deleting": False}
+        for _ in range(self.USERS_ATTEMPTS):
+            current = await self._users_claim(query)
+            if current is None:
+                return None
+            if current:
+                diff = await self._users_write(query, current, users)
+                if diff is not None:
+                    return diff
+            self.log.warning(
+                f"concurrent member update of team {query['id']}, retrying"
+            )
+        raise ConflictError
 
     async def index_create(self) -> None:
         self.log.info(f"creating {self.resource_type} indices")
@@ -37,6 +178,7 @@ class CrudTeams(CrudMongo):
                 ("users", pymongo.ASCENDING),
             ]
         )
+        await self._deleting_index_create()
         self.log.info(f"creating {self.resource_type} indices, done")
 
     async def create(
@@ -47,7 +189,25 @@ class CrudTeams(CrudMongo):
     ) -> TeamGet:
         data = payload.model_dump()
         data["id"] = _id
-        result = await self._create(payload=data, fields=fields)
+        if self.crud_team_members is None:
+            result = await self._create(payload=data, fields=fields)
+            return TeamGet(**result)
+        users = list(dict.fromkeys(data.pop("users") or []))
+        result = await self._create(payload=data, fields=fields, deleting=True)
+        try:
+            await self.crud_team_members.add(team=_id, users=users)
+            await self._delete_unmark(query={"id": _id})
+        except Exception:
+            try:
+                await self.delete(_id=_id)
+            except Exception as err:
+                self.log.error(
+                    f"cleaning up partially created team {_id} failed, "
+                    f"leaving it to the reaper: {err}"
+                )
+            raise
+        if "users" in fields:
+            result["users"] = users
         return TeamGet(**result)
 
     async def delete(
@@ -55,6 +215,8 @@ class CrudTeams(CrudMongo):
         _id: str,
     ) -> DataDelete:
         query = {"id": _id}
+        if self.crud_team_members is not None:
+            await self.crud_team_members.delete_team(team=_id)
         await self._delete(query=query)
         return DataDelete()
 
@@ -66,12 +228,23 @@ class CrudTeams(CrudMongo):
         await self._delete_mark(query=query)
 
     async def delete_user_from_teams(self, user_id):
-        query = {}
+        if self.crud_team_members is not None:
+            await self.crud_team_members.delete_user(user=user_id)
+            return
+        query = {"users": user_id}
         update = {"$pull": {"users": user_id}}
-        await self._coll.update_many(
-            filter=query,
-            update=update,
-        )
+        try:
+            with self._guard(write=True):
+                await self._coll.update_many(
+                    filter=query,
+                    update=update,
+                    session=self.session,
+                )
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+
+    async def deleting(self, grace: float, limit: int) -> list:
+        return await self._deleting(grace=grace, limit=limit)
 
     async def get(
         self,
@@ -79,9 +252,128 @@ class CrudTeams(CrudMongo):
         fields: list,
     ) -> TeamGet:
         query = {"id": _id}
-        result = await self._get(query=query, fields=fields)
+        if self.crud_team_members is None:
+            result = await self._get(query=query, fields=fields)
+            return TeamGet(**result)
+        result = await self._get(query=query, fields=self._team_fields(fields))
+        if "users" in fields:
+            result["users"] = await self.crud_team_members.users(team=_id)
         return TeamGet(**result)
 
+    async def ldap_teams(self) -> list[dict]:
+        try:
+            with self._guard():
+                cursor = self._coll.find(
+                    filter={"ldap_group": {"$nin": ["", None]}, "deleting": False},
+                    projection={"_id": 0, "id": 1, "ldap_group": 1, "ldap_changed": 1},
+                    session=self.session,
+                )
+                return await cursor.to_list(None)
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+
+    async def ldap_sync(
+        self,
+        _id: str,
+        ldap_group: str,
+        users: list,
+        ldap_changed: typing.Optional[str],
+    ) -> typing.Optional[dict]:
+        query = {"id": _id, "ldap_group": ldap_group}
+        diff = await self._users_apply(query=query, users=users)
+        if diff is None:
+            return None
+        result = await self._find_one_and_update(
+            query={**query, "deleting": False},
+            update={"$set": {"ldap_changed": ldap_changed}},
+            fields=["id"],
+        )
+        if result is None:
+            return None
+        return diff
+
+    async def users(
+        self,
+        _id: str,
+        page: int,
+        limit: int,
+    ) -> TeamUsersGetMulti:
+        if self.crud_team_members is not None:
+            await self.resource_exists(_id=_id)
+            result = await self.crud_team_members.users_page(
+                team=_id, page=page, limit=limit
+            )
+            return TeamUsersGetMulti(**result)
+        users = {"$ifNull": ["$users", []]}
+        try:
+            with self._guard():
+                cursor = self.coll_search.aggregate(
+                    [
+                        {"$match": {"id": _id, "deleting": False}},
+                        {
+                            "$project": {
+                                "_id": 0,
+                                "count": {"$size": users},
+                                "users": {
+                                    "$slice": [
+                                        users,
+                                        self._pagination_skip(page, limit),
+                                        limit,
+                                    ]
+                                },
+                            }
+                        },
+                    ],
+                    session=self.session,
+                )
+                result = await cursor.to_list(1)
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        if not result:
+            raise ResourceNotFound(
+                details=f"Resource {self.resource_type} {_id} not found"
+            )
+        return TeamUsersGetMulti(
+            **self._format_multi(result[0]["users"], count=result[0]["count"])
+        )
+
+    async def users_migrate(self, prune: bool = False) -> int:
+        migrated = 0
+        try:
+            with self._guard():
+                cursor = self._coll.find(
+                    filter={"deleting": False, "users": {"$exists": True}},
+                    projection={"_id": 0, "id": 1, "users": 1, "users_migrated": 1},
+                    batch_size=1,
+                    session=self.session,
+                )
+            async for team in cursor:
+                if await self._users_migrate_team(team=team, prune=prune):
+                    migrated += 1
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
+        return migrated
+
+    async def _users_migrate_team(self, team: dict, prune: bool) -> bool:
+        update = {}
+        migrated = False
+        if not team.get("users_migrated"):
+            users = list(dict.fromkeys(team["users"] or []))
+            await self.crud_team_members.add(team=team["id"], users=users)
+            self.log.info(f"migrated {len(users)} members of team {team['id']}")
+            migrated = True
+            update["$set"] = {"users_migrated": True}
+        if prune:
+            update["$unset"] = {"users": ""}
+        if update:
+            with self._guard(write=True):
+                await self._coll.update_one(
+                    filter={"id": team["id"]},
+                    update=update,
+                    session=self.session,
+                )
+        return migrated
+
     async def resource_exists(
         self,
         _id: str,
@@ -102,10 +394,17 @@ class CrudTeams(CrudMongo):
         limit: typing.Optional[int] = None,
     ) -> TeamGetMulti:
         query = {}
-        self._filter_re(query, "id", _id)
+        if self.crud_team_members is not None:
+            fields = self._team_fields(fields or list(TeamGet.model_fields))
+            teams = None
+            if users:
+                teams = await self.crud_team_members.teams(users=users)
+            self._filter_re(query, "id", _id, list_filter=teams)
+        else:
+            self._filter_re(query, "id", _id)
+            self._filter_re(query, "users", users)
         self._filter_re(query, "ldap_group", ldap_group)
         self._filter_re(query, "permissions", permissions)
-        self._filter_re(query, "users", users)
 
         result = await self._search(
             query=query,
@@ -125,6 +424,21 @@ class CrudTeams(CrudMongo):
     ) -> TeamGet:
         query = {"id": _id}
         data = payload.model_dump()
-
-        result = await self._update(query=query, fields=fields, payload=data)
-        return TeamGet(**result)
+        users = data.pop("users")
+        diff = {}
+        if users is not None:
+            diff = await self._users_apply(query=query, users=users)
+            if diff is None:
+                raise ResourceNotFound(
+                    details=f"Resource {self.resource_type} {query} not found"
+                )
+        team_fields = fields
+        if self.crud_team_members is not None:
+            team_fields = self._team_fields(fields)
+        if any(value is not None for value in data.values()):
+            result = await self._update(query=query, fields=team_fields, payload=data)
+        else:
+            result = await self._get(query=query, fields=team_fields)
+        if self.crud_team_members is not None and "users" in fields:
+            result["users"] = await self.crud_team_members.users(team=_id)
+        return TeamGet(**result, **diff)
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import typing
 
@@ -7,11 +8,14 @@ from passlib.hash import pbkdf2_sha512
 import pymongo
 import pymongo.errors
 
+from dummy_project.circuitbreaker import CircuitBreaker
+
+from dummy_project.crud.cache import DocCache
 from dummy_project.crud.common import CrudMongo
 from dummy_project.crud.ldap import CrudLdap
 
 from dummy_project.errors import AuthenticationError
-from dummy_project.errors import BackendError
+from dummy_project.errors import DuplicateResource
 
 from dummy_project.model.common import DataDelete
 from dummy_project.model.common import sort_order_literal
@@ -21,6 +25,8 @@ from dummy_project.model.users import UserGetMulti
 from dummy_project.model.users import UserPost
 from dummy_project.model.users import UserPut
 
+from dummy_project.singleflight import SingleFlight
+
 
 class CrudUsers(CrudMongo):
     def __init__(
@@ -28,13 +34,25 @@ class CrudUsers(CrudMongo):
         log: logging.Logger,
         coll: AsyncIOMotorCollection,
         crud_ldap: CrudLdap,
+        search_read_preference: typing.Optional[str] = None,
+        breaker: typing.Optional[CircuitBreaker] = None,
+        cache: typing.Optional[DocCache] = None,
+        singleflight: typing.Optional[SingleFlight] = None,
     ):
-        super(CrudUsers, self).__init__(log=log, coll=coll)
+        super(CrudUsers, self).__init__(
+            log=log,
+            coll=coll,
+            search_read_preference=search_read_preference,
+            breaker=breaker,
+            cache=cache,
+            singleflight=singleflight,
+        )
         self._crud_ldap = crud_ldap
 
     async def index_create(self) -> None:
         self.log.info(f"creating {self.resource_type} indices")
         await self.coll.create_index([("id", pymongo.ASCENDING)], unique=True)
+        await self._deleting_index_create()
         self.log.info(f"creating {self.resource_type} indices, done")
 
     @property
@@ -49,10 +67,12 @@ class CrudUsers(CrudMongo):
         user = credentials.user
         password = credentials.password
         try:
-            result = await self._coll.find_one(
-                filter={"id": user, "deleting": False},
-                projection={"password": 1, "backend": 1},
-            )
+            with self._guard():
+                result = await self._coll.find_one(
+                    filter={"id": user, "deleting": False},
+                    projection={"password": 1, "backend": 1},
+                    session=self.session,
+                )
             if not result:
                 await self.check_credentials_ldap_and_create_user(
                     credentials=credentials
@@ -75,27 +95,51 @@ class CrudUsers(CrudMongo):
                     msg="backend mismatch, please contact the administrator"
                 )
             return user
-        except pymongo.errors.ConnectionFailure as err:
-            self.log.error(f"backend error: {err}")
-            raise BackendError()
+        except pymongo.errors.PyMongoError as err:
+            self._backend_error(err)
 
     async def check_credentials_ldap_and_create_user(
         self, credentials: AuthenticatePost
+    ):
+        return await self._collapse(
+            (
+                "ldap_create",
+                credentials.user,
+                hashlib.sha256(credentials.password.encode()).digest(),
+            ),
+            self._check_credentials_ldap_and_create_user,
+            credentials=credentials,
+        )
+
+    async def _check_credentials_ldap_and_create_user(
+        self, credentials: AuthenticatePost
     ):
         ldap_user = await self.crud_ldap.check_user_credentials(
             user=credentials.user,
             password=credentials.password,
         )
-        result = await self.create_external(
-            _id=credentials.user,
-            payload=UserPut(
-                name=f"{ldap_user['givenName'][0]} {ldap_user['sn'][0]}",
-                email=ldap_user["mail"][0],
-                admin=False,
-            ),
-            backend="ldap",
-            fields=["_id"],
-        )
+        try:
+            result = await self.create_external(
+                _id=credentials.user,
+                payload=UserPut(
+                    name=f"{ldap_user['givenName'][0]} {ldap_user['sn'][0]}",
+                    email=ldap_user["mail"][0],
+                    admin=False,
+                ),
+                backend="ldap",
+                fields=["_id"],
+            )
+        except DuplicateResource:
+            with self._guard():
+                existing = await self._coll.find_one(
+                    filter={"id": credentials.user, "deleting": False},
+                    projection={"_id": 1},
+                    session=self.session,
+                )
+            if not existing:
+                raise
+            self.log.info(f"ldap user {credentials.user} created concurrently")
+            result = UserGet()
         return result
 
     async def create(
@@ -139,6 +183,9 @@ class CrudUsers(CrudMongo):
         query = {"id": _id}
         await self._delete_mark(query=query)
 
+    async def deleting(self, grace: float, limit: int) -> list:
+        return await self._deleting(grace=grace, limit=limit)
+
     async def get(
         self,
         _id: str,
@@ -148,6 +195,15 @@ class CrudUsers(CrudMongo):
         result = await self._get(query=query, fields=fields)
         return UserGet(**result)
 
+    async def get_with_obj_id(
+        self,
+        _id: str,
+        fields: list,
+    ) -> tuple[ObjectId, UserGet]:
+        query = {"id": _id}
+        result = await self._get(query=query, fields=fields, obj_id=True)
+        return result.pop("_id"), UserGet(**result)
+
     async def resource_exists(
         self,
         _id: str,
@@ -185,12 +241,53 @@ class CrudUsers(CrudMongo):
     ) -> UserGet:
         query = {"id": _id}
         data = payload.model_dump()
-        if data["password"] is not None:
-            user_orig = await self.get(_id=_id, fields=["backend"])
-            if user_orig.backend == "internal":
-                data["password"] = self._password(data["password"])
-            else:
-                data["passwort"] = None
+        password = data.pop("password")
+        update = {}
+        for k, v in data.items():
+            if v is None:
+                continue
+            update[k] = {"$literal": v}
+        if password is not None:
+            update["password"] = {
+                "$cond": {
+                    "if": {"$eq": ["$backend", "internal"]},
+                    "then": {"$literal": self._password(password)},
+                    "else": "$password",
+                }
+            }
+        if not update:
+            return await self.get(_id=_id, fields=fields)
 
-        result = await self._update(query=query, fields=fields, payload=data)
+        result = await self._update_pipeline(
+            query=query, fields=fields, pipeline=[{"$set": update}]
+        )
         return UserGet(**result)
+
+    async def upsert_external(
+        self,
+        _id: str,
+        payload: UserPut,
+        backend: str,
+        backend_override: bool,
+    ) -> typing.Optional[str]:
+        query = {"id": _id, "deleting": False}
+        created = {"$eq": [{"$type": "$backend"}, "missing"]}
+        update = {}
+        for k, v in payload.model_dump().items():
+            if v is None or k == "password":
+                continue
+            update[k] = {"$cond": [created, {"$literal": v}, f"${k}"]}
+        if backend_override:
+            update["backend"] = {"$literal": backend}
+        else:
+            update["backend"] = {"$cond": [created, {"$literal": backend}, "$backend"]}
+        result = await self._find_one_and_update(
+            query=query,
+            update=[{"$set": update}],
+            fields=["backend"],
+            upsert=True,
+            return_document=pymongo.ReturnDocument.BEFORE,
+        )
+        if result is None:
+            return None
+        return result["backend"]
@@ -0,0 +1,60 @@
+import asyncio
+import contextvars
+import time
+import typing
+
+from dummy_project.errors import DeadlineExceeded
+
+
+class Deadline:
+    __slots__ = ("at", "explicit")
+
+    def __init__(self, at: float, explicit: bool):
+        self.at = at
+        self.explicit = explicit
+
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+def start(timeout: float, explicit: bool = False) -> contextvars.Token:
+    return _deadline.set(Deadline(at=time.monotonic() + timeout, explicit=explicit))
+
+
+def reset(token: contextvars.Token) -> None:
+    _deadline.reset(token)
+
+
+def route_default(timeout: float) -> None:
+    current = _deadline.get()
+    if current is None:
+        _deadline.set(Deadline(at=time.monotonic() + timeout, explicit=False))
+    elif not current.explicit:
+        current.at = min(current.at, time.monotonic() + timeout)
+
+
+def remaining() -> typing.Optional[float]:
+    current = _deadline.get()
+    if current is None:
+        return None
+    return max(0.0, current.at - time.monotonic())
+
+
+def exceeded() -> bool:
+    current = _deadline.get()
+    return current is not None and time.monotonic() >= current.at
+
+
+def check() -> None:
+    if exceeded():
+        raise DeadlineExceeded
+
+
+async def wait_for(aw: typing.Awaitable):
+    timeout = remaining()
+    if timeout is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, timeout=timeout)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded
@@ -6,6 +6,20 @@ class AuthenticationError(HTTPException):
         super(AuthenticationError, self).__init__(status_code=401, detail=msg)
 
 
+class ConflictError(HTTPException):
+    def __init__(self):
+        super(ConflictError, self).__init__(
+            status_code=409, detail="Concurrent modification, please retry"
+        )
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super(DeadlineExceeded, self).__init__(
+            status_code=504, detail="Request deadline exceeded"
+        )
+
+
 class DuplicateResource(HTTPException):
     def __init__(self):
         super(DuplicateResource, self).__init__(
@@ -13,6 +27,24 @@ class DuplicateResource(HTTPException):
         )
 
 
+class OverloadError(HTTPException):
+    def __init__(self):
+        super(OverloadError, self).__init__(
+            status_code=503,
+            detail="Service overloaded, please retry later",
+            headers={"Retry-After": "1"},
+        )
+
+
+class RateLimitError(HTTPException):
+    def __init__(self, retry_after: int):
+        super(RateLimitError, self).__init__(
+            status_code=429,
+            detail="Too Many Requests",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
 class ResourceNotFound(HTTPException):
     def __init__(self, details=None):
         if not details:
@@ -20,6 +52,15 @@ class ResourceNotFound(HTTPException):
         super(ResourceNotFound, self).__init__(status_code=404, detail=details)
 
 
+class BackendUnavailable(HTTPException):
+    def __init__(self, retry_after: int):
+        super(BackendUnavailable, self).__init__(
+            status_code=503,
+            detail="Backend unavailable, please retry later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
 class BackendError(HTTPException):
     def __init__(self):
         super(BackendError, self).__init__(
@@ -56,10 +97,13 @@ class AdminError(HTTPException):
 
 
 class CredentialError(HTTPException):
+    def __init__(self, details="Invalid or no credentials"):
+        super(CredentialError, self).__init__(status_code=403, detail=details)
+
+
+class CredentialExpiredError(CredentialError):
     def __init__(self):
-        super(CredentialError, self).__init__(
-            status_code=403, detail="Invalid or no credentials"
-        )
+        super(CredentialExpiredError, self).__init__(details="Credential expired")
 
 
 class SessionCredentialError(HTTPException):
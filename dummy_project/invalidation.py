@@ -0,0 +1,291 @@
+import asyncio
+import datetime
+import logging
+import typing
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+import pymongo
+import pymongo.errors
+
+from dummy_project.metrics import Metrics
+
+
+class InvalidationBus:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        mongo_db: AsyncIOMotorDatabase,
+        resources: list[str],
+        ignored_fields: typing.Optional[dict[str, list[str]]] = None,
+        enabled: bool = True,
+        mode: str = "auto",
+        poll_interval: float = 1.0,
+        retry_interval: float = 5.0,
+        versions: str = "cache_versions",
+    ):
+        self._enabled = enabled
+        self._ignored_fields = ignored_fields or {}
+        self._log = log
+        self._metrics = metrics
+        self._mode = mode
+        self._mongo_db = mongo_db
+        self._pending = set()
+        self._pending_event = asyncio.Event()
+        self._poll_interval = poll_interval
+        self._polling = mode == "poll"
+        self._resources = resources
+        self._retry_interval = retry_interval
+        self._stopping = asyncio.Event()
+        self._subscribers = {}
+        self._tasks = []
+        self._token = None
+        self._versions = mongo_db[versions]
+        self._versions_seen = None
+        self._watch_task = None
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def ignored_fields(self):
+        return self._ignored_fields
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def mongo_db(self):
+        return self._mongo_db
+
+    @property
+    def poll_interval(self):
+        return self._poll_interval
+
+    @property
+    def polling(self):
+        return self._polling
+
+    @property
+    def resources(self):
+        return self._resources
+
+    @property
+    def retry_interval(self):
+        return self._retry_interval
+
+    @property
+    def versions(self):
+        return self._versions
+
+    def subscribe(
+        self, resource: str, callback: typing.Callable[[typing.Any], None]
+    ) -> None:
+        self._subscribers.setdefault(resource, []).append(callback)
+
+    def written(self, resource: str) -> None:
+        if not self.polling:
+            return
+        self._pending.add(resource)
+        self._pending_event.set()
+
+    def _publish(
+        self,
+        resource: str,
+        source: str,
+        changed: typing.Optional[datetime.datetime] = None,
+        doc_id: typing.Any = None,
+    ) -> None:
+        for callback in self._subscribers.get(resource, []):
+            callback(doc_id)
+        self.metrics.inc("cache_invalidations_total", resource=resource, source=source)
+        if changed is not None:
+            lag = datetime.datetime.utcnow() - changed
+            self.metrics.observe(
+                "cache_invalidation_lag_seconds",
+                max(lag.total_seconds(), 0.0),
+                source=source,
+            )
+
+    def _publish_all(self, source: str) -> None:
+        for resource in self.resources:
+            self._publish(resource=resource, source=source)
+
+    def _ignored(self, resource: str, change: dict) -> bool:
+        fields = self.ignored_fields.get(resource)
+        description = change.get("updateDescription")
+        if change.get("operationType") != "update" or not fields or not description:
+            return False
+        if description.get("removedFields") or description.get("truncatedArrays"):
+            return False
+        updated = description.get("updatedFields") or {}
+        return all(field.split(".")[0] in fields for field in updated)
+
+    def _change(self, change: dict) -> None:
+        resource = change.get("ns", {}).get("coll")
+        if resource not in self.resources:
+            self._publish_all(source="change_stream")
+            return
+        if change.get("operationType") == "insert":
+            return
+        if self._ignored(resource, change):
+            self.metrics.inc("cache_invalidations_ignored_total", resource=resource)
+            return
+        self._publish(
+            resource=resource,
+            source="change_stream",
+            changed=change.get("wallTime"),
+            doc_id=change.get("documentKey", {}).get("_id"),
+        )
+
+    async def _watch(self) -> None:
+        pipeline = [
+            {
+                "$match": {
+                    "ns.coll": {"$in": self.resources},
+                    "operationType": {"$ne": "insert"},
+                }
+            },
+            {
+                "$project": {
+                    "ns": 1,
+                    "documentKey": 1,
+                    "operationType": 1,
+                    "updateDescription": 1,
+                    "wallTime": 1,
+                }
+            },
+        ]
+        async with self.mongo_db.watch(
+            pipeline=pipeline, resume_after=self._token
+        ) as stream:
+            self.log.info(f"watching {self.resources} for cache invalidations")
+            async for change in stream:
+                self._token = stream.resume_token
+                self._change(change)
+
+    async def _watch_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self._watch()
+            except pymongo.errors.OperationFailure as err:
+                if err.code in (260, 286):
+                    self.log.warning(f"change stream resume failed: {err}")
+                    self._token = None
+                elif self.mode == "auto" and err.code == 40573:
+                    self.log.warning(
+                        f"change streams unavailable, polling cache versions: {err}"
+                    )
+                    self._polling = True
+                    self._tasks.append(asyncio.create_task(self._poll_loop()))
+                    self._tasks.append(asyncio.create_task(self._bump_loop()))
+                    return
+                else:
+                    self.log.error(f"change stream failed: {err}")
+            except pymongo.errors.PyMongoError as err:
+                self.log.error(f"change stream failed: {err}")
+            self._publish_all(source="change_stream")
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.retry_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _bump(self) -> None:
+        pending, self._pending = self._pending, set()
+        now = datetime.datetime.utcnow()
+        try:
+            await self.versions.bulk_write(
+                [
+                    pymongo.UpdateOne(
+                        filter={"resource": resource},
+                        update={"$inc": {"version": 1}, "$set": {"updated": now}},
+                        upsert=True,
+                    )
+                    for resource in pending
+                ],
+                ordered=False,
+            )
+        except pymongo.errors.PyMongoError as err:
+            self.log.error(f"bumping cache versions failed, retrying: {err}")
+            self._pending |= pending
+
+    async def _bump_loop(self) -> None:
+        while not self._stopping.is_set():
+            await self._pending_event.wait()
+            self._pending_event.clear()
+            if self._pending:
+                await self._bump()
+                if self._pending:
+                    await asyncio.sleep(self.retry_interval)
+                    self._pending_event.set()
+        if self._pending:
+            await self._bump()
+
+    async def _poll(self) -> None:
+        cursor = self.versions.find(
+            filter={"resource": {"$in": self.resources}},
+            projection={"_id": 0, "resource": 1, "version": 1, "updated": 1},
+        )
+        versions = {}
+        async for item in cursor:
+            resource = item["resource"]
+            versions[resource] = item["version"]
+            if self._versions_seen is None:
+                continue
+            if self._versions_seen.get(resource) != item["version"]:
+                self._publish(
+                    resource=resource, source="poll", changed=item.get("updated")
+                )
+        self._versions_seen = versions
+
+    async def _poll_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await self._poll()
+            except pymongo.errors.PyMongoError as err:
+                self.log.error(f"polling cache versions failed: {err}")
+                self._versions_seen = None
+                self._publish_all(source="poll")
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(), timeout=self.poll_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def index_create(self) -> None:
+        self.log.info(f"creating {self.versions.name} indices")
+        await self.versions.create_index([("resource", pymongo.ASCENDING)], unique=True)
+        self.log.info(f"creating {self.versions.name} indices, done")
+
+    def start(self) -> None:
+        if not self.enabled or not self.resources:
+            self.log.info("cache invalidation bus disabled")
+            return
+        if self.polling:
+            self._tasks.append(asyncio.create_task(self._poll_loop()))
+            self._tasks.append(asyncio.create_task(self._bump_loop()))
+        else:
+            self._watch_task = asyncio.create_task(self._watch_loop())
+            self._tasks.append(self._watch_task)
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        self._pending_event.set()
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+
+import bonsai.errors
+from fastapi import HTTPException
+
+from dummy_project.crud.lease import CrudLease
+from dummy_project.crud.ldap import CrudLdap
+from dummy_project.crud.teams import CrudTeams
+
+import dummy_project.deadline as deadline
+
+from dummy_project.metrics import Metrics
+
+
+class LdapTeamSync:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        crud_lease: CrudLease,
+        crud_ldap: CrudLdap,
+        crud_teams: CrudTeams,
+        enabled: bool = True,
+        interval: float = 300.0,
+        concurrency: int = 4,
+        jitter: float = 30.0,
+        lease_ttl: float = 900.0,
+        full_interval: int = 12,
+        timeout: float = 300.0,
+    ):
+        self._concurrency = concurrency
+        self._crud_lease = crud_lease
+        self._crud_ldap = crud_ldap
+        self._crud_teams = crud_teams
+        self._enabled = enabled
+        self._full_interval = full_interval
+        self._holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._interval = interval
+        self._jitter = jitter
+        self._lease_lost = asyncio.Event()
+        self._lease_ttl = lease_ttl
+        self._log = log
+        self._metrics = metrics
+        self._runs = 0
+        self._stopping = asyncio.Event()
+        self._task = None
+        self._timeout = timeout
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    @property
+    def crud_lease(self):
+        return self._crud_lease
+
+    @property
+    def crud_ldap(self):
+        return self._crud_ldap
+
+    @property
+    def crud_teams(self):
+        return self._crud_teams
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def full_interval(self):
+        return self._full_interval
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def jitter(self):
+        return self._jitter
+
+    @property
+    def lease_ttl(self):
+        return self._lease_ttl
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    async def _sync_team(
+        self,
+        team: dict,
+        full: bool,
+        semaphore: asyncio.Semaphore,
+        memo: dict,
+        stats: dict,
+    ) -> None:
+        await asyncio.sleep(random.uniform(0, self.jitter))
+        async with semaphore:
+            if self._stopping.is_set() or self._lease_lost.is_set():
+                return
+            start = time.monotonic()
+            token = deadline.start(timeout=self.timeout)
+            try:
+                changed = await self.crud_ldap.get_group_changed(
+                    group=team["ldap_group"]
+                )
+                if not full and changed and changed == team.get("ldap_changed"):
+                    result = "unchanged"
+                else:
+                    users = await self.crud_ldap.get_logins_from_group(
+                        group=team["ldap_group"], memo=memo
+                    )
+                    diff = await self.crud_teams.ldap_sync(
+                        _id=team["id"],
+                        ldap_group=team["ldap_group"],
+                        users=users,
+                        ldap_changed=changed,
+                    )
+                    result = "synced" if diff is not None else "skipped"
+                    for key, value in (diff or {}).items():
+                        self.metrics.inc(f"ldap_sync_{key}_total", value)
+            except (HTTPException, bonsai.errors.LDAPError) as err:
+                self.log.warning(f"ldap sync of team {team['id']} failed: {err}")
+                result = "failed"
+            except Exception as err:
+                self.log.exception(f"ldap sync of team {team['id']} failed: {err}")
+                result = "failed"
+            finally:
+                deadline.reset(token)
+            stats[result] = stats.get(result, 0) + 1
+            self.metrics.inc("ldap_sync_teams_total", result=result)
+            self.metrics.observe("ldap_sync_team_seconds", time.monotonic() - start)
+
+    async def run(self) -> dict:
+        full = self._runs % self.full_interval == 0
+        self._runs += 1
+        start = time.monotonic()
+        stats = {}
+        teams = await self.crud_teams.ldap_teams()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        memo = {}
+        await asyncio.gather(
+            *(self._sync_team(team, full, semaphore, memo, stats) for team in teams)
+        )
+        duration = time.monotonic() - start
+        self.metrics.observe("ldap_sync_run_seconds", duration)
+        self.metrics.set("ldap_sync_last_run_timestamp", time.time())
+        self.log.info(
+            f"ldap sync {'full' if full else 'incremental'} run of {len(teams)} "
+            f"teams done in {duration:.2f} seconds: {stats}"
+        )
+        return stats
+
+    async def _lease_renew(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                held = await self.crud_lease.acquire(
+                    name="ldap_sync", holder=self._holder, ttl=self.lease_ttl
+                )
+            except Exception as err:
+                self.log.warning(f"renewing ldap sync lease failed: {err}")
+                continue
+            if not held:
+                self.log.error("ldap sync lease lost, skipping remaining teams")
+                self._lease_lost.set()
+                return
+
+    async def _run_leased(self) -> None:
+        self._lease_lost.clear()
+        renew = asyncio.create_task(self._lease_renew())
+        try:
+            await self.run()
+        finally:
+            renew.cancel()
+
+    async def _sync_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(),
+                    timeout=self.interval + random.uniform(0, self.jitter),
+                )
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping.is_set():
+                break
+            try:
+                if not await self.crud_lease.acquire(
+                    name="ldap_sync", holder=self._holder, ttl=self.lease_ttl
+                ):
+                    continue
+                await self._run_leased()
+            except HTTPException as err:
+                self.log.error(f"ldap sync run failed: {err.detail}")
+                self.metrics.inc("ldap_sync_runs_failed_total")
+            except Exception as err:
+                self.log.exception(f"ldap sync run failed: {err}")
+                self.metrics.inc("ldap_sync_runs_failed_total")
+
+    def start(self) -> None:
+        if not self.enabled:
+            self.log.info("ldap team sync disabled")
+            return
+        self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if not self._task:
+            return
+        await self._task
+        self._task = None
+        try:
+            await self.crud_lease.release(name="ldap_sync", holder=self._holder)
+        except HTTPException as err:
+            self.log.error(f"releasing ldap sync lease failed: {err.detail}")
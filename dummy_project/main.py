@@ -1,18 +1,22 @@
 from contextlib import asynccontextmanager
+import functools
 import logging
 import random
 import string
 import sys
 import time
+import typing
 
 from authlib.integrations.starlette_client import OAuth
-import bonsai.asyncio
+from bson import json_util
+import bonsai
 import httpx
 from fastapi import FastAPI
 from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.responses import HTMLResponse
+from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse
 from fastapi_versionizer import Versionizer
-from motor.motor_asyncio import AsyncIOMotorClient
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from starlette.middleware.sessions import SessionMiddleware
 import uvicorn
@@ -20,22 +24,67 @@ import uvicorn
 import dummy_project.api
 import dummy_project.oauth
 
+from dummy_project.bootstrap import setup_logging
+from dummy_project.bootstrap import setup_mongodb
+from dummy_project.bootstrap import setup_teams
+
+from dummy_project.admission import Admission
+from dummy_project.admission import AdmissionClass
 from dummy_project.authorize import Authorize
+from dummy_project.circuitbreaker import CircuitBreaker
+from dummy_project.circuitbreaker import CircuitBreakers
 
 from dummy_project.config import Settings
+from dummy_project.config import Admission as SettingsAdmission
+from dummy_project.config import Cache as SettingsCache
+from dummy_project.config import CircuitBreakers as SettingsCircuitBreakers
+from dummy_project.config import Http as SettingsHttp
 from dummy_project.config import Ldap as SettingsLdap
+from dummy_project.config import Mongodb as SettingsMongodb
 from dummy_project.config import OAuth as SettingsOAuth
+from dummy_project.config import RateLimit as SettingsRateLimit
+from dummy_project.config import SharedCache as SettingsSharedCache
+from dummy_project.config import SingleFlight as SettingsSingleFlight
 
+from dummy_project.crud.audit import CrudAudit
+from dummy_project.crud.cache import DocCache
+from dummy_project.crud.common import mongo_session
 from dummy_project.crud.credentials import CrudCredentials
+from dummy_project.crud.jobs import CrudJobs
+from dummy_project.crud.lease import CrudLease
 from dummy_project.crud.ldap import CrudLdap
+from dummy_project.crud.ldap_pool import LdapPool
+from dummy_project.crud.ldap_pool import LdapPools
 from dummy_project.crud.oauth import CrudOAuthGitHub
-from dummy_project.crud.teams import CrudTeams
+from dummy_project.crud.oauth import CrudOAuthOIDC
 from dummy_project.crud.users import CrudUsers
 
+import dummy_project.deadline as deadline
+
 from dummy_project.model.users import UserPost
 
 from dummy_project.errors import ResourceNotFound
 
+from dummy_project.invalidation import InvalidationBus
+
+from dummy_project.ldapsync import LdapTeamSync
+
+from dummy_project.metrics import Metrics
+
+from dummy_project.ratelimit import RateLimiter
+from dummy_project.ratelimit import RateLimits
+
+from dummy_project.reaper import DeleteReaper
+
+from dummy_project.sharedcache import SharedAuthCache
+from dummy_project.sharedcache import SharedTable
+
+from dummy_project.singleflight import SingleFlight
+
+from dummy_project.teamjobs import TeamJobWorker
+
+from dummy_project.userdelete import UserDeletion
+
 
 settings = Settings()
 
@@ -46,23 +95,78 @@ async def lifespan(app: FastAPI):
         settings.app.loglevel,
     )
 
-    http = httpx.AsyncClient()
+    metrics = Metrics()
+    app.state.metrics = metrics
+
+    http = setup_http(log=log, settings_http=settings.http)
 
     ldap_pool = await setup_ldap(
         log=log,
+        metrics=metrics,
         settings_ldap=settings.ldap,
     )
 
     log.info("adding routes")
     mongo_db = setup_mongodb(
         log=log,
-        database=settings.mongodb.database,
-        url=settings.mongodb.url,
+        settings_mongodb=settings.mongodb,
+    )
+    app.state.mongo_client = mongo_db.client
+
+    circuitbreakers = setup_circuitbreakers(
+        log=log,
+        metrics=metrics,
+        settings_circuitbreaker=settings.circuitbreaker,
+        oauth_settings=settings.oauth,
     )
 
+    caches = setup_caches(
+        log=log,
+        metrics=metrics,
+        settings_cache=settings.cache,
+    )
+
+    singleflights = setup_singleflights(
+        log=log,
+        metrics=metrics,
+        settings_singleflight=settings.singleflight,
+    )
+
+    shared_cache = setup_shared_cache(
+        log=log,
+        metrics=metrics,
+        settings_mongodb=settings.mongodb,
+        settings_shared_cache=settings.sharedcache,
+    )
+
+    invalidation_resources = list(caches)
+    if shared_cache is not None:
+        invalidation_resources += ["users", "users_credentials"]
+    invalidation_bus = InvalidationBus(
+        log=log,
+        metrics=metrics,
+        mongo_db=mongo_db,
+        resources=sorted(set(invalidation_resources)),
+        ignored_fields={"users_credentials": list(CrudCredentials.USAGE_FIELDS)},
+        enabled=settings.invalidation.enabled,
+        mode=settings.invalidation.mode,
+        poll_interval=settings.invalidation.pollinterval,
+    )
+    for resource, cache in caches.items():
+        invalidation_bus.subscribe(resource, cache.invalidate)
+    if shared_cache is not None:
+        invalidation_bus.subscribe("users", shared_cache.invalidate_users)
+        invalidation_bus.subscribe(
+            "users_credentials", shared_cache.invalidate_credentials
+        )
+    if invalidation_bus.resources and settings.invalidation.enabled:
+        await invalidation_bus.index_create()
+    invalidation_bus.start()
+
     oauth_providers = setup_oauth_providers(
         log=log,
         http=http,
+        circuitbreakers=circuitbreakers,
         oauth_settings=settings.oauth,
     )
 
@@ -71,13 +175,36 @@ async def lifespan(app: FastAPI):
         ldap_base_dn=settings.ldap.basedn,
         ldap_bind_dn=settings.ldap.binddn,
         ldap_pool=ldap_pool,
-        ldap_url=settings.ldap.url,
         ldap_user_pattern=settings.ldap.userpattern,
+        breaker=circuitbreakers.breakers["ldap"],
+        nested_groups=settings.ldap.nestedgroups,
+        nested_concurrency=settings.ldap.nestedconcurrency,
+        matching_rule_in_chain=settings.ldap.matchingruleinchain,
+        batch_size=settings.ldap.batchsize,
+        page_size=settings.ldap.pagesize,
+        singleflight=singleflights.get("ldap"),
     )
 
-    crud_teams = CrudTeams(
+    crud_audit = CrudAudit(
         log=log,
-        coll=mongo_db["teams"],
+        coll=mongo_db["audit"],
+        metrics=metrics,
+        enabled=settings.audit.enabled,
+        batch_size=settings.audit.batchsize,
+        flush_interval=settings.audit.flushinterval,
+        queue_size=settings.audit.queuesize,
+        retention=settings.audit.retention,
+    )
+    await crud_audit.index_create()
+    crud_audit.start()
+
+    crud_teams = await setup_teams(
+        log=log,
+        mongo_db=mongo_db,
+        breaker=circuitbreakers.breakers["mongodb"],
+        cache=caches.get("teams"),
+        settings_mongodb=settings.mongodb,
+        settings_teams=settings.teams,
     )
     await crud_teams.index_create()
 
@@ -85,30 +212,146 @@ async def lifespan(app: FastAPI):
         log=log,
         coll=mongo_db["users"],
         crud_ldap=crud_ldap,
+        search_read_preference=settings.mongodb.searchreadpreference,
+        breaker=circuitbreakers.breakers["mongodb"],
+        cache=caches.get("users"),
+        singleflight=singleflights.get("users"),
     )
     await crud_users.index_create()
 
     crud_users_credentials = CrudCredentials(
         log=log,
         coll=mongo_db["users_credentials"],
+        usage_flush_interval=settings.credentials.usageflushinterval,
+        search_read_preference=settings.mongodb.searchreadpreference,
+        breaker=circuitbreakers.breakers["mongodb"],
+        cache=caches.get("users_credentials"),
+        shared_cache=shared_cache,
+        singleflight=singleflights.get("users_credentials"),
     )
     await crud_users_credentials.index_create()
+    crud_users_credentials.start()
+
+    user_deletion = UserDeletion(
+        log=log,
+        metrics=metrics,
+        client=mongo_db.client,
+        crud_teams=crud_teams,
+        crud_users=crud_users,
+        crud_users_credentials=crud_users_credentials,
+        transactions=settings.mongodb.transactions,
+    )
+
+    crud_lease = CrudLease(
+        log=log,
+        coll=mongo_db["leases"],
+        breaker=circuitbreakers.breakers["mongodb"],
+    )
+    await crud_lease.index_create()
+
+    ldap_team_sync = LdapTeamSync(
+        log=log,
+        metrics=metrics,
+        crud_lease=crud_lease,
+        crud_ldap=crud_ldap,
+        crud_teams=crud_teams,
+        enabled=settings.ldapsync.enabled and ldap_pool is not None,
+        interval=settings.ldapsync.interval,
+        concurrency=settings.ldapsync.concurrency,
+        jitter=settings.ldapsync.jitter,
+        lease_ttl=settings.ldapsync.leasettl,
+        full_interval=settings.ldapsync.fullinterval,
+        timeout=settings.ldapsync.timeout,
+    )
+    ldap_team_sync.start()
+
+    delete_reaper = DeleteReaper(
+        log=log,
+        metrics=metrics,
+        crud_lease=crud_lease,
+        crud_teams=crud_teams,
+        crud_users=crud_users,
+        user_deletion=user_deletion,
+        enabled=settings.reaper.enabled,
+        interval=settings.reaper.interval,
+        grace=settings.reaper.grace,
+        batch_size=settings.reaper.batchsize,
+        lease_ttl=settings.reaper.leasettl,
+    )
+    delete_reaper.start()
+
+    crud_jobs = CrudJobs(
+        log=log,
+        coll=mongo_db["jobs"],
+        retention=settings.teamjobs.retention,
+        breaker=circuitbreakers.breakers["mongodb"],
+    )
+    await crud_jobs.index_create()
+
+    team_job_worker = TeamJobWorker(
+        log=log,
+        metrics=metrics,
+        crud_jobs=crud_jobs,
+        crud_ldap=crud_ldap,
+        crud_teams=crud_teams,
+        enabled=ldap_pool is not None,
+        concurrency=settings.teamjobs.concurrency,
+        heartbeat_interval=settings.teamjobs.heartbeatinterval,
+        max_attempts=settings.teamjobs.maxattempts,
+        poll_interval=settings.teamjobs.pollinterval,
+        timeout=settings.teamjobs.timeout,
+    )
+    team_job_worker.start()
+
+    ratelimits = setup_ratelimits(
+        log=log,
+        metrics=metrics,
+        mongo_db=mongo_db,
+        settings_ratelimit=settings.ratelimit,
+    )
+    await ratelimits.index_create()
+    ratelimits.start()
+
+    for crud in (crud_teams, crud_users, crud_users_credentials):
+        if crud.resource_type in invalidation_bus.resources:
+            crud.on_write(
+                functools.partial(invalidation_bus.written, crud.resource_type)
+            )
+    if shared_cache is not None:
+        crud_users.on_write(shared_cache.invalidate_users)
+        crud_users_credentials.on_write(shared_cache.invalidate_credentials)
 
     authorize = Authorize(
         log=log,
+        crud_audit=crud_audit,
         crud_teams=crud_teams,
         crud_users=crud_users,
         crud_users_credentials=crud_users_credentials,
+        ratelimits=ratelimits,
+        shared_cache=shared_cache,
+        singleflight=singleflights.get("authorize"),
+    )
+
+    admission = setup_admission(
+        log=log,
+        metrics=metrics,
+        settings_admission=settings.admission,
     )
 
     api_router = dummy_project.api.Api(
         log=log,
+        admission=admission,
         authorize=authorize,
+        crud_audit=crud_audit,
+        crud_jobs=crud_jobs,
         crud_ldap=crud_ldap,
         crud_teams=crud_teams,
         crud_users=crud_users,
         crud_users_credentials=crud_users_credentials,
         http=http,
+        ratelimits=ratelimits,
+        team_job_worker=team_job_worker,
+        user_deletion=user_deletion,
     )
     app.include_router(api_router.router)
     # versionize(
@@ -126,7 +369,13 @@ async def lifespan(app: FastAPI):
     ).versionize()
 
     oauth_router = dummy_project.oauth.Oauth(
-        log=log, crud_users=crud_users, http=http, oauth_providers=oauth_providers
+        log=log,
+        admission=admission,
+        crud_audit=crud_audit,
+        crud_users=crud_users,
+        http=http,
+        oauth_providers=oauth_providers,
+        ratelimits=ratelimits,
     )
     app.include_router(oauth_router.router)
 
@@ -138,9 +387,61 @@ async def lifespan(app: FastAPI):
             swagger_ui_parameters={"defaultModelsExpandDepth": -1},
         )
 
+    @app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+    def get_metrics() -> PlainTextResponse:
+        return PlainTextResponse(metrics.render())
+
+    @app.get("/ready", response_class=JSONResponse, include_in_schema=False)
+    def get_ready() -> JSONResponse:
+        ready = circuitbreakers.ready()
+        return JSONResponse(
+            {"ready": ready, "breakers": circuitbreakers.states()},
+            status_code=200 if ready else 503,
+        )
+
     log.info("adding routes, done")
     await setup_admin_user(log=log, crud_users=crud_users)
     yield
+    log.info("shutting down")
+    await team_job_worker.stop()
+    await invalidation_bus.stop()
+    await ldap_team_sync.stop()
+    await delete_reaper.stop()
+    await ratelimits.stop()
+    await crud_users_credentials.stop()
+    await crud_audit.stop()
+    if ldap_pool:
+        await ldap_pool.close()
+    await http.aclose()
+    if shared_cache is not None:
+        await shared_cache.close()
+    log.info("shutting down, done")
+
+
+def setup_admission(
+    log: logging.Logger,
+    metrics: Metrics,
+    settings_admission: SettingsAdmission,
+) -> Admission:
+    log.info("setting up admission control")
+    classes = {}
+    for name in ("auth", "ldap", "search", "read", "write"):
+        settings_class = getattr(settings_admission, name)
+        classes[name] = AdmissionClass(
+            log=log,
+            metrics=metrics,
+            name=name,
+            concurrency=settings_class.concurrency,
+            queue_size=settings_class.queuesize,
+            deadline=settings_class.deadline,
+            timeout=settings_class.timeout,
+        )
+    return Admission(
+        log=log,
+        metrics=metrics,
+        classes=classes,
+        enabled=settings_admission.enabled,
+    )
 
 
 async def setup_admin_user(log: logging.Logger, crud_users: CrudUsers):
@@ -161,42 +462,200 @@ async def setup_admin_user(log: logging.Logger, crud_users: CrudUsers):
         log.info("creating admin user, done")
 
 
-async def setup_ldap(log: logging.Logger, settings_ldap: SettingsLdap):
-    if not settings_ldap.url:
+async def setup_ldap(
+    log: logging.Logger, metrics: Metrics, settings_ldap: SettingsLdap
+) -> typing.Optional[LdapPools]:
+    urls = list(settings_ldap.urls)
+    if settings_ldap.url and settings_ldap.url not in urls:
+        urls.insert(0, settings_ldap.url)
+    if not urls:
         log.info("ldap not configured")
         return
-    log.info(f"setting up ldap with {settings_ldap.url} as a backend")
+    log.info(f"setting up ldap with {', '.join(urls)} as a backend")
     if not settings_ldap.binddn:
         log.fatal("ldap binddn not configured")
         sys.exit(1)
     if not settings_ldap.password:
         log.fatal("ldap password not configured")
         sys.exit(1)
-    client = bonsai.LDAPClient(settings_ldap.url)
-    client.set_credentials("SIMPLE", settings_ldap.binddn, settings_ldap.password)
-    pool = bonsai.asyncio.AIOConnectionPool(client=client, maxconn=30)
+    pools = []
+    for url in urls:
+        client = bonsai.LDAPClient(url)
+        client.set_credentials("SIMPLE", settings_ldap.binddn, settings_ldap.password)
+        pools.append(
+            LdapPool(
+                log=log,
+                metrics=metrics,
+                client=client,
+                name=url,
+                min_size=settings_ldap.poolminsize,
+                max_size=settings_ldap.poolmaxsize,
+                max_idle=settings_ldap.poolmaxidle,
+                health_check_interval=settings_ldap.poolhealthcheck,
+                checkout_timeout=settings_ldap.poolcheckouttimeout,
+                max_failures=settings_ldap.serverfailures,
+                retry_down=settings_ldap.serverretry,
+            )
+        )
+    pool = LdapPools(
+        log=log,
+        metrics=metrics,
+        pools=pools,
+        hedge=settings_ldap.hedge,
+        hedge_delay=settings_ldap.hedgedelay,
+        hedge_min_delay=settings_ldap.hedgemindelay,
+        hedge_percentile=settings_ldap.hedgepercentile,
+    )
     await pool.open()
     return pool
 
 
-def setup_logging(log_level):
-    log = logging.getLogger("uvicorn")
-    log.info(f"setting loglevel to: {log_level}")
-    log.setLevel(log_level)
-    return log
+def setup_http(log: logging.Logger, settings_http: SettingsHttp) -> httpx.AsyncClient:
+    log.info("setting up http client")
+    return httpx.AsyncClient(
+        http2=settings_http.http2,
+        limits=httpx.Limits(
+            max_connections=settings_http.maxconnections,
+            max_keepalive_connections=settings_http.maxkeepalive,
+            keepalive_expiry=settings_http.keepaliveexpiry,
+        ),
+        timeout=httpx.Timeout(
+            connect=settings_http.timeoutconnect,
+            pool=settings_http.timeoutpool,
+            read=settings_http.timeoutread,
+            write=settings_http.timeoutwrite,
+        ),
+    )
 
 
-def setup_mongodb(log: logging.Logger, database: str, url: str) -> AsyncIOMotorDatabase:
-    log.info("setting up mongodb client")
-    pool = AsyncIOMotorClient(url)
-    db = pool.get_database(database)
-    log.info("setting up mongodb client, done")
-    return db
+def setup_ratelimits(
+    log: logging.Logger,
+    metrics: Metrics,
+    mongo_db: AsyncIOMotorDatabase,
+    settings_ratelimit: SettingsRateLimit,
+) -> RateLimits:
+    log.info("setting up rate limits")
+    coll = None
+    if settings_ratelimit.sharded:
+        log.info("rate limits are shared between workers")
+        coll = mongo_db["ratelimit"]
+    limiters = {}
+    for name in ("user", "client", "credential", "credentialclient"):
+        bucket = getattr(settings_ratelimit, name)
+        limiters[name] = RateLimiter(
+            log=log,
+            metrics=metrics,
+            name=name,
+            rate=bucket.rate,
+            burst=bucket.burst,
+            max_keys=settings_ratelimit.maxkeys,
+            coll=coll,
+            window=settings_ratelimit.window,
+        )
+    return RateLimits(
+        log=log,
+        metrics=metrics,
+        limiters=limiters,
+        enabled=settings_ratelimit.enabled,
+        sync_interval=settings_ratelimit.syncinterval,
+        trusted_proxies=settings_ratelimit.trustedproxies,
+    )
+
+
+def setup_caches(
+    log: logging.Logger,
+    metrics: Metrics,
+    settings_cache: dict[str, SettingsCache],
+) -> dict[str, DocCache]:
+    caches = {}
+    for resource, config in settings_cache.items():
+        if not config.enabled:
+            continue
+        log.info(f"setting up document cache for {resource}")
+        caches[resource] = DocCache(
+            log=log,
+            metrics=metrics,
+            name=resource,
+            max_entries=config.maxentries,
+            ttl=config.ttl,
+        )
+    return caches
+
+
+def setup_singleflights(
+    log: logging.Logger,
+    metrics: Metrics,
+    settings_singleflight: SettingsSingleFlight,
+) -> dict[str, SingleFlight]:
+    if not settings_singleflight.enabled:
+        return {}
+    log.info("setting up request coalescing")
+    return {
+        name: SingleFlight(
+            log=log,
+            metrics=metrics,
+            name=name,
+            timeout=settings_singleflight.timeout,
+        )
+        for name in ("authorize", "ldap", "users", "users_credentials")
+    }
+
+
+def setup_shared_cache(
+    log: logging.Logger,
+    metrics: Metrics,
+    settings_mongodb: SettingsMongodb,
+    settings_shared_cache: SettingsSharedCache,
+) -> typing.Optional[SharedAuthCache]:
+    if not settings_shared_cache.enabled:
+        return None
+    log.info("setting up shared memory auth cache")
+    return SharedAuthCache(
+        log=log,
+        metrics=metrics,
+        table=SharedTable(
+            log=log,
+            name=settings_shared_cache.name,
+            scope=f"{settings_mongodb.url}/{settings_mongodb.database}",
+            slots=settings_shared_cache.slots,
+        ),
+        ttl=settings_shared_cache.ttl,
+    )
+
+
+def setup_circuitbreakers(
+    log: logging.Logger,
+    metrics: Metrics,
+    settings_circuitbreaker: SettingsCircuitBreakers,
+    oauth_settings: dict["str", SettingsOAuth],
+) -> CircuitBreakers:
+    log.info("setting up circuit breakers")
+    backends = {
+        "ldap": settings_circuitbreaker.ldap,
+        "mongodb": settings_circuitbreaker.mongodb,
+    }
+    for provider in oauth_settings:
+        backends[f"oauth_{provider}"] = settings_circuitbreaker.oauth
+    breakers = {}
+    for name, settings_breaker in backends.items():
+        breakers[name] = CircuitBreaker(
+            log=log,
+            metrics=metrics,
+            name=name,
+            enabled=settings_breaker.enabled,
+            failure_rate=settings_breaker.failurerate,
+            min_requests=settings_breaker.minrequests,
+            window=settings_breaker.window,
+            open_duration=settings_breaker.openduration,
+            half_open_requests=settings_breaker.halfopenrequests,
+        )
+    return CircuitBreakers(log=log, metrics=metrics, breakers=breakers)
 
 
 def setup_oauth_providers(
     log: logging.Logger,
     http: httpx.AsyncClient,
+    circuitbreakers: CircuitBreakers,
     oauth_settings: dict["str", SettingsOAuth],
 ):
     oauth = OAuth()
@@ -216,13 +675,84 @@ def setup_oauth_providers(
                 authorize_url=config.url.authorize,
                 access_token_url=config.url.accesstoken,
                 userinfo_url=config.url.userinfo,
+                useremails_url=config.url.useremails,
+                breaker=circuitbreakers.breakers[f"oauth_{provider}"],
+            )
+        elif config.type == "oidc":
+            log.info(f"oauth setting up oidc provider with name {provider}")
+            providers[provider] = CrudOAuthOIDC(
+                log=log,
+                http=http,
+                backend_override=config.override,
+                name=provider,
+                oauth=oauth,
+                scope=config.scope,
+                client_id=config.client.id,
+                client_secret=config.client.secret,
+                discovery_url=config.url.discovery,
+                login_claim=config.loginclaim,
+                metadata_ttl=config.metadatattl,
+                breaker=circuitbreakers.breakers[f"oauth_{provider}"],
             )
     return providers
 
 app = FastAPI(title="dummy_project", version="0.0.0", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def mongodb_causal_session(request, call_next):
+    client = getattr(request.app.state, "mongo_client", None)
+    if client is None or not settings.mongodb.causalconsistency:
+        return await call_next(request)
+    async with await client.start_session(causal_consistency=True) as session:
+        if "mongo_cluster_time" in request.session:
+            session.advance_cluster_time(
+                json_util.loads(request.session["mongo_cluster_time"])
+            )
+            session.advance_operation_time(
+                json_util.loads(request.session["mongo_operation_time"])
+            )
+        token = mongo_session.set(session)
+        try:
+            response = await call_next(request)
+        finally:
+            mongo_session.reset(token)
+        if "username" in request.session and session.operation_time is not None:
+            request.session["mongo_cluster_time"] = json_util.dumps(
+                session.cluster_time
+            )
+            request.session["mongo_operation_time"] = json_util.dumps(
+                session.operation_time
+            )
+    return response
+
+
 app.add_middleware(SessionMiddleware, secret_key=settings.app.secretkey, max_age=3600)
 
 
+@app.middleware("http")
+async def add_deadline(request, call_next):
+    timeout = request.headers.get(settings.deadline.header)
+    try:
+        timeout = min(float(timeout), settings.deadline.max)
+        token = deadline.start(timeout=timeout, explicit=True)
+    except (TypeError, ValueError):
+        token = deadline.start(timeout=settings.deadline.default)
+    try:
+        response = await call_next(request)
+    finally:
+        deadline.reset(token)
+    if response.status_code == 504:
+        metrics = getattr(request.app.state, "metrics", None)
+        route = request.scope.get("route")
+        if metrics:
+            metrics.inc(
+                "deadline_exceeded_total",
+                path=route.path if route is not None else "unmatched",
+            )
+    return response
+
+
 @app.middleware("http")
 async def add_process_time_header(request, call_next):
     start_time = time.time()
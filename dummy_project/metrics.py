@@ -0,0 +1,52 @@
+import typing
+
+
+class Metrics:
+    def __init__(self):
+        self._counters = {}
+        self._gauges = {}
+        self._summaries = {}
+        self._callbacks = []
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _format(name: str, labels: tuple, value: float) -> str:
+        if not labels:
+            return f"{name} {value}"
+        _labels = ",".join(f'{k}="{v}"' for k, v in labels)
+        return f"{name}{{{_labels}}} {value}"
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._key(name, labels)
+        summary = self._summaries.setdefault(key, [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += value
+        summary[2] = max(summary[2], value)
+
+    def register(self, callback: typing.Callable[["Metrics"], None]) -> None:
+        self._callbacks.append(callback)
+
+    def render(self) -> str:
+        for callback in self._callbacks:
+            callback(self)
+        lines = []
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(self._format(name, labels, value))
+        for (name, labels), value in sorted(self._gauges.items()):
+            lines.append(self._format(name, labels, value))
+        for (name, labels), (count, total, maximum) in sorted(self._summaries.items()):
+            lines.append(self._format(f"{name}_count", labels, count))
+            lines.append(self._format(f"{name}_sum", labels, total))
+            lines.append(self._format(f"{name}_max", labels, maximum))
+        lines.append("")
+        return "\n".join(lines)
@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import logging
+
+from dummy_project.config import Settings
+
+from dummy_project.bootstrap import setup_logging
+from dummy_project.bootstrap import setup_mongodb
+from dummy_project.bootstrap import setup_teams
+
+
+async def migrate_team_members(settings: Settings, prune: bool) -> None:
+    log = setup_logging(settings.app.loglevel)
+    mongo_db = setup_mongodb(log=log, settings_mongodb=settings.mongodb)
+    settings.teams.memberscollection = True
+    crud_teams = await setup_teams(
+        log=log,
+        mongo_db=mongo_db,
+        breaker=None,
+        cache=None,
+        settings_mongodb=settings.mongodb,
+        settings_teams=settings.teams,
+    )
+    migrated = await crud_teams.users_migrate(prune=prune)
+    log.info(f"migrated members of {migrated} teams to the team_members collection")
+    mongo_db.client.close()
+
+
+def team_members():
+    parser = argparse.ArgumentParser(
+        description="copy embedded team members into the team_members collection"
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="remove the embedded users arrays after copying them",
+    )
+    args = parser.parse_args()
+    logging.basicConfig()
+    asyncio.run(migrate_team_members(settings=Settings(), prune=args.prune))
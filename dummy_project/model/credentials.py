@@ -1,3 +1,4 @@
+import datetime
 from typing import get_args as typing_get_args
 from typing import Optional
 from typing import List
@@ -11,6 +12,9 @@ filter_literal = Literal[
     "id",
     "created",
     "description",
+    "expires",
+    "last_used",
+    "use_count",
 ]
 
 filter_list = set(typing_get_args(filter_literal))
@@ -18,6 +22,9 @@ filter_list = set(typing_get_args(filter_literal))
 sort_literal = Literal[
     "id",
     "created",
+    "expires",
+    "last_used",
+    "use_count",
 ]
 
 
@@ -25,6 +32,9 @@ class CredentialGet(BaseModel):
     id: Optional[str] = None
     created: Optional[str] = None
     description: Optional[str] = None
+    expires: Optional[str] = None
+    last_used: Optional[str] = None
+    use_count: Optional[int] = None
 
 
 class CredentialGetMulti(BaseModel):
@@ -34,6 +44,7 @@ class CredentialGetMulti(BaseModel):
 
 class CredentialPost(BaseModel):
     description: str
+    expires: Optional[datetime.datetime] = None
 
 
 class CredentialPostResult(CredentialGet):
@@ -42,3 +53,4 @@ class CredentialPostResult(CredentialGet):
 
 class CredentialPut(BaseModel):
     description: str
+    expires: Optional[datetime.datetime] = None
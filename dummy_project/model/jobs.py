@@ -0,0 +1,21 @@
+from typing import Literal
+from typing import Optional
+
+from pydantic import BaseModel
+
+job_status_literal = Literal["queued", "running", "done", "superseded", "failed"]
+
+
+class JobGet(BaseModel):
+    id: Optional[str] = None
+    team: Optional[str] = None
+    ldap_group: Optional[str] = None
+    status: Optional[job_status_literal] = None
+    attempts: Optional[int] = None
+    members: Optional[int] = None
+    users_added: Optional[int] = None
+    users_removed: Optional[int] = None
+    error: Optional[str] = None
+    created: Optional[str] = None
+    started: Optional[str] = None
+    finished: Optional[str] = None
@@ -22,6 +22,8 @@ class TeamGet(BaseModel):
     id: Optional[StrictStr] = None
     ldap_group: Optional[StrictStr] = ""
     users: Optional[List[StrictStr]] = None
+    users_added: Optional[int] = None
+    users_removed: Optional[int] = None
 
 
 class TeamGetMulti(BaseModel):
@@ -29,6 +31,11 @@ class TeamGetMulti(BaseModel):
     meta: MetaMulti
 
 
+class TeamUsersGetMulti(BaseModel):
+    result: List[StrictStr]
+    meta: MetaMulti
+
+
 class TeamPost(BaseModel):
     ldap_group: Optional[StrictStr] = ""
     users: Optional[List[StrictStr]] = []
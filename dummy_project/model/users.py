@@ -1,4 +1,5 @@
 from typing import get_args as typing_get_args
+from typing import Dict
 from typing import List
 from typing import Literal
 from typing import Optional
@@ -7,6 +8,7 @@ from pydantic import StrictBool
 from pydantic import EmailStr
 from pydantic import StrictStr
 
+from dummy_project.model.common import DataDelete
 from dummy_project.model.common import MetaMulti
 
 filter_literal = Literal[
@@ -35,6 +37,11 @@ class UserGet(BaseModel):
     backend: Optional[StrictStr] = None
 
 
+class UserDelete(DataDelete):
+    transaction: Optional[StrictBool] = None
+    stages: Optional[Dict[str, float]] = None
+
+
 class UserGetMulti(BaseModel):
     result: List[UserGet]
     meta: MetaMulti
@@ -3,24 +3,38 @@ import logging
 import httpx
 from fastapi import APIRouter
 
+from dummy_project.admission import Admission
+
 from dummy_project.oauth.authenticate import OauthAuthenticate
+from dummy_project.crud.audit import CrudAudit
 from dummy_project.crud.oauth import CrudOAuth
 from dummy_project.crud.users import CrudUsers
 
+from dummy_project.ratelimit import RateLimits
+
 
 class Oauth:
     def __init__(
         self,
         log: logging.Logger,
+        admission: Admission,
+        crud_audit: CrudAudit,
         crud_users: CrudUsers,
         http: httpx.AsyncClient,
         oauth_providers: dict[str, CrudOAuth],
+        ratelimits: RateLimits,
     ):
         self._log = log
         self._router = APIRouter()
 
         self._authenticate = OauthAuthenticate(
-            log=log, crud_users=crud_users, http=http, oauth_providers=oauth_providers
+            log=log,
+            admission=admission,
+            crud_audit=crud_audit,
+            crud_users=crud_users,
+            http=http,
+            oauth_providers=oauth_providers,
+            ratelimits=ratelimits,
         )
 
         self.router.include_router(
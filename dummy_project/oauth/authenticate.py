@@ -1,16 +1,19 @@
 import logging
 
 from fastapi import APIRouter
+from fastapi import Depends
 from fastapi import Request
 from fastapi import HTTPException
 from starlette.responses import RedirectResponse
 
 import httpx
 
+from dummy_project.admission import Admission
+
+from dummy_project.crud.audit import CrudAudit
 from dummy_project.crud.users import CrudUsers
 from dummy_project.crud.oauth import CrudOAuth
 
-from dummy_project.errors import ResourceNotFound
 from dummy_project.errors import AuthenticationError
 
 from dummy_project.model.common import MetaMulti
@@ -18,19 +21,26 @@ from dummy_project.model.oauth import OauthProviderGet
 from dummy_project.model.oauth import OauthProviderGetMulti
 from dummy_project.model.users import UserPut
 
+from dummy_project.ratelimit import RateLimits
+
 
 class OauthAuthenticate:
     def __init__(
         self,
         log: logging.Logger,
+        admission: Admission,
+        crud_audit: CrudAudit,
         crud_users: CrudUsers,
         http: httpx.AsyncClient,
         oauth_providers: dict[str, CrudOAuth],
+        ratelimits: RateLimits,
     ):
+        self._crud_audit = crud_audit
         self._crud_users = crud_users
         self._http = http
         self._log = log
         self._oauth_providers = oauth_providers
+        self._ratelimits = ratelimits
         self._router = APIRouter(
             prefix="/authenticate",
             tags=["authenticate"],
@@ -41,18 +51,25 @@ class OauthAuthenticate:
             self.get_oauth_providers,
             response_model=OauthProviderGetMulti,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("read"))],
         )
         self.router.add_api_route(
             "/oauth/{provider}/login",
             self.get_oauth_login,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("read"))],
         )
         self.router.add_api_route(
             "/oauth/{provider}/auth",
             self.get_oauth_auth,
             methods=["GET"],
+            dependencies=[Depends(admission.dependency("auth"))],
         )
 
+    @property
+    def crud_audit(self):
+        return self._crud_audit
+
     @property
     def crud_users(self):
         return self._crud_users
@@ -69,6 +86,10 @@ class OauthAuthenticate:
     def oauth_providers(self):
         return self._oauth_providers
 
+    @property
+    def ratelimits(self):
+        return self._ratelimits
+
     @property
     def router(self):
         return self._router
@@ -95,40 +116,39 @@ class OauthAuthenticate:
         _provider = self.oauth_providers.get(provider, None)
         if _provider is None:
             raise HTTPException(status_code=404, detail="oauth provider not found")
+        self.ratelimits.check("client", self.ratelimits.client(request))
         token = await _provider.oauth_auth(request=request)
-        userinfo = await _provider.get_user_info(token=token["access_token"])
+        userinfo = await _provider.get_user_info(token=token)
         login = userinfo["login"]
-        try:
-            user = await self.crud_users.get(_id=login, fields=["backend"])
-            if user.backend != f"oauth:{provider}":
-                if _provider.backend_override:
-                    self.log.warning(
-                        f"backend override: backend:{user.backend} -> oauth:{provider}"
-                    )
-                    await self.crud_users.update(
-                        _id=login,
-                        payload=UserPut(
-                            backend=f"oauth{provider}",
-                        ),
-                        fields=["_id"],
-                    )
-                else:
-                    self.log.error(
-                        f"auth backend mismatch: {user.backend} != {provider}"
-                    )
-                    raise AuthenticationError(
-                        msg="backend mismatch, please contact the administrator"
-                    )
-        except ResourceNotFound:
-            await self.crud_users.create_external(
-                _id=login,
-                payload=UserPut(
-                    admin=False,
-                    email=userinfo["email"],
-                    name=userinfo["name"],
-                ),
-                fields=["_id"],
-                backend=f"oauth:{provider}",
-            )
+        backend = await self.crud_users.upsert_external(
+            _id=login,
+            payload=UserPut(
+                admin=False,
+                email=userinfo["email"],
+                name=userinfo["name"],
+            ),
+            backend=f"oauth:{provider}",
+            backend_override=_provider.backend_override,
+        )
+        if backend is not None and backend != f"oauth:{provider}":
+            if _provider.backend_override:
+                self.log.warning(
+                    f"backend override: backend:{backend} -> oauth:{provider}"
+                )
+            else:
+                self.log.error(f"auth backend mismatch: {backend} != {provider}")
+                self.crud_audit.record(
+                    event="oauth",
+                    request=request,
+                    user=login,
+                    success=False,
+                    provider=provider,
+                )
+                raise AuthenticationError(
+                    msg="backend mismatch, please contact the administrator"
+                )
+        self.crud_audit.record(
+            event="oauth", request=request, user=login, provider=provider
+        )
         request.session["username"] = login
         return RedirectResponse(url="/")
@@ -0,0 +1,337 @@
+import asyncio
+import datetime
+import ipaddress
+import logging
+import math
+import os
+import socket
+import time
+import typing
+
+from fastapi import Request
+from motor.motor_asyncio import AsyncIOMotorCollection
+import pymongo
+import pymongo.errors
+
+from dummy_project.errors import RateLimitError
+
+from dummy_project.metrics import Metrics
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        name: str,
+        rate: float,
+        burst: int,
+        max_keys: int = 100000,
+        coll: typing.Optional[AsyncIOMotorCollection] = None,
+        window: int = 60,
+    ):
+        self._buckets = {}
+        self._burst = burst
+        self._coll = coll
+        self._log = log
+        self._max_keys = max_keys
+        self._metrics = metrics
+        self._name = name
+        self._rate = rate
+        self._shard = f"{socket.gethostname()}:{os.getpid()}"
+        self._window = window
+        self._window_current = None
+        self._window_local = {}
+        self._window_remote = {}
+        self._window_synced = {}
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @property
+    def coll(self):
+        return self._coll
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def max_keys(self):
+        return self._max_keys
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def sharded(self):
+        return self._coll is not None
+
+    @property
+    def size(self):
+        return len(self._buckets)
+
+    @property
+    def window(self):
+        return self._window
+
+    @property
+    def window_limit(self):
+        return self.burst + self.rate * self.window
+
+    def _reject(self, retry_after: float) -> None:
+        self.metrics.inc("ratelimit_rejected_total", limiter=self.name)
+        raise RateLimitError(retry_after=max(1, math.ceil(retry_after)))
+
+    def _window_rotate(self) -> int:
+        window = int(time.time() // self.window)
+        if window != self._window_current:
+            self._window_current = window
+            self._window_local = {}
+            self._window_remote = {}
+            self._window_synced = {}
+        return window
+
+    def _bucket(self, key: str) -> TokenBucket:
+        now = time.monotonic()
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.pop(next(iter(self._buckets)))
+            bucket = TokenBucket(tokens=self.burst, updated=now)
+        else:
+            bucket.tokens = min(
+                self.burst, bucket.tokens + (now - bucket.updated) * self.rate
+            )
+            bucket.updated = now
+        self._buckets[key] = bucket
+        return bucket
+
+    def peek(self, key: str) -> None:
+        bucket = self._bucket(key)
+        if bucket.tokens < 1:
+            self._reject((1 - bucket.tokens) / self.rate)
+        if self.sharded:
+            window = self._window_rotate()
+            used = self._window_remote.get(key, 0) + self._window_local.get(key, 0)
+            if used >= self.window_limit:
+                self._reject((window + 1) * self.window - time.time())
+
+    def charge(self, key: str) -> None:
+        bucket = self._bucket(key)
+        bucket.tokens = max(0.0, bucket.tokens - 1)
+        if self.sharded:
+            self._window_rotate()
+            self._window_local[key] = self._window_local.get(key, 0) + 1
+
+    def check(self, key: str) -> None:
+        self.peek(key)
+        self.charge(key)
+
+    async def index_create(self) -> None:
+        if not self.sharded:
+            return
+        await self.coll.create_index(
+            [("expires", pymongo.ASCENDING)], expireAfterSeconds=0
+        )
+        await self.coll.create_index(
+            [
+                ("name", pymongo.ASCENDING),
+                ("window", pymongo.ASCENDING),
+                ("key", pymongo.ASCENDING),
+            ]
+        )
+
+    async def sync(self) -> None:
+        if not self.sharded:
+            return
+        window = self._window_rotate()
+        local = dict(self._window_local)
+        if not local:
+            return
+        expires = datetime.datetime.utcfromtimestamp((window + 2) * self.window)
+        requests = []
+        for key, count in local.items():
+            delta = count - self._window_synced.get(key, 0)
+            if delta <= 0:
+                continue
+            requests.append(
+                pymongo.UpdateOne(
+                    filter={"_id": f"{self.name}:{key}:{window}:{self._shard}"},
+                    update={
+                        "$inc": {"count": delta},
+                        "$setOnInsert": {
+                            "name": self.name,
+                            "key": key,
+                            "window": window,
+                            "shard": self._shard,
+                            "expires": expires,
+                        },
+                    },
+                    upsert=True,
+                )
+            )
+        try:
+            if requests:
+                await self.coll.bulk_write(requests, ordered=False)
+        except pymongo.errors.PyMongoError as err:
+            self.log.error(f"ratelimit {self.name} sync failed: {err}")
+            return
+        if window == self._window_current:
+            for key, count in local.items():
+                self._window_synced[key] = max(self._window_synced.get(key, 0), count)
+        try:
+            pipeline = [
+                {
+                    "$match": {
+                        "name": self.name,
+                        "window": window,
+                        "key": {"$in": list(local.keys())},
+                        "shard": {"$ne": self._shard},
+                    }
+                },
+                {"$group": {"_id": "$key", "count": {"$sum": "$count"}}},
+            ]
+            remote = {}
+            async for item in self.coll.aggregate(pipeline):
+                remote[item["_id"]] = item["count"]
+        except pymongo.errors.PyMongoError as err:
+            self.log.error(f"ratelimit {self.name} sync failed: {err}")
+            return
+        if window == self._window_current:
+            self._window_remote = remote
+
+
+class RateLimits:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        limiters: dict[str, RateLimiter],
+        enabled: bool = True,
+        sync_interval: float = 1.0,
+        trusted_proxies: typing.Optional[list[str]] = None,
+    ):
+        self._enabled = enabled
+        self._limiters = limiters
+        self._log = log
+        self._metrics = metrics
+        self._sync_interval = sync_interval
+        self._sync_stopping = asyncio.Event()
+        self._sync_task = None
+        self._trusted_proxies = [
+            ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies or []
+        ]
+        self.metrics.register(self._metrics_collect)
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def limiters(self):
+        return self._limiters
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def sync_interval(self):
+        return self._sync_interval
+
+    @property
+    def trusted_proxies(self):
+        return self._trusted_proxies
+
+    def _metrics_collect(self, metrics: Metrics) -> None:
+        for name, limiter in self.limiters.items():
+            metrics.set("ratelimit_keys", limiter.size, limiter=name)
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            address = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def client(self, request: Request) -> typing.Optional[str]:
+        if request.client is None:
+            return None
+        client = request.client.host
+        if not self._trusted(client):
+            return client
+        forwarded = request.headers.get("x-forwarded-for", "")
+        for address in reversed(forwarded.split(",")):
+            address = address.strip()
+            if not address:
+                continue
+            client = address
+            if not self._trusted(address):
+                break
+        return client
+
+    def check(self, name: str, key: typing.Optional[str]) -> None:
+        if not self.enabled or key is None:
+            return
+        self.limiters[name].check(key)
+
+    def peek(self, name: str, key: typing.Optional[str]) -> None:
+        if not self.enabled or key is None:
+            return
+        self.limiters[name].peek(key)
+
+    def charge(self, name: str, key: typing.Optional[str]) -> None:
+        if not self.enabled or key is None:
+            return
+        self.limiters[name].charge(key)
+
+    async def index_create(self) -> None:
+        for limiter in self.limiters.values():
+            await limiter.index_create()
+
+    async def _sync_loop(self) -> None:
+        while not self._sync_stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._sync_stopping.wait(), timeout=self.sync_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            for limiter in self.limiters.values():
+                await limiter.sync()
+
+    def start(self) -> None:
+        if not self.enabled:
+            self.log.info("rate limiting disabled")
+            return
+        if any(limiter.sharded for limiter in self.limiters.values()):
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self) -> None:
+        self._sync_stopping.set()
+        if self._sync_task:
+            await self._sync_task
+            self._sync_task = None
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import typing
+
+from fastapi import HTTPException
+
+from dummy_project.crud.lease import CrudLease
+from dummy_project.crud.teams import CrudTeams
+from dummy_project.crud.users import CrudUsers
+
+from dummy_project.errors import ResourceNotFound
+
+from dummy_project.metrics import Metrics
+
+from dummy_project.userdelete import UserDeletion
+
+
+class DeleteReaper:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        crud_lease: CrudLease,
+        crud_teams: CrudTeams,
+        crud_users: CrudUsers,
+        user_deletion: UserDeletion,
+        enabled: bool = True,
+        interval: float = 300.0,
+        grace: float = 600.0,
+        batch_size: int = 100,
+        lease_ttl: float = 300.0,
+    ):
+        self._batch_size = batch_size
+        self._crud_lease = crud_lease
+        self._crud_teams = crud_teams
+        self._crud_users = crud_users
+        self._enabled = enabled
+        self._grace = grace
+        self._holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._interval = interval
+        self._lease_ttl = lease_ttl
+        self._log = log
+        self._metrics = metrics
+        self._stopping = asyncio.Event()
+        self._task = None
+        self._user_deletion = user_deletion
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @property
+    def crud_lease(self):
+        return self._crud_lease
+
+    @property
+    def crud_teams(self):
+        return self._crud_teams
+
+    @property
+    def crud_users(self):
+        return self._crud_users
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def grace(self):
+        return self._grace
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def lease_ttl(self):
+        return self._lease_ttl
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def user_deletion(self):
+        return self._user_deletion
+
+    async def _reap(self, resource: str, crud, reap: typing.Callable) -> int:
+        reclaimed = 0
+        failed = set()
+        while not self._stopping.is_set():
+            ids = await crud.deleting(
+                grace=self.grace, limit=self.batch_size + len(failed)
+            )
+            ids = [_id for _id in ids if _id not in failed]
+            if not ids:
+                break
+            batch = 0
+            for _id in ids[: self.batch_size]:
+                try:
+                    await reap(_id=_id)
+                except ResourceNotFound:
+                    failed.add(_id)
+                    continue
+                except HTTPException as err:
+                    self.log.warning(f"reaping {resource} {_id} failed: {err.detail}")
+                    failed.add(_id)
+                    continue
+                except Exception as err:
+                    self.log.exception(f"reaping {resource} {_id} failed: {err}")
+                    self.metrics.inc("reaper_failed_total", resource=resource)
+                    failed.add(_id)
+                    continue
+                batch += 1
+            reclaimed += batch
+            self.metrics.inc("reaper_reclaimed_total", batch, resource=resource)
+            if not await self.crud_lease.acquire(
+                name="reaper", holder=self._holder, ttl=self.lease_ttl
+            ):
+                break
+        return reclaimed
+
+    async def run(self) -> dict:
+        start = time.monotonic()
+        stats = {
+            "users": await self._reap(
+                "users", self.crud_users, self.user_deletion.delete
+            ),
+            "teams": await self._reap("teams", self.crud_teams, self.crud_teams.delete),
+        }
+        duration = time.monotonic() - start
+        self.metrics.observe("reaper_run_seconds", duration)
+        if any(stats.values()):
+            self.log.info(
+                f"reaper reclaimed {stats} half deleted resources "
+                f"in {duration:.2f} seconds"
+            )
+        return stats
+
+    async def _reap_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(
+                    self._stopping.wait(),
+                    timeout=self.interval * random.uniform(0.9, 1.1),
+                )
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping.is_set():
+                break
+            try:
+                if not await self.crud_lease.acquire(
+                    name="reaper", holder=self._holder, ttl=self.lease_ttl
+                ):
+                    continue
+                await self.run()
+            except HTTPException as err:
+                self.log.error(f"reaper run failed: {err.detail}")
+                self.metrics.inc("reaper_runs_failed_total")
+            except Exception as err:
+                self.log.exception(f"reaper run failed: {err}")
+                self.metrics.inc("reaper_runs_failed_total")
+
+    def start(self) -> None:
+        if not self.enabled:
+            self.log.info("delete reaper disabled")
+            return
+        self._task = asyncio.create_task(self._reap_loop())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if not self._task:
+            return
+        await self._task
+        self._task = None
+        try:
+            await self.crud_lease.release(name="reaper", holder=self._holder)
+        except HTTPException as err:
+            self.log.error(f"releasing reaper lease failed: {err.detail}")
@@ -0,0 +1,336 @@
+import contextlib
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+import typing
+
+from dummy_project.metrics import Metrics
+
+
+class SharedTable:
+    MAGIC = b"dpshm003"
+    HEADER = struct.Struct("<8sII4I")
+    SEQ = struct.Struct("<I")
+    PROBES = 8
+    TOMBSTONE = 0xFFFF
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        name: str,
+        scope: str = "",
+        slots: int = 65536,
+        value_size: int = 160,
+        directory: typing.Optional[str] = None,
+    ):
+        if directory is None:
+            directory = (
+                "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            )
+        scope = hashlib.blake2b(scope.encode(), digest_size=8).hexdigest()
+        self._log = log
+        self._path = os.path.join(directory, f"{name}_{scope}_{slots}_{value_size}.shm")
+        self._slot = struct.Struct(f"<16s16sdIH{value_size}s")
+        self._slot_size = self.SEQ.size + self._slot.size
+        self._slots = slots
+        self._value_size = value_size
+        size = self.HEADER.size + slots * self._slot_size
+        self._attach_fd = os.open(f"{self._path}.attach", os.O_RDWR | os.O_CREAT, 0o600)
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        first = self._attach()
+        with self._locked():
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._mmap = mmap.mmap(self._fd, size)
+            self._buf = memoryview(self._mmap)
+            if first or bytes(self._buf[: len(self.MAGIC)]) != self.MAGIC:
+                self.log.info(f"initializing shared memory table {self._path}")
+                self._buf[:size] = bytes(size)
+                self.HEADER.pack_into(
+                    self._buf, 0, self.MAGIC, slots, value_size, 0, 0, 0, 0
+                )
+
+    def _attach(self) -> bool:
+        try:
+            fcntl.flock(self._attach_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fcntl.flock(self._attach_fd, fcntl.LOCK_SH)
+            return False
+        fcntl.flock(self._attach_fd, fcntl.LOCK_SH)
+        return True
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def slots(self):
+        return self._slots
+
+    @property
+    def value_size(self):
+        return self._value_size
+
+    @contextlib.contextmanager
+    def _locked(self, blocking: bool = True):
+        flags = fcntl.LOCK_EX
+        if not blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._fd, flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _digest(kind: int, key: str) -> bytes:
+        return hashlib.blake2b(
+            key.encode(), digest_size=16, person=kind.to_bytes(16, "little")
+        ).digest()
+
+    def _header(self) -> list:
+        return list(self.HEADER.unpack_from(self._buf, 0))
+
+    def _cleared(self, kind: int) -> int:
+        return self._header()[3 + kind]
+
+    def generation(self, kind: int) -> int:
+        return self._header()[5 + kind]
+
+    def _offsets(self, digest: bytes) -> typing.Iterator[int]:
+        start = int.from_bytes(digest[:8], "little")
+        for probe in range(self.PROBES):
+            index = (start + probe) % self.slots
+            yield self.HEADER.size + index * self._slot_size
+
+    def _read(self, offset: int) -> typing.Optional[tuple]:
+        for _ in range(3):
+            seq = self.SEQ.unpack_from(self._buf, offset)[0]
+            if seq & 1:
+                continue
+            slot = self._slot.unpack_from(self._buf, offset + self.SEQ.size)
+            if self.SEQ.unpack_from(self._buf, offset)[0] == seq:
+                return slot
+        return None
+
+    def _write(self, offset: int, *slot) -> None:
+        seq = self.SEQ.unpack_from(self._buf, offset)[0]
+        self.SEQ.pack_into(self._buf, offset, (seq + 1) & 0xFFFFFFFF)
+        self._slot.pack_into(self._buf, offset + self.SEQ.size, *slot)
+        self.SEQ.pack_into(self._buf, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _find(self, digest: bytes, now: float) -> typing.Optional[tuple]:
+        for offset in self._offsets(digest):
+            slot = self._read(offset)
+            if slot is not None and slot[0] == digest and slot[2] > now:
+                return slot
+        return None
+
+    def _target(
+        self, digest: bytes, now: float, evict_tombstones: bool
+    ) -> typing.Optional[int]:
+        target = None
+        oldest = None
+        for offset in self._offsets(digest):
+            slot_key, _, expires, _, length, _ = self._slot.unpack_from(
+                self._buf, offset + self.SEQ.size
+            )
+            if slot_key == digest:
+                return offset
+            if target is None and expires <= now:
+                target = offset
+            if length == self.TOMBSTONE and not evict_tombstones:
+                continue
+            if oldest is None or expires < oldest[0]:
+                oldest = (expires, offset)
+        if target is None and oldest is not None:
+            target = oldest[1]
+        return target
+
+    def _invalidated(self, kind: int, doc: bytes, generation: int, now: float) -> bool:
+        if self._cleared(kind) > generation:
+            return True
+        tombstone = self._find(doc, now)
+        return tombstone is not None and tombstone[3] > generation
+
+    def get(self, kind: int, key: str) -> typing.Optional[bytes]:
+        now = time.time()
+        slot = self._find(self._digest(kind, key), now)
+        if slot is None:
+            return None
+        _, doc, _, generation, length, value = slot
+        if length == self.TOMBSTONE or self._invalidated(kind, doc, generation, now):
+            return None
+        return value[:length]
+
+    def put(
+        self,
+        kind: int,
+        key: str,
+        doc: str,
+        value: bytes,
+        ttl: float,
+        generation: int,
+    ) -> bool:
+        if len(value) > self.value_size:
+            return False
+        digest = self._digest(kind, key)
+        doc = self._digest(kind + 2, doc)
+        now = time.time()
+        with self._locked(blocking=False) as locked:
+            if not locked or self._invalidated(kind, doc, generation, now):
+                return False
+            target = self._target(digest, now, evict_tombstones=False)
+            if target is None:
+                return False
+            self._write(target, digest, doc, now + ttl, generation, len(value), value)
+        return True
+
+    def invalidate(
+        self, kind: int, doc: typing.Optional[str] = None, ttl: float = 0.0
+    ) -> None:
+        if self._buf is None:
+            return
+        with self._locked():
+            header = self._header()
+            header[5 + kind] = (header[5 + kind] + 1) & 0xFFFFFFFF
+            generation = header[5 + kind]
+            target = None
+            if doc is not None:
+                doc = self._digest(kind + 2, doc)
+                target = self._target(doc, time.time(), evict_tombstones=False)
+            if target is None:
+                header[3 + kind] = generation
+            else:
+                self._write(
+                    target,
+                    doc,
+                    bytes(16),
+                    time.time() + ttl,
+                    generation,
+                    self.TOMBSTONE,
+                    b"",
+                )
+            self.HEADER.pack_into(self._buf, 0, *header)
+
+    def close(self) -> None:
+        buf, self._buf = self._buf, None
+        buf.release()
+        self._mmap.close()
+        os.close(self._fd)
+        os.close(self._attach_fd)
+
+
+class SharedAuthCache:
+    CREDENTIALS = 0
+    USERS = 1
+    CREDENTIAL = struct.Struct("<32sd")
+
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        table: SharedTable,
+        ttl: float = 30.0,
+    ):
+        self._log = log
+        self._metrics = metrics
+        self._table = table
+        self._ttl = ttl
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def table(self):
+        return self._table
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def _result(self, kind: str, value: typing.Any) -> typing.Any:
+        result = "miss" if value is None else "hit"
+        self.metrics.inc("shared_cache_lookups_total", kind=kind, result=result)
+        return value
+
+    @property
+    def credentials_generation(self) -> int:
+        return self.table.generation(self.CREDENTIALS)
+
+    @property
+    def users_generation(self) -> int:
+        return self.table.generation(self.USERS)
+
+    def _put(
+        self, kind: int, key: str, doc_id: typing.Any, value: bytes, generation: int
+    ) -> None:
+        if not self.table.put(
+            kind, key, str(doc_id), value, self.ttl, generation=generation
+        ):
+            self.metrics.inc("shared_cache_puts_skipped_total")
+
+    def _invalidate(self, kind: int, doc_id: typing.Any) -> None:
+        doc = None if doc_id is None else str(doc_id)
+        self.table.invalidate(kind, doc, 2 * self.ttl)
+
+    def credential_get(self, _id: str, secret: str) -> typing.Optional[str]:
+        value = self.table.get(self.CREDENTIALS, _id)
+        if value is None:
+            return self._result("credentials", None)
+        digest, expires = self.CREDENTIAL.unpack_from(value)
+        if digest != hashlib.sha256(secret.encode()).digest():
+            return self._result("credentials", None)
+        if expires and expires <= time.time():
+            return self._result("credentials", None)
+        return self._result("credentials", value[self.CREDENTIAL.size :].decode())
+
+    def credential_put(
+        self,
+        _id: str,
+        doc_id: typing.Any,
+        secret: str,
+        owner: str,
+        expires: typing.Optional[float],
+        generation: int,
+    ) -> None:
+        value = self.CREDENTIAL.pack(
+            hashlib.sha256(secret.encode()).digest(), expires or 0.0
+        )
+        self._put(self.CREDENTIALS, _id, doc_id, value + owner.encode(), generation)
+
+    def admin_get(self, user: str) -> typing.Optional[bool]:
+        value = self.table.get(self.USERS, user)
+        return self._result("users", None if value is None else value == b"\x01")
+
+    def admin_put(
+        self, user: str, doc_id: typing.Any, admin: bool, generation: int
+    ) -> None:
+        self._put(self.USERS, user, doc_id, b"\x01" if admin else b"\x00", generation)
+
+    def invalidate_credentials(self, doc_id: typing.Any = None) -> None:
+        self._invalidate(self.CREDENTIALS, doc_id)
+
+    def invalidate_users(self, doc_id: typing.Any = None) -> None:
+        self._invalidate(self.USERS, doc_id)
+
+    async def close(self) -> None:
+        self.table.close()
@@ -0,0 +1,70 @@
+import asyncio
+import contextvars
+import copy
+import logging
+import typing
+
+import dummy_project.deadline as deadline
+
+from dummy_project.metrics import Metrics
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        name: str,
+        timeout: float = 10.0,
+    ):
+        self._calls = {}
+        self._log = log
+        self._metrics = metrics
+        self._name = name
+        self._timeout = timeout
+        self.metrics.register(self._metrics_collect)
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    def _metrics_collect(self, metrics: Metrics) -> None:
+        metrics.set("singleflight_inflight", len(self._calls), flight=self.name)
+
+    def _done(self, key: typing.Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def _call(self, func: typing.Callable, **kwargs):
+        token = deadline.start(timeout=self.timeout)
+        try:
+            return await func(**kwargs)
+        finally:
+            deadline.reset(token)
+
+    async def do(self, key: typing.Hashable, func: typing.Callable, **kwargs):
+        task = self._calls.get(key)
+        if task is not None:
+            self.metrics.inc("singleflight_collapsed_total", flight=self.name)
+            return copy.deepcopy(await deadline.wait_for(asyncio.shield(task)))
+        self.metrics.inc("singleflight_calls_total", flight=self.name)
+        task = contextvars.Context().run(
+            asyncio.create_task, self._call(func, **kwargs)
+        )
+        self._calls[key] = task
+        task.add_done_callback(lambda _task: self._done(key, _task))
+        return await deadline.wait_for(asyncio.shield(task))
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+
+import bonsai.errors
+from fastapi import HTTPException
+
+from dummy_project.crud.jobs import CrudJobs
+from dummy_project.crud.ldap import CrudLdap
+from dummy_project.crud.teams import CrudTeams
+
+import dummy_project.deadline as deadline
+
+from dummy_project.metrics import Metrics
+
+
+class TeamJobWorker:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        crud_jobs: CrudJobs,
+        crud_ldap: CrudLdap,
+        crud_teams: CrudTeams,
+        enabled: bool = True,
+        concurrency: int = 2,
+        heartbeat_interval: float = 10.0,
+        max_attempts: int = 3,
+        poll_interval: float = 5.0,
+        timeout: float = 900.0,
+    ):
+        self._concurrency = concurrency
+        self._crud_jobs = crud_jobs
+        self._crud_ldap = crud_ldap
+        self._crud_teams = crud_teams
+        self._enabled = enabled
+        self._heartbeat_interval = heartbeat_interval
+        self._log = log
+        self._max_attempts = max_attempts
+        self._metrics = metrics
+        self._poll_interval = poll_interval
+        self._running = set()
+        self._stopping = asyncio.Event()
+        self._task = None
+        self._timeout = timeout
+        self._wakeup = asyncio.Event()
+        self._worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.metrics.register(self._metrics_collect)
+
+    @property
+    def concurrency(self):
+        return self._concurrency
+
+    @property
+    def crud_jobs(self):
+        return self._crud_jobs
+
+    @property
+    def crud_ldap(self):
+        return self._crud_ldap
+
+    @property
+    def crud_teams(self):
+        return self._crud_teams
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @property
+    def heartbeat_interval(self):
+        return self._heartbeat_interval
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def max_attempts(self):
+        return self._max_attempts
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def poll_interval(self):
+        return self._poll_interval
+
+    @property
+    def stale_after(self):
+        return 3 * self.heartbeat_interval
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    def _metrics_collect(self, metrics: Metrics) -> None:
+        metrics.set("team_jobs_running", len(self._running))
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    async def _heartbeat(self, job: dict, progress: dict) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.crud_jobs.heartbeat(
+                    _id=job["id"], worker=self._worker, members=progress["members"]
+                )
+            except HTTPException as err:
+                self.log.warning(f"team job {job['id']} heartbeat failed: {err}")
+            except Exception as err:
+                self.log.exception(f"team job {job['id']} heartbeat failed: {err}")
+
+    async def _failed(self, job: dict, err: Exception) -> str:
+        status = "failed"
+        try:
+            if job["attempts"] < self.max_attempts:
+                status = "queued"
+                await self.crud_jobs.release(
+                    _id=job["id"], worker=self._worker, error=str(err)
+                )
+            else:
+                await self.crud_jobs.finish(
+                    _id=job["id"],
+                    worker=self._worker,
+                    status=status,
+                    error=str(err),
+                )
+        except Exception as err:
+            self.log.error(f"team job {job['id']} state update failed: {err}")
+        return status
+
+    async def _sync(self, job: dict, progress: dict) -> tuple:
+        token = deadline.start(timeout=self.timeout)
+        try:
+            users = await self.crud_ldap.get_logins_from_group(
+                group=job["ldap_group"],
+                progress=lambda members: progress.update(members=members),
+            )
+            diff = await self.crud_teams.ldap_sync(
+                _id=job["team"],
+                ldap_group=job["ldap_group"],
+                users=users,
+                ldap_changed=None,
+            )
+        finally:
+            deadline.reset(token)
+        return users, diff
+
+    async def _run(self, job: dict) -> None:
+        start = time.monotonic()
+        progress = {"members": 0}
+        heartbeat = asyncio.create_task(self._heartbeat(job=job, progress=progress))
+        try:
+            users, diff = await self._sync(job=job, progress=progress)
+            status = "done" if diff is not None else "superseded"
+            await self.crud_jobs.finish(
+                _id=job["id"],
+                worker=self._worker,
+                status=status,
+                members=len(users),
+                **(diff or {}),
+            )
+        except asyncio.CancelledError:
+            try:
+                await self.crud_jobs.release(_id=job["id"], worker=self._worker)
+            except HTTPException as err:
+                self.log.error(f"team job {job['id']} release failed: {err}")
+            raise
+        except (HTTPException, bonsai.errors.LDAPError) as err:
+            self.log.warning(f"team job {job['id']} failed: {err}")
+            status = await self._failed(job=job, err=err)
+        except Exception as err:
+            self.log.exception(f"team job {job['id']} failed: {err}")
+            status = await self._failed(job=job, err=err)
+        finally:
+            heartbeat.cancel()
+        self.metrics.inc("team_jobs_total", status=status)
+        self.metrics.observe("team_job_seconds", time.monotonic() - start)
+
+    def _done(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        self._wakeup.set()
+
+    async def _worker_loop(self) -> None:
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                while len(self._running) < self.concurrency:
+                    job = await self.crud_jobs.claim(
+                        worker=self._worker,
+                        stale_after=self.stale_after,
+                        max_attempts=self.max_attempts,
+                    )
+                    if job is None:
+                        break
+                    task = asyncio.create_task(self._run(job=job))
+                    self._running.add(task)
+                    task.add_done_callback(self._done)
+            except HTTPException as err:
+                self.log.error(f"claiming team jobs failed: {err.detail}")
+            except Exception as err:
+                self.log.exception(f"claiming team jobs failed: {err}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if not self.enabled:
+            self.log.info("team job worker disabled")
+            return
+        self._task = asyncio.create_task(self._worker_loop())
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+        running = list(self._running)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
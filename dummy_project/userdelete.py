@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import time
+import typing
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClientSession
+import pymongo.errors
+
+from dummy_project.crud.common import mongo_session
+from dummy_project.crud.credentials import CrudCredentials
+from dummy_project.crud.teams import CrudTeams
+from dummy_project.crud.users import CrudUsers
+
+from dummy_project.errors import BackendError
+
+from dummy_project.metrics import Metrics
+
+from dummy_project.model.users import UserDelete
+
+
+class UserDeletion:
+    def __init__(
+        self,
+        log: logging.Logger,
+        metrics: Metrics,
+        client: AsyncIOMotorClient,
+        crud_teams: CrudTeams,
+        crud_users: CrudUsers,
+        crud_users_credentials: CrudCredentials,
+        transactions: bool = True,
+    ):
+        self._client = client
+        self._crud_teams = crud_teams
+        self._crud_users = crud_users
+        self._crud_users_credentials = crud_users_credentials
+        self._log = log
+        self._metrics = metrics
+        self._transactions = transactions
+
+    @property
+    def client(self):
+        return self._client
+
+    @property
+    def crud_teams(self):
+        return self._crud_teams
+
+    @property
+    def crud_users(self):
+        return self._crud_users
+
+    @property
+    def crud_users_credentials(self):
+        return self._crud_users_credentials
+
+    @property
+    def log(self):
+        return self._log
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def transactions(self) -> bool:
+        topology = self.client.topology_description.topology_type_name
+        return self._transactions and topology in ("ReplicaSetWithPrimary", "Sharded")
+
+    @staticmethod
+    def _advance(
+        session: AsyncIOMotorClientSession, source: AsyncIOMotorClientSession
+    ) -> None:
+        if source.cluster_time is not None:
+            session.advance_cluster_time(source.cluster_time)
+        if source.operation_time is not None:
+            session.advance_operation_time(source.operation_time)
+
+    async def _stage(
+        self, name: str, stages: dict, func: typing.Callable, **kwargs
+    ) -> None:
+        start = time.monotonic()
+        await func(**kwargs)
+        stages[name] = time.monotonic() - start
+        self.metrics.observe("user_delete_stage_seconds", stages[name], stage=name)
+
+    async def _stage_concurrent(
+        self, name: str, stages: dict, func: typing.Callable, **kwargs
+    ) -> None:
+        parent = mongo_session.get()
+        if parent is None:
+            return await self._stage(name, stages, func, **kwargs)
+        async with await self.client.start_session(causal_consistency=True) as session:
+            self._advance(session, parent)
+            mongo_session.set(session)
+            await self._stage(name, stages, func, **kwargs)
+        self._advance(parent, session)
+
+    async def _delete_concurrent(self, _id: str, stages: dict) -> None:
+        await self._stage("mark", stages, self.crud_users.delete_mark, _id=_id)
+        await asyncio.gather(
+            self._stage_concurrent(
+                "credentials",
+                stages,
+                self.crud_users_credentials.delete_all_from_owner,
+                owner=_id,
+            ),
+            self._stage_concurrent(
+                "teams", stages, self.crud_teams.delete_user_from_teams, user_id=_id
+            ),
+        )
+        await self._stage("user", stages, self.crud_users.delete, _id=_id)
+
+    async def _delete_transaction(self, _id: str, stages: dict) -> None:
+        async def callback(session: AsyncIOMotorClientSession) -> None:
+            stages.clear()
+            await self._stage(
+                "credentials",
+                stages,
+                self.crud_users_credentials.delete_all_from_owner,
+                owner=_id,
+            )
+            await self._stage(
+                "teams", stages, self.crud_teams.delete_user_from_teams, user_id=_id
+            )
+            await self._stage("user", stages, self.crud_users.delete, _id=_id)
+
+        parent = mongo_session.get()
+        async with await self.client.start_session(causal_consistency=True) as session:
+            if parent is not None:
+                self._advance(session, parent)
+            token = mongo_session.set(session)
+            try:
+                await session.with_transaction(callback)
+            except pymongo.errors.PyMongoError as err:
+                self.log.error(f"deleting user {_id} failed: {err}")
+                raise BackendError
+            finally:
+                mongo_session.reset(token)
+            if parent is not None:
+                self._advance(parent, session)
+
+    async def delete(self, _id: str) -> UserDelete:
+        start = time.monotonic()
+        stages = {}
+        transaction = self.transactions
+        if transaction:
+            await self._delete_transaction(_id=_id, stages=stages)
+        else:
+            await self._delete_concurrent(_id=_id, stages=stages)
+        stages["total"] = time.monotonic() - start
+        return UserDelete(transaction=transaction, stages=stages)
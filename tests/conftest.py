@@ -0,0 +1,83 @@
+import logging
+
+import pytest
+
+from dummy_project.metrics import Metrics
+
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._iter = None
+
+    async def to_list(self, length=None):
+        return list(self._cursor)
+
+    def __aiter__(self):
+        self._iter = iter(self._cursor)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class AsyncCollection:
+    def __init__(self, coll):
+        self._coll = coll
+        self.commands = []
+        self.name = coll.name
+
+    def find(self, *args, session=None, **kwargs):
+        self.commands.append("find")
+        return AsyncCursor(self._coll.find(*args, **kwargs))
+
+    def aggregate(self, *args, session=None, **kwargs):
+        self.commands.append("aggregate")
+        return AsyncCursor(self._coll.aggregate(*args, **kwargs))
+
+    def with_options(self, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        func = getattr(self._coll, name)
+
+        async def wrapper(*args, session=None, **kwargs):
+            self.commands.append(name)
+            return func(*args, **kwargs)
+
+        return wrapper
+
+
+@pytest.fixture
+def log():
+    return logging.getLogger("tests")
+
+
+@pytest.fixture
+def metrics():
+    return Metrics()
+
+
+@pytest.fixture
+def mongo_db():
+    mongomock = pytest.importorskip("mongomock")
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def collection(mongo_db):
+    def factory(name):
+        return AsyncCollection(mongo_db[name])
+
+    return factory
+
+
+@pytest.fixture
+def counter(metrics):
+    def value(name, **labels):
+        return metrics._counters.get(metrics._key(name, labels), 0)
+
+    return value
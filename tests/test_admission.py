@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from dummy_project.admission import Admission
+from dummy_project.admission import AdmissionClass
+from dummy_project.errors import OverloadError
+
+
+def admission_class(log, metrics, **kwargs):
+    settings = {"concurrency": 1, "queue_size": 1, "deadline": 1.0, "timeout": 5.0}
+    settings.update(kwargs)
+    return AdmissionClass(log=log, metrics=metrics, name="write", **settings)
+
+
+def test_waiter_is_admitted_on_release(log, metrics):
+    admission = admission_class(log, metrics)
+
+    async def scenario():
+        await admission.acquire()
+        waiter = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0)
+        assert admission.queued == 1
+        admission.release()
+        await waiter
+        assert admission.active == 1
+        assert admission.queued == 0
+        admission.release()
+        assert admission.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_shed(log, metrics, counter):
+    admission = admission_class(log, metrics)
+
+    async def scenario():
+        await admission.acquire()
+        waiter = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(OverloadError):
+            await admission.acquire()
+        waiter.cancel()
+
+    asyncio.run(scenario())
+    assert counter("admission_shed_total", cls="write", reason="queue_full") == 1
+
+
+def test_queue_timeout_is_shed(log, metrics, counter):
+    admission = admission_class(log, metrics, deadline=0.01)
+
+    async def scenario():
+        await admission.acquire()
+        with pytest.raises(OverloadError):
+            await admission.acquire()
+        assert admission.queued == 0
+
+    asyncio.run(scenario())
+    assert counter("admission_shed_total", cls="write", reason="timeout") == 1
+
+
+def test_classes_are_isolated(log, metrics):
+    write = admission_class(log, metrics, deadline=0.01)
+    read = AdmissionClass(
+        log=log,
+        metrics=metrics,
+        name="read",
+        concurrency=1,
+        queue_size=1,
+        deadline=0.01,
+        timeout=5.0,
+    )
+    admission = Admission(
+        log=log, metrics=metrics, classes={"read": read, "write": write}
+    )
+
+    async def admitted(name):
+        dependency = admission.dependency(name)()
+        await dependency.__anext__()
+        return dependency
+
+    async def scenario():
+        held = [await admitted("write"), await admitted("read")]
+        with pytest.raises(OverloadError):
+            await admitted("write")
+        for dependency in held:
+            await dependency.aclose()
+
+    asyncio.run(scenario())
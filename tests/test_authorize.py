@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from dummy_project.authorize import Authorize
+from dummy_project.errors import CredentialError
+from dummy_project.errors import CredentialExpiredError
+
+
+class FakeAudit:
+    def __init__(self):
+        self.events = []
+
+    def record(self, event, request, **kwargs):
+        self.events.append((event, kwargs))
+
+
+class FakeCredentials:
+    def __init__(self):
+        self.checked = 0
+
+    async def check_credential(self, request):
+        self.checked += 1
+        if request.headers["x-secret"] == "expired":
+            raise CredentialExpiredError
+        if request.headers["x-secret"] != "good":
+            raise CredentialError
+        return "owner"
+
+
+class FakeRateLimits:
+    def __init__(self):
+        self.charged = []
+
+    def client(self, request):
+        return "127.0.0.1"
+
+    def peek(self, name, key):
+        pass
+
+    def charge(self, name, key):
+        self.charged.append(name)
+
+
+@pytest.fixture
+def authorize(log):
+    return Authorize(
+        log=log,
+        crud_audit=FakeAudit(),
+        crud_teams=None,
+        crud_users=None,
+        crud_users_credentials=FakeCredentials(),
+        ratelimits=FakeRateLimits(),
+    )
+
+
+def request(**headers):
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [
+                (key.replace("_", "-").encode(), value.encode())
+                for key, value in headers.items()
+            ],
+        }
+    )
+
+
+@pytest.mark.parametrize("headers", [{}, {"x_secret_id": "c"}, {"x_secret": "s"}])
+def test_missing_credentials_are_not_checked_or_audited(authorize, headers):
+    user = asyncio.run(authorize.get_user_from_credentials(request(**headers)))
+    assert user is None
+    assert authorize.crud_users_credentials.checked == 0
+    assert authorize.crud_audit.events == []
+    assert authorize.ratelimits.charged == []
+
+
+def test_failed_credentials_are_audited_and_charged(authorize):
+    user = asyncio.run(
+        authorize.get_user_from_credentials(request(x_secret_id="c", x_secret="bad"))
+    )
+    assert user is None
+    assert authorize.crud_audit.events == [
+        ("credential", {"success": False, "credential": "c"})
+    ]
+    assert authorize.ratelimits.charged == ["credentialclient", "credential"]
+
+
+def test_valid_credentials_return_owner(authorize):
+    user = asyncio.run(
+        authorize.get_user_from_credentials(request(x_secret_id="c", x_secret="good"))
+    )
+    assert user == "owner"
+    assert authorize.crud_audit.events == [
+        ("credential", {"user": "owner", "credential": "c"})
+    ]
+
+
+def test_expired_credentials_are_rejected_without_charging(authorize):
+    with pytest.raises(CredentialExpiredError) as err:
+        asyncio.run(
+            authorize.get_user_from_credentials(
+                request(x_secret_id="c", x_secret="expired")
+            )
+        )
+    assert err.value.status_code == 403
+    assert err.value.detail == "Credential expired"
+    assert authorize.crud_audit.events == [
+        ("credential", {"success": False, "credential": "c", "reason": "expired"})
+    ]
+    assert authorize.ratelimits.charged == []
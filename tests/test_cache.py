@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from bson.objectid import ObjectId
+import pytest
+
+from dummy_project.crud.cache import DocCache
+from dummy_project.crud.common import CrudMongo
+
+
+@pytest.fixture
+def cache(log, metrics):
+    return DocCache(log=log, metrics=metrics, name="users", max_entries=4, ttl=30.0)
+
+
+def doc(name):
+    return {"_id": ObjectId(), "id": name}
+
+
+def test_invalidate_document_keeps_other_entries(cache):
+    first = doc("a")
+    second = doc("b")
+    cache.put("a", first, generation=cache.generation)
+    cache.put("a-admin", first, generation=cache.generation)
+    cache.put("b", second, generation=cache.generation)
+    cache.invalidate(first["_id"])
+    assert cache.get("a") is None
+    assert cache.get("a-admin") is None
+    assert cache.get("b") == second
+
+
+def test_put_racing_a_document_invalidation_is_dropped(cache):
+    first = doc("a")
+    second = doc("b")
+    generation = cache.generation
+    cache.invalidate(first["_id"])
+    cache.put("a", first, generation=generation)
+    cache.put("b", second, generation=generation)
+    assert cache.get("a") is None
+    assert cache.get("b") == second
+
+
+def test_put_racing_a_full_invalidation_is_dropped(cache):
+    generation = cache.generation
+    cache.invalidate()
+    cache.put("a", doc("a"), generation=generation)
+    assert cache.get("a") is None
+
+
+def test_read_through(log, metrics, collection, counter):
+    cache = DocCache(log=log, metrics=metrics, name="users")
+    crud = CrudMongo(log=log, coll=collection("users"), cache=cache)
+    coll = crud.coll._coll
+    doc_id = coll.insert_one({"id": "a", "admin": True, "deleting": False}).inserted_id
+
+    async def run():
+        first = await crud._get(query={"id": "a"}, fields=["id", "admin"])
+        coll.update_one({"_id": doc_id}, {"$set": {"admin": False}})
+        second = await crud._get(query={"id": "a"}, fields=["id", "admin"], obj_id=True)
+        cache.invalidate(doc_id)
+        third = await crud._get(query={"id": "a"}, fields=["id", "admin"])
+        return first, second, third
+
+    first, second, third = asyncio.run(run())
+    assert first == {"id": "a", "admin": True}
+    assert second == {"_id": doc_id, "id": "a", "admin": True}
+    assert third == {"id": "a", "admin": False}
+    assert counter("doc_cache_hits_total", resource="users") == 1
+
+
+def test_least_recently_used_entry_is_evicted(cache):
+    for name in "abcd":
+        cache.put(name, doc(name), generation=cache.generation)
+    assert cache.get("a") is not None
+    cache.put("e", doc("e"), generation=cache.generation)
+    assert cache.get("b") is None
+    assert all(cache.get(name) is not None for name in "acde")
+
+
+def test_expired_entry_is_a_miss(cache, monkeypatch, counter):
+    now = time.monotonic()
+    cache.put("a", doc("a"), generation=cache.generation)
+    monkeypatch.setattr(time, "monotonic", lambda: now + 31.0)
+    assert cache.get("a") is None
+    assert counter("doc_cache_misses_total", resource="users") == 1
+
+
+def test_cached_values_are_copies(cache):
+    value = doc("a")
+    cache.put("a", value, generation=cache.generation)
+    value["id"] = "changed"
+    cache.get("a")["id"] = "changed"
+    assert cache.get("a")["id"] == "a"
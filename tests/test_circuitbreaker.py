@@ -0,0 +1,127 @@
+import pytest
+
+import dummy_project.circuitbreaker as circuitbreaker
+from dummy_project.circuitbreaker import CircuitBreaker
+from dummy_project.circuitbreaker import CircuitBreakers
+from dummy_project.errors import BackendUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuitbreaker.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def breaker(log, metrics, clock):
+    return CircuitBreaker(
+        log=log,
+        metrics=metrics,
+        name="mongo",
+        failure_rate=0.5,
+        min_requests=4,
+        window=10.0,
+        open_duration=5.0,
+    )
+
+
+def fail(breaker):
+    with pytest.raises(ConnectionError):
+        with breaker.guard(errors=(ConnectionError,)):
+            raise ConnectionError
+
+
+def succeed(breaker):
+    with breaker.guard(errors=(ConnectionError,)):
+        pass
+
+
+def test_opens_only_after_min_requests(breaker):
+    for _ in range(3):
+        fail(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(BackendUnavailable) as err:
+        succeed(breaker)
+    assert err.value.headers["Retry-After"] == "5"
+
+
+def test_failures_age_out_of_the_window(breaker, clock):
+    for _ in range(3):
+        fail(breaker)
+    clock.now += 11.0
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_other_errors_count_as_success(breaker):
+    for _ in range(2):
+        fail(breaker)
+    for _ in range(4):
+        with pytest.raises(ValueError):
+            with breaker.guard(errors=(ConnectionError,)):
+                raise ValueError
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_trial_closes_or_reopens(breaker, clock, counter):
+    for _ in range(4):
+        fail(breaker)
+    clock.now += 5.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    fail(breaker)
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now += 5.0
+    succeed(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert (
+        counter("circuit_breaker_transitions_total", breaker="mongo", state="open") == 2
+    )
+
+
+def test_half_open_admits_a_single_trial(breaker, clock):
+    for _ in range(4):
+        fail(breaker)
+    clock.now += 5.0
+    with breaker.guard(errors=(ConnectionError,)):
+        with pytest.raises(BackendUnavailable):
+            succeed(breaker)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_ready_only_depends_on_mongodb(log, metrics, clock):
+    breakers = CircuitBreakers(
+        log=log,
+        metrics=metrics,
+        breakers={
+            name: CircuitBreaker(
+                log=log,
+                metrics=metrics,
+                name=name,
+                failure_rate=0.5,
+                min_requests=4,
+                window=10.0,
+                open_duration=5.0,
+            )
+            for name in ("ldap", "mongodb", "oauth_github")
+        },
+    )
+    for name in ("ldap", "oauth_github"):
+        for _ in range(4):
+            fail(breakers.breakers[name])
+    assert breakers.states()["ldap"] == CircuitBreaker.OPEN
+    assert breakers.ready()
+    for _ in range(4):
+        fail(breakers.breakers["mongodb"])
+    assert not breakers.ready()
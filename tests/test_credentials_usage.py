@@ -0,0 +1,100 @@
+import asyncio
+import datetime
+
+import pymongo.errors
+import pytest
+from passlib.hash import pbkdf2_sha512
+
+from dummy_project.crud.credentials import CrudCredentials
+from dummy_project.errors import CredentialExpiredError
+
+
+class FailingCollection:
+    name = "users_credentials"
+
+    def __init__(self, error):
+        self.error = error
+        self.requests = []
+
+    async def bulk_write(self, requests, ordered=True):
+        self.requests.append(requests)
+        raise self.error
+
+
+def credentials(log, coll):
+    return CrudCredentials(log=log, coll=coll, usage_flush_interval=60)
+
+
+def test_usage_is_flushed(log, collection, mongo_db):
+    mongo_db["users_credentials"].insert_many(
+        [{"id": "a", "use_count": 1}, {"id": "b"}]
+    )
+    crud = credentials(log, collection("users_credentials"))
+    for _id in ("a", "a", "b"):
+        crud._usage_record(_id=_id)
+    asyncio.run(crud.usage_flush())
+    docs = {
+        doc["id"]: doc for doc in mongo_db["users_credentials"].find({}, {"_id": 0})
+    }
+    assert docs["a"]["use_count"] == 3
+    assert docs["b"]["use_count"] == 1
+    assert isinstance(docs["b"]["last_used"], datetime.datetime)
+    assert crud._usage == {}
+
+
+def test_bulk_write_errors_requeue_only_failed_updates(log):
+    error = pymongo.errors.BulkWriteError(
+        {
+            "writeErrors": [{"index": 1, "code": 2, "errmsg": "failed"}],
+            "writeConcernErrors": [],
+            "nInserted": 0,
+            "nModified": 1,
+        }
+    )
+    crud = credentials(log, FailingCollection(error))
+    for _id in ("a", "b", "b"):
+        crud._usage_record(_id=_id)
+    asyncio.run(crud.usage_flush())
+    assert list(crud._usage) == ["b"]
+    assert crud._usage["b"][1] == 2
+
+
+def test_ambiguous_errors_do_not_requeue_counts(log):
+    crud = credentials(log, FailingCollection(pymongo.errors.AutoReconnect("lost")))
+    crud._usage_record(_id="a")
+    last_used = crud._usage["a"][0]
+    asyncio.run(crud.usage_flush())
+    assert crud._usage == {"a": [last_used, 0]}
+
+
+def test_expired_credentials_are_refused(log, collection, mongo_db):
+    now = datetime.datetime.utcnow()
+    secret = pbkdf2_sha512.hash("s3cret", rounds=10)
+    mongo_db["users_credentials"].insert_many(
+        [
+            {
+                "id": "old",
+                "owner": "alice",
+                "secret": secret,
+                "expires": now,
+                "deleting": False,
+            },
+            {
+                "id": "new",
+                "owner": "alice",
+                "secret": secret,
+                "expires": now + datetime.timedelta(hours=1),
+                "deleting": False,
+            },
+        ]
+    )
+    crud = credentials(log, collection("users_credentials"))
+    with pytest.raises(CredentialExpiredError) as err:
+        asyncio.run(
+            crud._check_credential(_id="old", secret="s3cret", shared_cache=None)
+        )
+    assert err.value.status_code == 403
+    owner = asyncio.run(
+        crud._check_credential(_id="new", secret="s3cret", shared_cache=None)
+    )
+    assert owner == "alice"
@@ -0,0 +1,96 @@
+import asyncio
+import time
+import types
+
+import pymongo._csot
+import pytest
+
+import dummy_project.deadline as deadline
+
+from dummy_project.crud.common import CrudMongo
+
+from dummy_project.errors import DeadlineExceeded
+
+
+@pytest.fixture
+def crud(log):
+    return CrudMongo(log=log, coll=types.SimpleNamespace(name="things"))
+
+
+def test_no_deadline():
+    assert deadline.remaining() is None
+    assert not deadline.exceeded()
+    deadline.check()
+
+
+def test_deadline_exceeded():
+    token = deadline.start(timeout=0.01)
+    try:
+        time.sleep(0.02)
+        assert deadline.remaining() == 0.0
+        assert deadline.exceeded()
+        with pytest.raises(DeadlineExceeded):
+            deadline.check()
+    finally:
+        deadline.reset(token)
+
+
+def test_route_default_keeps_explicit_deadline():
+    token = deadline.start(timeout=10.0, explicit=True)
+    try:
+        deadline.route_default(1.0)
+        assert deadline.remaining() > 9.0
+    finally:
+        deadline.reset(token)
+
+
+def test_route_default_tightens_implicit_deadline():
+    token = deadline.start(timeout=10.0)
+    try:
+        deadline.route_default(1.0)
+        assert deadline.remaining() <= 1.0
+    finally:
+        deadline.reset(token)
+
+
+def test_wait_for_raises_deadline_exceeded():
+    async def run():
+        token = deadline.start(timeout=0.01)
+        try:
+            await deadline.wait_for(asyncio.sleep(1))
+        finally:
+            deadline.reset(token)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+
+
+def test_guard_without_deadline_has_no_timeout(crud):
+    with crud._guard():
+        assert pymongo._csot.get_timeout() is None
+
+
+def test_guard_applies_remaining_deadline(crud):
+    token = deadline.start(timeout=5.0)
+    try:
+        with crud._guard():
+            assert 0 < pymongo._csot.get_timeout() <= 5.0
+    finally:
+        deadline.reset(token)
+
+
+def test_guard_fails_fast_when_deadline_exceeded(crud):
+    token = deadline.start(timeout=0.0)
+    try:
+        with pytest.raises(DeadlineExceeded):
+            with crud._guard():
+                pass
+    finally:
+        deadline.reset(token)
+
+
+def test_guard_never_disables_timeout(crud, monkeypatch):
+    monkeypatch.setattr(deadline, "remaining", lambda: 0.0)
+    monkeypatch.setattr(deadline, "exceeded", lambda: False)
+    with crud._guard():
+        assert pymongo._csot.get_timeout() > 0
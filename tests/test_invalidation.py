@@ -0,0 +1,198 @@
+import asyncio
+import os
+import time
+
+from bson.objectid import ObjectId
+import pytest
+
+from dummy_project.crud.cache import DocCache
+
+from dummy_project.invalidation import InvalidationBus
+
+
+def change(operation, coll="users_credentials", doc_id=None, **kwargs):
+    result = {"ns": {"db": "test", "coll": coll}, "operationType": operation}
+    if doc_id is not None:
+        result["documentKey"] = {"_id": doc_id}
+    result.update(kwargs)
+    return result
+
+
+@pytest.fixture
+def bus(log, metrics):
+    return InvalidationBus(
+        log=log,
+        metrics=metrics,
+        mongo_db={"cache_versions": None},
+        resources=["users", "users_credentials"],
+        ignored_fields={"users_credentials": ["last_used", "use_count"]},
+    )
+
+
+@pytest.fixture
+def published(bus):
+    events = []
+    for resource in bus.resources:
+        bus.subscribe(
+            resource,
+            lambda doc_id, resource=resource: events.append((resource, doc_id)),
+        )
+    return events
+
+
+def test_usage_only_updates_are_ignored(bus, published, counter):
+    bus._change(
+        change(
+            "update",
+            doc_id=ObjectId(),
+            updateDescription={
+                "updatedFields": {"use_count": 3, "last_used": 1},
+                "removedFields": [],
+            },
+        )
+    )
+    assert published == []
+    assert (
+        counter("cache_invalidations_ignored_total", resource="users_credentials") == 1
+    )
+
+
+def test_other_updates_invalidate_the_document(bus, published):
+    doc_id = ObjectId()
+    bus._change(
+        change(
+            "update",
+            doc_id=doc_id,
+            updateDescription={
+                "updatedFields": {"use_count": 3, "expires": 1},
+                "removedFields": [],
+            },
+        )
+    )
+    assert published == [("users_credentials", doc_id)]
+
+
+def test_removed_usage_fields_invalidate(bus, published):
+    doc_id = ObjectId()
+    bus._change(
+        change(
+            "update",
+            doc_id=doc_id,
+            updateDescription={"updatedFields": {}, "removedFields": ["use_count"]},
+        )
+    )
+    assert published == [("users_credentials", doc_id)]
+
+
+def test_usage_fields_only_apply_to_their_resource(bus, published):
+    doc_id = ObjectId()
+    bus._change(
+        change(
+            "update",
+            coll="users",
+            doc_id=doc_id,
+            updateDescription={"updatedFields": {"use_count": 1}},
+        )
+    )
+    assert published == [("users", doc_id)]
+
+
+def test_deletes_invalidate_the_document(bus, published):
+    doc_id = ObjectId()
+    bus._change(change("delete", coll="users", doc_id=doc_id))
+    assert published == [("users", doc_id)]
+
+
+def test_inserts_are_ignored(bus, published):
+    bus._change(change("insert", coll="users", doc_id=ObjectId()))
+    assert published == []
+
+
+def test_collection_events_invalidate_the_resource(bus, published):
+    bus._change(change("drop", coll="users"))
+    assert published == [("users", None)]
+
+
+def test_unknown_namespace_invalidates_everything(bus, published):
+    bus._change(change("dropDatabase", coll=None))
+    assert sorted(published) == [("users", None), ("users_credentials", None)]
+
+
+def test_poll_mode_publishes_writes_of_other_workers(log, metrics, collection):
+    db = {"cache_versions": collection("cache_versions")}
+    writer = InvalidationBus(
+        log=log, metrics=metrics, mongo_db=db, resources=["users"], mode="poll"
+    )
+    reader = InvalidationBus(
+        log=log,
+        metrics=metrics,
+        mongo_db=db,
+        resources=["users"],
+        mode="poll",
+        poll_interval=0.01,
+    )
+    published = []
+    reader.subscribe("users", published.append)
+
+    async def run():
+        writer.start()
+        reader.start()
+        await asyncio.sleep(0.05)
+        writer.written("users")
+        for _ in range(100):
+            if published:
+                break
+            await asyncio.sleep(0.01)
+        await writer.stop()
+        await reader.stop()
+
+    asyncio.run(run())
+    assert published == [None]
+
+
+@pytest.mark.skipif(
+    not os.environ.get("DUMMY_PROJECT_TEST_MONGODB_URL"),
+    reason="needs a replica set in DUMMY_PROJECT_TEST_MONGODB_URL",
+)
+def test_change_stream_invalidation_latency(log, metrics):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ["DUMMY_PROJECT_TEST_MONGODB_URL"])
+        db = client[f"test_invalidation_{os.getpid()}"]
+        coll = db["users_credentials"]
+        doc_id = (await coll.insert_one({"id": "c1", "use_count": 0})).inserted_id
+        cache = DocCache(log=log, metrics=metrics, name="users_credentials")
+        bus = InvalidationBus(
+            log=log,
+            metrics=metrics,
+            mongo_db=db,
+            resources=["users_credentials"],
+            ignored_fields={"users_credentials": ["last_used", "use_count"]},
+            mode="change_stream",
+        )
+        received = asyncio.Event()
+        invalidated = []
+
+        def invalidate(doc_id):
+            invalidated.append(doc_id)
+            cache.invalidate(doc_id)
+            received.set()
+
+        bus.subscribe("users_credentials", invalidate)
+        bus.start()
+        try:
+            await asyncio.sleep(1)
+            await coll.update_one({"_id": doc_id}, {"$inc": {"use_count": 1}})
+            start = time.monotonic()
+            await coll.update_one({"_id": doc_id}, {"$set": {"description": "x"}})
+            await asyncio.wait_for(received.wait(), timeout=5)
+            return time.monotonic() - start, invalidated, doc_id
+        finally:
+            await bus.stop()
+            await client.drop_database(db.name)
+            client.close()
+
+    latency, invalidated, doc_id = asyncio.run(run())
+    assert invalidated == [doc_id]
+    assert latency < 1.0
@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+
+import pytest
+
+import dummy_project.deadline as deadline
+
+from dummy_project.crud.jobs import CrudJobs
+from dummy_project.errors import DeadlineExceeded
+from dummy_project.teamjobs import TeamJobWorker
+
+
+@pytest.fixture
+def jobs(log, collection):
+    return CrudJobs(log=log, coll=collection("jobs"))
+
+
+def stale_job(mongo_db, _id, attempts):
+    mongo_db.jobs.insert_one(
+        {
+            "id": _id,
+            "team": "t",
+            "ldap_group": "g",
+            "status": "running",
+            "attempts": attempts,
+            "worker": "gone",
+            "heartbeat": datetime.datetime.utcnow() - datetime.timedelta(hours=1),
+            "created": datetime.datetime.utcnow(),
+            "deleting": False,
+        }
+    )
+
+
+def test_claim_fails_exhausted_stale_jobs(jobs, mongo_db):
+    stale_job(mongo_db, "exhausted", attempts=3)
+    stale_job(mongo_db, "retry", attempts=1)
+    job = asyncio.run(jobs.claim(worker="w", stale_after=30.0, max_attempts=3))
+    assert job["id"] == "retry"
+    assert job["attempts"] == 2
+    assert asyncio.run(jobs.claim(worker="w", stale_after=30.0, max_attempts=3)) is None
+    exhausted = mongo_db.jobs.find_one({"id": "exhausted"})
+    assert exhausted["status"] == "failed"
+    assert "worker" not in exhausted
+
+
+class FakeLdap:
+    async def get_logins_from_group(self, group, progress):
+        raise RuntimeError("boom")
+
+
+class HungLdap:
+    async def get_logins_from_group(self, group, progress):
+        await deadline.wait_for(asyncio.sleep(10))
+
+
+def queued_job(mongo_db):
+    mongo_db.jobs.insert_one(
+        {
+            "id": "j",
+            "team": "t",
+            "ldap_group": "g",
+            "status": "queued",
+            "attempts": 0,
+            "created": datetime.datetime.utcnow(),
+            "deleting": False,
+        }
+    )
+
+
+def test_unexpected_error_releases_job(log, metrics, counter, jobs, mongo_db):
+    queued_job(mongo_db)
+    worker = TeamJobWorker(
+        log=log, metrics=metrics, crud_jobs=jobs, crud_ldap=FakeLdap(), crud_teams=None
+    )
+
+    async def scenario():
+        for _ in range(worker.max_attempts):
+            job = await jobs.claim(
+                worker=worker._worker, stale_after=30.0, max_attempts=3
+            )
+            await worker._run(job=job)
+
+    asyncio.run(scenario())
+    job = mongo_db.jobs.find_one({"id": "j"})
+    assert job["status"] == "failed"
+    assert job["error"] == "boom"
+    assert counter("team_jobs_total", status="queued") == 2
+    assert counter("team_jobs_total", status="failed") == 1
+
+
+def test_hung_job_is_bounded_by_the_deadline(log, metrics, counter, jobs, mongo_db):
+    queued_job(mongo_db)
+    worker = TeamJobWorker(
+        log=log,
+        metrics=metrics,
+        crud_jobs=jobs,
+        crud_ldap=HungLdap(),
+        crud_teams=None,
+        timeout=0.1,
+    )
+
+    async def scenario():
+        job = await jobs.claim(worker=worker._worker, stale_after=30.0, max_attempts=3)
+        await asyncio.wait_for(worker._run(job=job), timeout=5)
+
+    asyncio.run(scenario())
+    job = mongo_db.jobs.find_one({"id": "j"})
+    assert job["status"] == "queued"
+    assert job["error"] == str(DeadlineExceeded())
+    assert counter("team_jobs_total", status="queued") == 1
+
+
+class FlakyHeartbeatJobs:
+    def __init__(self):
+        self.calls = 0
+
+    async def heartbeat(self, _id, worker, members):
+        self.calls += 1
+        if self.calls == 1:
+            raise RuntimeError("boom")
+
+
+def test_heartbeat_survives_unexpected_error(log, metrics):
+    jobs = FlakyHeartbeatJobs()
+    worker = TeamJobWorker(
+        log=log,
+        metrics=metrics,
+        crud_jobs=jobs,
+        crud_ldap=None,
+        crud_teams=None,
+        heartbeat_interval=0.01,
+    )
+
+    async def scenario():
+        heartbeat = asyncio.create_task(
+            worker._heartbeat(job={"id": "j"}, progress={"members": 0})
+        )
+        await asyncio.sleep(0.1)
+        assert not heartbeat.done()
+        heartbeat.cancel()
+
+    asyncio.run(scenario())
+    assert jobs.calls > 1
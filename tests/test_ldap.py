@@ -0,0 +1,221 @@
+import asyncio
+
+import bonsai.errors
+import pytest
+
+from dummy_project.crud.ldap import CrudLdap
+from dummy_project.errors import LdapResourceNotFound
+
+
+class DirectoryLdap(CrudLdap):
+    def __init__(self, log, entries, chain=None, **kwargs):
+        super(DirectoryLdap, self).__init__(
+            log=log,
+            ldap_base_dn="dc=example",
+            ldap_bind_dn="cn=bind,dc=example",
+            ldap_pool=None,
+            ldap_user_pattern="{}",
+            nested_groups=True,
+            **kwargs,
+        )
+        self.active = 0
+        self.chain = chain
+        self.entries = entries
+        self.peak = 0
+
+    async def _ldap_search(self, base_dn, scope, query, attrlist=None, hedge=False):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.001)
+        self.active -= 1
+        entry = self.entries.get(f"{query},{base_dn}")
+        return [] if entry is None else [entry]
+
+    async def _ldap_search_paged(self, base_dn, scope, query, attrlist=None):
+        if isinstance(self.chain, Exception):
+            raise self.chain
+        for login in self.chain or []:
+            yield {"sAMAccountName": [login]}
+
+
+def user(login):
+    return {"objectClass": ["user"], "sAMAccountName": [login]}
+
+
+def group(*members):
+    return {"objectClass": ["group"], "member": list(members)}
+
+
+@pytest.fixture
+def entries():
+    users = {f"cn=u{i},dc=example": user(f"u{i}") for i in range(50)}
+    return {
+        **users,
+        "cn=all,dc=example": group(*users, "cn=sub,dc=example"),
+        "cn=sub,dc=example": group("cn=u0,dc=example", "cn=all,dc=example"),
+        "cn=empty,dc=example": group(),
+    }
+
+
+def test_nested_resolution_caps_concurrency(log, entries):
+    ldap = DirectoryLdap(
+        log, entries, matching_rule_in_chain=False, nested_concurrency=4
+    )
+    logins = asyncio.run(ldap.get_logins_from_group_nested(group="cn=all,dc=example"))
+    assert logins == sorted(f"u{i}" for i in range(50))
+    assert ldap.peak == 4
+
+
+def test_empty_chain_result_does_not_fall_back(log, entries):
+    ldap = DirectoryLdap(log, entries, chain=[])
+    logins = asyncio.run(ldap.get_logins_from_group_nested(group="cn=all,dc=example"))
+    assert logins == []
+    assert ldap.matching_rule_in_chain
+    with pytest.raises(LdapResourceNotFound):
+        asyncio.run(ldap.get_logins_from_group_nested(group="cn=gone,dc=example"))
+
+
+class InappropriateMatching(bonsai.errors.LDAPError):
+    code = 0x12
+
+
+def test_unsupported_chain_query_falls_back(log, entries):
+    chain = InappropriateMatching("inappropriate matching")
+    ldap = DirectoryLdap(log, entries, chain=chain)
+    logins = asyncio.run(ldap.get_logins_from_group_nested(group="cn=sub,dc=example"))
+    assert logins == sorted(f"u{i}" for i in range(50))
+    assert not ldap.matching_rule_in_chain
+
+
+def test_failed_chain_query_falls_back_once(log, entries):
+    chain = bonsai.errors.SizeLimitError("size limit exceeded")
+    ldap = DirectoryLdap(log, entries, chain=chain)
+    logins = asyncio.run(ldap.get_logins_from_group_nested(group="cn=sub,dc=example"))
+    assert logins == sorted(f"u{i}" for i in range(50))
+    assert ldap.matching_rule_in_chain
+    ldap.chain = ["u1"]
+    logins = asyncio.run(ldap.get_logins_from_group_nested(group="cn=sub,dc=example"))
+    assert logins == ["u1"]
+
+
+class FakePool:
+    def __init__(self, name, fails):
+        self.fails = fails
+        self.name = name
+
+
+class FakePools:
+    hedge = True
+
+    def __init__(self, pools):
+        self.pools = pools
+
+    def select(self, exclude=()):
+        return [pool for pool in self.pools if pool not in exclude] or self.pools
+
+    def hedge_delay(self, pool):
+        return 0.001
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+
+class FailoverLdap(CrudLdap):
+    def __init__(self, log, metrics, pools):
+        ldap_pool = FakePools(pools)
+        ldap_pool._metrics = metrics
+        super(FailoverLdap, self).__init__(
+            log=log,
+            ldap_base_dn="dc=example",
+            ldap_bind_dn="cn=bind,dc=example",
+            ldap_pool=ldap_pool,
+            ldap_user_pattern="{}",
+        )
+        self.calls = []
+
+    async def _ldap_search_pool(self, pool, base_dn, scope, query, attrlist=None):
+        self.calls.append(pool.name)
+        await asyncio.sleep(0.01)
+        if pool.fails:
+            raise bonsai.errors.ConnectionError(pool.name)
+        return [pool.name]
+
+    async def _check_user_credentials_pool(self, pool, user, password):
+        self.calls.append(pool.name)
+        if pool.fails:
+            raise bonsai.errors.ConnectionError(pool.name)
+        return pool.name
+
+
+@pytest.fixture
+def failover(log, metrics):
+    pools = [FakePool("a", True), FakePool("b", True), FakePool("c", False)]
+    return FailoverLdap(log, metrics, pools)
+
+
+def test_hedged_retry_skips_every_failed_pool(failover):
+    result = asyncio.run(
+        failover._ldap_search(base_dn="dc=example", scope=2, query="q", hedge=True)
+    )
+    assert result == ["c"]
+    assert failover.calls == ["a", "b", "c"]
+
+
+def test_credentials_check_fails_over(failover):
+    result = asyncio.run(failover.check_user_credentials(user="u", password="p"))
+    assert result == "c"
+    assert failover.calls == ["a", "b", "c"]
+
+
+class BatchLdap(CrudLdap):
+    def __init__(self, log, members, fail=None):
+        super(BatchLdap, self).__init__(
+            log=log,
+            ldap_base_dn="dc=example",
+            ldap_bind_dn="cn=bind,dc=example",
+            ldap_pool=None,
+            ldap_user_pattern="{}",
+            nested_concurrency=3,
+            batch_size=10,
+        )
+        self.active = 0
+        self.cancelled = 0
+        self.fail = fail
+        self.members = members
+        self.peak = 0
+
+    async def iter_group_members(self, group, start=None):
+        for member in self.members:
+            yield member
+
+    async def get_logins_batch(self, members):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(0.01 if members[0] != self.fail else 0.001)
+            if members[0] == self.fail:
+                raise bonsai.errors.ConnectionError("down")
+            return list(members)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+
+
+def test_member_batches_are_bounded_and_ordered(log):
+    members = [f"u{i:03d}" for i in range(95)]
+    ldap = BatchLdap(log, members)
+    logins = asyncio.run(ldap.get_logins_from_group(group="cn=all,dc=example"))
+    assert logins == members
+    assert ldap.peak == 3
+
+
+def test_failed_member_batch_cancels_the_others(log):
+    members = [f"u{i:03d}" for i in range(95)]
+    ldap = BatchLdap(log, members, fail="u020")
+    with pytest.raises(bonsai.errors.ConnectionError):
+        asyncio.run(ldap.get_logins_from_group(group="cn=all,dc=example"))
+    assert ldap.cancelled == 2
+    assert ldap.active == 0
@@ -0,0 +1,102 @@
+import asyncio
+
+import dummy_project.deadline as deadline
+
+from dummy_project.ldapsync import LdapTeamSync
+
+
+class FakeLease:
+    def __init__(self, results):
+        self.calls = 0
+        self.results = results
+
+    async def acquire(self, name, holder, ttl):
+        self.calls += 1
+        result = self.results[min(self.calls, len(self.results)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def release(self, name, holder):
+        pass
+
+
+class FakeLdap:
+    async def get_group_changed(self, group):
+        return None
+
+    async def get_logins_from_group(self, group, memo):
+        if group == "broken":
+            raise RuntimeError("boom")
+        if group == "hung":
+            await deadline.wait_for(asyncio.sleep(10))
+        await asyncio.sleep(0.05)
+        return ["a"]
+
+
+class FakeTeams:
+    def __init__(self, teams):
+        self.synced = []
+        self.teams = teams
+
+    async def ldap_teams(self):
+        return self.teams
+
+    async def ldap_sync(self, _id, ldap_group, users, ldap_changed):
+        self.synced.append(_id)
+        return {"users_added": len(users)}
+
+
+def sync(log, metrics, lease, teams, **kwargs):
+    return LdapTeamSync(
+        log=log,
+        metrics=metrics,
+        crud_lease=lease,
+        crud_ldap=FakeLdap(),
+        crud_teams=teams,
+        jitter=0.0,
+        **kwargs,
+    )
+
+
+def test_loop_survives_unexpected_errors(log, metrics, counter):
+    lease = FakeLease([RuntimeError("boom"), False])
+    ldap_sync = sync(log, metrics, lease, FakeTeams([]), interval=0.01)
+
+    async def scenario():
+        ldap_sync.start()
+        await asyncio.sleep(0.1)
+        await ldap_sync.stop()
+
+    asyncio.run(scenario())
+    assert lease.calls > 1
+    assert counter("ldap_sync_runs_failed_total") == 1
+
+
+def test_failing_team_does_not_abort_run(log, metrics):
+    teams = FakeTeams(
+        [{"id": "a", "ldap_group": "ok"}, {"id": "b", "ldap_group": "broken"}]
+    )
+    ldap_sync = sync(log, metrics, FakeLease([True]), teams)
+    stats = asyncio.run(ldap_sync.run())
+    assert stats == {"synced": 1, "failed": 1}
+    assert teams.synced == ["a"]
+
+
+def test_long_run_renews_and_stops_when_lease_lost(log, metrics):
+    teams = FakeTeams([{"id": str(i), "ldap_group": "ok"} for i in range(4)])
+    lease = FakeLease([True, False])
+    ldap_sync = sync(log, metrics, lease, teams, concurrency=1, lease_ttl=0.06)
+    asyncio.run(ldap_sync._run_leased())
+    assert lease.calls == 2
+    assert 0 < len(teams.synced) < 4
+
+
+def test_hung_team_is_bounded_by_the_deadline(log, metrics):
+    teams = FakeTeams(
+        [{"id": "a", "ldap_group": "ok"}, {"id": "b", "ldap_group": "hung"}]
+    )
+    ldap_sync = sync(log, metrics, FakeLease([True]), teams, timeout=0.1)
+    stats = asyncio.run(asyncio.wait_for(ldap_sync.run(), timeout=5))
+    assert stats == {"synced": 1, "failed": 1}
+    assert teams.synced == ["a"]
@@ -0,0 +1,206 @@
+import asyncio
+import time
+
+from authlib.integrations.starlette_client import OAuth
+import httpx
+import pytest
+
+import dummy_project.crud.oauth as crud_oauth
+from dummy_project.crud.oauth import CrudOAuthGitHub
+from dummy_project.crud.oauth import CrudOAuthOIDC
+from dummy_project.errors import AuthenticationError
+
+
+def github(log, responses, handler=None):
+    def respond(request):
+        status, payload = responses[request.url.path]
+        return httpx.Response(status, json=payload)
+
+    return CrudOAuthGitHub(
+        log=log,
+        http=httpx.AsyncClient(transport=httpx.MockTransport(handler or respond)),
+        backend_override=False,
+        name="github",
+        oauth=OAuth(),
+        scope="user:email",
+        client_id="id",
+        client_secret="secret",
+        authorize_url="https://github.test/authorize",
+        access_token_url="https://github.test/token",
+        userinfo_url="https://api.github.test/user",
+        useremails_url="https://api.github.test/user/emails",
+    )
+
+
+def user_info(crud):
+    return asyncio.run(crud.get_user_info({"access_token": "token"}))
+
+
+def test_primary_verified_email_is_used(log):
+    crud = github(
+        log,
+        {
+            "/user": (200, {"login": "a", "email": None}),
+            "/user/emails": (
+                200,
+                [
+                    "junk",
+                    {"email": "x@test", "primary": True, "verified": False},
+                    {"email": "a@test", "primary": True, "verified": True},
+                ],
+            ),
+        },
+    )
+    assert user_info(crud) == {"login": "a", "email": "a@test"}
+
+
+@pytest.mark.parametrize(
+    "responses",
+    [
+        {"/user": (401, {"message": "Bad credentials"}), "/user/emails": (200, [])},
+        {"/user": (200, ["a"]), "/user/emails": (200, [])},
+        {"/user": (200, {"email": "a@test"}), "/user/emails": (200, [])},
+        {"/user": (200, {"login": 1}), "/user/emails": (200, [])},
+        {"/user": (200, {"login": "a"}), "/user/emails": (403, {"message": "no"})},
+        {"/user": (200, {"login": "a"}), "/user/emails": (200, {"message": "no"})},
+    ],
+)
+def test_provider_failures_are_authentication_errors(log, responses):
+    with pytest.raises(AuthenticationError):
+        user_info(github(log, responses))
+
+
+class Provider:
+    def __init__(self):
+        self.jwks = {"keys": [{"kid": "one"}]}
+        self.requests = []
+        self.responses = {}
+
+    def __call__(self, request):
+        self.requests.append(request.url.path)
+        response = self.responses.get(request.url.path)
+        if isinstance(response, Exception):
+            raise response
+        if response is not None:
+            return response
+        if request.url.path == "/.well-known/openid-configuration":
+            return httpx.Response(
+                200,
+                json={
+                    "issuer": "https://idp.test",
+                    "authorization_endpoint": "https://idp.test/authorize",
+                    "token_endpoint": "https://idp.test/token",
+                    "jwks_uri": "https://idp.test/jwks",
+                },
+            )
+        return httpx.Response(200, json=self.jwks)
+
+
+@pytest.fixture
+def provider():
+    return Provider()
+
+
+@pytest.fixture
+def oidc(log, provider):
+    return CrudOAuthOIDC(
+        log=log,
+        http=httpx.AsyncClient(transport=httpx.MockTransport(provider)),
+        backend_override=False,
+        name="oidc",
+        oauth=OAuth(),
+        scope="openid",
+        client_id="id",
+        client_secret="secret",
+        discovery_url="https://idp.test/.well-known/openid-configuration",
+        metadata_ttl=60,
+    )
+
+
+def test_discovery_and_jwks_are_cached(oidc, provider):
+    async def scenario():
+        await oidc.jwks()
+        await oidc.jwks()
+        return await oidc.metadata()
+
+    metadata = asyncio.run(scenario())
+    assert metadata["token_endpoint"] == "https://idp.test/token"
+    assert provider.requests == ["/.well-known/openid-configuration", "/jwks"]
+
+
+def test_discovery_and_jwks_are_reloaded_after_ttl(oidc, provider, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(crud_oauth.time, "monotonic", lambda: now[0])
+    asyncio.run(oidc.jwks())
+    now[0] += 61
+    provider.jwks = {"keys": [{"kid": "two"}]}
+    assert asyncio.run(oidc.jwks()) == {"keys": [{"kid": "two"}]}
+    assert provider.requests == [
+        "/.well-known/openid-configuration",
+        "/jwks",
+        "/.well-known/openid-configuration",
+        "/jwks",
+    ]
+
+
+def test_key_rotation_refreshes_jwks(oidc, provider):
+    asyncio.run(oidc.jwks())
+    provider.jwks = {"keys": [{"kid": "two"}]}
+    assert asyncio.run(oidc.client.fetch_jwk_set()) == {"keys": [{"kid": "one"}]}
+    jwks = asyncio.run(oidc.client.fetch_jwk_set(force=True))
+    assert jwks == {"keys": [{"kid": "two"}]}
+    assert provider.requests.count("/jwks") == 2
+
+
+@pytest.mark.parametrize(
+    "path, response",
+    [
+        ("/.well-known/openid-configuration", httpx.Response(503)),
+        ("/.well-known/openid-configuration", httpx.Response(200, text="<html>")),
+        ("/jwks", httpx.Response(500)),
+        ("/jwks", httpx.Response(200, json=["key"])),
+        ("/.well-known/openid-configuration", httpx.ConnectError("refused")),
+        ("/jwks", httpx.ReadTimeout("timed out")),
+    ],
+)
+def test_discovery_failures_are_authentication_errors(oidc, provider, path, response):
+    provider.responses[path] = response
+    with pytest.raises(AuthenticationError):
+        asyncio.run(oidc.jwks())
+
+
+def test_missing_login_claim_is_rejected(oidc):
+    with pytest.raises(AuthenticationError):
+        asyncio.run(oidc.get_user_info({"userinfo": {"sub": "opaque"}}))
+    user = asyncio.run(
+        oidc.get_user_info({"userinfo": {"sub": "opaque", "preferred_username": "a"}})
+    )
+    assert user["login"] == "a"
+
+
+def test_github_user_info_calls_overlap(log):
+    latency = 0.05
+    active = {"now": 0, "peak": 0}
+
+    async def handler(request):
+        active["now"] += 1
+        active["peak"] = max(active["peak"], active["now"])
+        await asyncio.sleep(latency)
+        active["now"] -= 1
+        if request.url.path == "/user/emails":
+            return httpx.Response(
+                200, json=[{"email": "a@test", "primary": True, "verified": True}]
+            )
+        return httpx.Response(200, json={"login": "a", "email": None})
+
+    crud = github(log, {}, handler=handler)
+
+    async def scenario():
+        start = time.monotonic()
+        for _ in range(10):
+            await crud.get_user_info({"access_token": "token"})
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(scenario())
+    assert active["peak"] == 2
+    assert elapsed < 10 * latency * 1.5
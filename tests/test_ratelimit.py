@@ -0,0 +1,131 @@
+import asyncio
+import types
+
+import pytest
+
+from dummy_project.authorize import Authorize
+
+from dummy_project.errors import CredentialError
+from dummy_project.errors import RateLimitError
+
+from dummy_project.ratelimit import RateLimiter
+from dummy_project.ratelimit import RateLimits
+
+
+def request(host="10.0.0.1", **headers):
+    return types.SimpleNamespace(
+        client=types.SimpleNamespace(host=host), headers=headers
+    )
+
+
+@pytest.fixture
+def ratelimits(log, metrics):
+    limiters = {
+        name: RateLimiter(log=log, metrics=metrics, name=name, rate=0.001, burst=2)
+        for name in ("client", "credential", "credentialclient")
+    }
+    return RateLimits(
+        log=log,
+        metrics=metrics,
+        limiters=limiters,
+        trusted_proxies=["127.0.0.1", "10.1.0.0/16"],
+    )
+
+
+def test_bucket_allows_burst_then_rejects(ratelimits, counter):
+    ratelimits.check("client", "a")
+    ratelimits.check("client", "a")
+    with pytest.raises(RateLimitError):
+        ratelimits.check("client", "a")
+    ratelimits.check("client", "b")
+    assert counter("ratelimit_rejected_total", limiter="client") == 1
+
+
+def test_peek_does_not_consume(ratelimits):
+    for _ in range(5):
+        ratelimits.peek("client", "a")
+    ratelimits.charge("client", "a")
+    ratelimits.charge("client", "a")
+    ratelimits.charge("client", "a")
+    with pytest.raises(RateLimitError):
+        ratelimits.peek("client", "a")
+
+
+def test_disabled_rate_limits_never_reject(log, metrics):
+    limiter = RateLimiter(log=log, metrics=metrics, name="client", rate=1, burst=1)
+    ratelimits = RateLimits(
+        log=log, metrics=metrics, limiters={"client": limiter}, enabled=False
+    )
+    for _ in range(5):
+        ratelimits.check("client", "a")
+
+
+def test_client_without_trusted_proxy(ratelimits):
+    assert (
+        ratelimits.client(request("192.0.2.1", **{"x-forwarded-for": "1.2.3.4"}))
+        == "192.0.2.1"
+    )
+
+
+def test_client_behind_trusted_proxies(ratelimits):
+    forwarded = {"x-forwarded-for": "6.6.6.6, 192.0.2.7, 10.1.2.3"}
+    assert ratelimits.client(request("127.0.0.1", **forwarded)) == "192.0.2.7"
+    assert ratelimits.client(request("127.0.0.1")) == "127.0.0.1"
+
+
+def test_client_without_connection(ratelimits):
+    assert ratelimits.client(types.SimpleNamespace(client=None, headers={})) is None
+
+
+class Credentials:
+    def __init__(self):
+        self.valid = True
+
+    async def check_credential(self, request):
+        if not self.valid:
+            raise CredentialError
+        return "alice"
+
+
+@pytest.fixture
+def authorize(log, ratelimits):
+    return Authorize(
+        log=log,
+        crud_audit=types.SimpleNamespace(record=lambda **kwargs: None),
+        crud_teams=None,
+        crud_users=None,
+        crud_users_credentials=Credentials(),
+        ratelimits=ratelimits,
+    )
+
+
+def test_successful_credentials_are_not_limited(authorize):
+    async def run():
+        for _ in range(10):
+            assert (
+                await authorize.get_user_from_credentials(
+                    request(**{"x-secret-id": "c1", "x-secret": "s"})
+                )
+                == "alice"
+            )
+
+    asyncio.run(run())
+
+
+def test_failed_credentials_are_limited(authorize):
+    authorize.crud_users_credentials.valid = False
+
+    async def run():
+        for _ in range(2):
+            assert (
+                await authorize.get_user_from_credentials(
+                    request(**{"x-secret-id": "c1", "x-secret": "s"})
+                )
+                is None
+            )
+        with pytest.raises(RateLimitError):
+            await authorize.get_user_from_credentials(
+                request(**{"x-secret-id": "c1", "x-secret": "s"})
+            )
+
+    asyncio.run(run())
@@ -0,0 +1,74 @@
+import asyncio
+
+from dummy_project.reaper import DeleteReaper
+
+
+class FakeLease:
+    def __init__(self, results):
+        self.calls = 0
+        self.results = results
+
+    async def acquire(self, name, holder, ttl):
+        self.calls += 1
+        result = self.results[min(self.calls, len(self.results)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def release(self, name, holder):
+        pass
+
+
+class FakeCrud:
+    def __init__(self, ids):
+        self.ids = ids
+
+    async def deleting(self, grace, limit):
+        return self.ids[:limit]
+
+    async def delete(self, _id):
+        if _id == "broken":
+            raise RuntimeError("boom")
+        self.ids.remove(_id)
+
+
+class FakeDeletion:
+    def __init__(self, crud):
+        self.delete = crud.delete
+
+
+def reaper(log, metrics, lease, users, teams, **kwargs):
+    return DeleteReaper(
+        log=log,
+        metrics=metrics,
+        crud_lease=lease,
+        crud_teams=teams,
+        crud_users=users,
+        user_deletion=FakeDeletion(users),
+        **kwargs,
+    )
+
+
+def test_unexpected_error_skips_only_that_id(log, metrics, counter):
+    users = FakeCrud(["a", "broken", "b"])
+    teams = FakeCrud(["t"])
+    stats = asyncio.run(reaper(log, metrics, FakeLease([True]), users, teams).run())
+    assert stats == {"users": 2, "teams": 1}
+    assert users.ids == ["broken"]
+    assert counter("reaper_failed_total", resource="users") == 1
+
+
+def test_loop_survives_unexpected_errors(log, metrics, counter):
+    lease = FakeLease([RuntimeError("boom"), False])
+    delete_reaper = reaper(
+        log, metrics, lease, FakeCrud([]), FakeCrud([]), interval=0.01
+    )
+
+    async def scenario():
+        delete_reaper.start()
+        await asyncio.sleep(0.1)
+        await delete_reaper.stop()
+
+    asyncio.run(scenario())
+    assert lease.calls > 1
+    assert counter("reaper_runs_failed_total") == 1
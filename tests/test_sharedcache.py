@@ -0,0 +1,201 @@
+import asyncio
+import fcntl
+import os
+import time
+
+import pytest
+
+from dummy_project.sharedcache import SharedAuthCache
+from dummy_project.sharedcache import SharedTable
+
+
+@pytest.fixture
+def tables(log, tmp_path):
+    opened = []
+
+    def factory(scope="mongodb://localhost/test"):
+        table = SharedTable(
+            log=log,
+            name="test",
+            scope=scope,
+            slots=16,
+            value_size=64,
+            directory=str(tmp_path),
+        )
+        opened.append(table)
+        return table
+
+    yield factory
+    for table in opened:
+        if table._buf is not None:
+            table.close()
+
+
+@pytest.fixture
+def cache(log, metrics, tables):
+    return SharedAuthCache(log=log, metrics=metrics, table=tables(), ttl=30.0)
+
+
+def test_put_is_visible_to_other_attachments(tables):
+    first = tables()
+    second = tables()
+    assert first.put(0, "key", "doc", b"value", 30.0, generation=first.generation(0))
+    assert second.get(0, "key") == b"value"
+    assert second.get(1, "key") is None
+
+
+def test_put_with_stale_generation_is_dropped(tables):
+    table = tables()
+    generation = table.generation(0)
+    table.invalidate(0)
+    assert not table.put(0, "key", "doc", b"stale", 30.0, generation=generation)
+    assert table.get(0, "key") is None
+
+
+def test_invalidate_hides_entries_of_one_kind(tables):
+    first = tables()
+    second = tables()
+    first.put(0, "a", "doc", b"1", 30.0, generation=first.generation(0))
+    first.put(1, "a", "doc", b"2", 30.0, generation=first.generation(1))
+    second.invalidate(0)
+    assert first.get(0, "a") is None
+    assert first.get(1, "a") == b"2"
+
+
+def test_invalidate_document_hides_only_its_entries(tables):
+    table = tables()
+    generation = table.generation(0)
+    table.put(0, "a", "doc-a", b"1", 30.0, generation=generation)
+    table.put(0, "b", "doc-b", b"2", 30.0, generation=generation)
+    table.invalidate(0, "doc-a", 30.0)
+    assert table.get(0, "a") is None
+    assert table.get(0, "b") == b"2"
+    assert table.put(0, "a", "doc-a", b"3", 30.0, generation=table.generation(0))
+    assert table.get(0, "a") == b"3"
+
+
+def test_put_racing_a_document_invalidation_is_dropped(tables):
+    table = tables()
+    generation = table.generation(0)
+    table.invalidate(0, "doc-a", 30.0)
+    assert not table.put(0, "a", "doc-a", b"stale", 30.0, generation=generation)
+    assert table.put(0, "b", "doc-b", b"fresh", 30.0, generation=generation)
+
+
+def test_document_invalidation_falls_back_to_clearing_the_kind(tables):
+    table = tables()
+    generation = table.generation(0)
+    for index in range(64):
+        table.put(0, f"key{index}", f"doc{index}", b"1", 30.0, generation=generation)
+    for index in range(64):
+        table.invalidate(0, f"other{index}", 30.0)
+    assert table._cleared(0) > generation
+    for index in range(64):
+        assert table.get(0, f"key{index}") is None
+
+
+def test_expired_entries_are_ignored(tables):
+    table = tables()
+    table.put(0, "key", "doc", b"value", 0.01, generation=table.generation(0))
+    time.sleep(0.02)
+    assert table.get(0, "key") is None
+
+
+def test_oversized_values_are_not_stored(tables):
+    table = tables()
+    assert not table.put(
+        0, "key", "doc", b"x" * 65, 30.0, generation=table.generation(0)
+    )
+
+
+def test_put_does_not_wait_for_a_held_lock(tables):
+    table = tables()
+    fd = os.open(table.path, os.O_RDWR)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        start = time.monotonic()
+        assert not table.put(0, "key", "doc", b"value", 30.0, generation=0)
+        assert time.monotonic() - start < 0.1
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def test_slots_are_reused_when_full(tables):
+    table = tables()
+    for index in range(64):
+        table.put(
+            0, f"key{index}", "doc", b"value", 30.0, generation=table.generation(0)
+        )
+    assert table.get(0, "key63") == b"value"
+
+
+def test_credential_requires_matching_secret(cache):
+    generation = cache.credentials_generation
+    cache.credential_put(
+        _id="c1",
+        doc_id="d1",
+        secret="s3cret",
+        owner="alice",
+        expires=None,
+        generation=generation,
+    )
+    assert cache.credential_get(_id="c1", secret="s3cret") == "alice"
+    assert cache.credential_get(_id="c1", secret="wrong") is None
+
+
+def test_credential_respects_expiry(cache):
+    cache.credential_put(
+        _id="c1",
+        doc_id="d1",
+        secret="s3cret",
+        owner="alice",
+        expires=time.time() - 1,
+        generation=cache.credentials_generation,
+    )
+    assert cache.credential_get(_id="c1", secret="s3cret") is None
+
+
+def test_credential_written_during_lookup_is_not_cached(cache):
+    generation = cache.credentials_generation
+    cache.invalidate_credentials()
+    cache.credential_put(
+        _id="c1",
+        doc_id="d1",
+        secret="s3cret",
+        owner="alice",
+        expires=None,
+        generation=generation,
+    )
+    assert cache.credential_get(_id="c1", secret="s3cret") is None
+
+
+def test_tables_of_different_databases_are_separate(tables):
+    first = tables(scope="mongodb://localhost/one")
+    second = tables(scope="mongodb://localhost/two")
+    assert first.path != second.path
+    first.put(1, "alice", "doc", b"\x01", 30.0, generation=first.generation(1))
+    assert second.get(1, "alice") is None
+
+
+def test_table_is_reset_once_all_attachments_are_gone(tables):
+    first = tables()
+    first.put(0, "key", "doc", b"value", 30.0, generation=first.generation(0))
+    second = tables()
+    assert second.get(0, "key") == b"value"
+    first.close()
+    second.close()
+    assert tables().get(0, "key") is None
+
+
+def test_invalidation_in_event_loop_is_visible_on_return(cache):
+    async def run():
+        cache.admin_put(
+            user="alice", doc_id="d1", admin=True, generation=cache.users_generation
+        )
+        assert cache.admin_get(user="alice") is True
+        cache.invalidate_users("d1")
+        assert cache.admin_get(user="alice") is None
+        await cache.close()
+
+    asyncio.run(run())
@@ -0,0 +1,149 @@
+import asyncio
+import types
+
+import pytest
+
+import dummy_project.deadline as deadline
+
+from dummy_project.crud.common import CrudMongo
+from dummy_project.crud.common import mongo_session
+
+from dummy_project.errors import DeadlineExceeded
+
+from dummy_project.singleflight import SingleFlight
+
+
+@pytest.fixture
+def flight(log, metrics):
+    return SingleFlight(log=log, metrics=metrics, name="test", timeout=5.0)
+
+
+def test_concurrent_calls_are_collapsed(flight, counter):
+    calls = []
+
+    async def lookup(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return [value]
+
+    async def run():
+        return await asyncio.gather(
+            *(flight.do("key", lookup, value=1) for _ in range(10))
+        )
+
+    results = asyncio.run(run())
+    assert calls == [1]
+    assert results == [[1]] * 10
+    assert len({id(result) for result in results}) == 10
+    assert counter("singleflight_calls_total", flight="test") == 1
+    assert counter("singleflight_collapsed_total", flight="test") == 9
+    assert not flight._calls
+
+
+def test_different_keys_are_not_collapsed(flight):
+    calls = []
+
+    async def lookup(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def run():
+        return await asyncio.gather(
+            flight.do("a", lookup, value="a"), flight.do("b", lookup, value="b")
+        )
+
+    assert asyncio.run(run()) == ["a", "b"]
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_errors_reach_every_caller(flight):
+    async def lookup():
+        await asyncio.sleep(0.01)
+        raise ValueError("failed")
+
+    async def run():
+        return await asyncio.gather(
+            *(flight.do("key", lookup) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert not flight._calls
+
+
+def test_cancelled_leader_does_not_cancel_followers(flight):
+    async def lookup():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        leader = asyncio.create_task(flight.do("key", lookup))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("key", lookup))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_shared_call_does_not_inherit_caller_context(flight):
+    seen = {}
+
+    async def lookup():
+        seen["session"] = mongo_session.get()
+        seen["remaining"] = deadline.remaining()
+
+    async def run():
+        token = mongo_session.set("request session")
+        deadline.start(timeout=0.5)
+        try:
+            await flight.do("key", lookup)
+        finally:
+            mongo_session.reset(token)
+
+    asyncio.run(run())
+    assert seen["session"] is None
+    assert 4.0 < seen["remaining"] <= 5.0
+
+
+def test_follower_honours_its_own_deadline(flight):
+    async def lookup():
+        await asyncio.sleep(0.2)
+        return "done"
+
+    async def follower():
+        deadline.start(timeout=0.01)
+        return await flight.do("key", lookup)
+
+    async def run():
+        leader = asyncio.create_task(flight.do("key", lookup))
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceeded):
+            await follower()
+        return await leader
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_collapse_runs_outside_transactions(log, metrics, counter):
+    flight = SingleFlight(log=log, metrics=metrics, name="crud")
+    crud = CrudMongo(
+        log=log, coll=types.SimpleNamespace(name="things"), singleflight=flight
+    )
+
+    async def lookup():
+        return "done"
+
+    async def run(session):
+        token = mongo_session.set(session)
+        try:
+            return await crud._collapse("key", lookup)
+        finally:
+            mongo_session.reset(token)
+
+    asyncio.run(run(types.SimpleNamespace(in_transaction=False)))
+    assert counter("singleflight_calls_total", flight="crud") == 1
+    asyncio.run(run(types.SimpleNamespace(in_transaction=True)))
+    assert counter("singleflight_calls_total", flight="crud") == 1
@@ -0,0 +1,186 @@
+import asyncio
+
+import bson
+import pytest
+
+from dummy_project.crud.team_members import CrudTeamMembers
+from dummy_project.crud.teams import CrudTeams
+from dummy_project.errors import ConflictError
+from dummy_project.model.teams import TeamPost
+from dummy_project.model.teams import TeamPut
+
+
+@pytest.fixture
+def members(log, collection):
+    crud = CrudTeamMembers(log=log, coll=collection("team_members"), chunk_size=2)
+    asyncio.run(crud.index_create())
+    return crud
+
+
+@pytest.fixture
+def teams(log, collection, members):
+    return CrudTeams(log=log, coll=collection("teams"), crud_team_members=members)
+
+
+def rows(mongo_db, team):
+    return sorted(
+        row["user"] for row in mongo_db.team_members.find({"team": team}, {"_id": 0})
+    )
+
+
+def test_users_migrate_is_add_only_and_rerunnable(teams, mongo_db):
+    mongo_db.teams.insert_one({"id": "t", "deleting": False, "users": ["a", "b", "a"]})
+    assert asyncio.run(teams.users_migrate()) == 1
+    assert rows(mongo_db, "t") == ["a", "b"]
+    mongo_db.team_members.delete_one({"team": "t", "user": "a"})
+    mongo_db.team_members.insert_one({"team": "t", "user": "c"})
+    assert asyncio.run(teams.users_migrate(prune=True)) == 0
+    assert rows(mongo_db, "t") == ["b", "c"]
+    assert "users" not in mongo_db.teams.find_one({"id": "t"})
+
+
+def test_create_cleans_up_when_members_fail(teams, members, mongo_db, monkeypatch):
+    async def fail(team, users):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(members, "add", fail)
+    with pytest.raises(RuntimeError):
+        asyncio.run(teams.create(_id="t", payload=TeamPost(users=["a"]), fields=["id"]))
+    assert mongo_db.teams.find_one({"id": "t"}) is None
+
+
+def test_create_is_hidden_until_members_are_written(teams, members, mongo_db):
+    seen = []
+    add = members.add
+
+    async def spy(team, users):
+        seen.append(mongo_db.teams.find_one({"id": team})["deleting"])
+        await add(team=team, users=users)
+
+    members.add = spy
+    result = asyncio.run(
+        teams.create(_id="t", payload=TeamPost(users=["a", "b"]), fields=["id"])
+    )
+    assert result.id == "t"
+    assert seen == [True]
+    team = mongo_db.teams.find_one({"id": "t"})
+    assert team["deleting"] is False
+    assert "deleting_since" not in team
+    assert rows(mongo_db, "t") == ["a", "b"]
+
+
+@pytest.fixture
+def embedded(log, collection):
+    return CrudTeams(log=log, coll=collection("teams"), users_chunk_size=2)
+
+
+def test_update_applies_members_in_chunks(embedded, mongo_db):
+    mongo_db.teams.insert_one({"id": "t", "deleting": False, "users": ["a", "b"]})
+    diff = asyncio.run(
+        embedded._users_apply(query={"id": "t"}, users=["b", "c", "d", "e"])
+    )
+    assert diff == {"users_added": 3, "users_removed": 1}
+    team = mongo_db.teams.find_one({"id": "t"})
+    assert sorted(team["users"]) == ["b", "c", "d", "e"]
+    assert team["users_version"] == 1
+
+
+@pytest.fixture
+def member_updates(embedded, monkeypatch):
+    updates = []
+    update_one = embedded.coll.update_one
+
+    async def spy(filter, update, session=None):
+        if "$pull" in update or "$addToSet" in update:
+            updates.append((filter, update))
+        return await update_one(filter=filter, update=update, session=session)
+
+    monkeypatch.setattr(embedded.coll, "update_one", spy)
+    return updates
+
+
+def test_update_returns_member_diff(embedded, member_updates, mongo_db):
+    mongo_db.teams.insert_one({"id": "t", "deleting": False, "users": ["a", "b", "c"]})
+    result = asyncio.run(
+        embedded.update(
+            _id="t",
+            payload=TeamPut(users=["c", "d", "e", "f", "g"]),
+            fields=["id", "users"],
+        )
+    )
+    assert result.users_added == 4
+    assert result.users_removed == 2
+    assert sorted(result.users) == ["c", "d", "e", "f", "g"]
+    ops = [
+        (op, sorted(*value["users"].values()))
+        for _, update in member_updates
+        for op, value in update.items()
+    ]
+    assert ops == [
+        ("$pull", ["a", "b"]),
+        ("$addToSet", ["d", "e"]),
+        ("$addToSet", ["f", "g"]),
+    ]
+    assert all(query["users_version"] == 1 for query, _ in member_updates)
+
+
+def test_member_diff_is_smaller_than_full_array_set(
+    log, collection, mongo_db, monkeypatch
+):
+    teams = CrudTeams(log=log, coll=collection("teams"), users_chunk_size=1000)
+    users = [f"user{index:05d}" for index in range(20000)]
+    mongo_db.teams.insert_one({"id": "t", "deleting": False, "users": users})
+    wanted = users[10:] + [f"new{index}" for index in range(10)]
+    sent = []
+    update_one = teams.coll.update_one
+
+    async def spy(filter, update, session=None):
+        sent.append(len(bson.encode(update)))
+        return await update_one(filter=filter, update=update, session=session)
+
+    monkeypatch.setattr(teams.coll, "update_one", spy)
+    asyncio.run(teams._users_apply(query={"id": "t"}, users=wanted))
+    assert sorted(mongo_db.teams.find_one({"id": "t"})["users"]) == sorted(wanted)
+    assert sum(sent) * 100 < len(bson.encode({"$set": {"users": wanted}}))
+
+
+def test_concurrent_member_update_does_not_merge(embedded, mongo_db, monkeypatch):
+    mongo_db.teams.insert_one({"id": "t", "deleting": False, "users": ["a"]})
+    write = embedded._users_write
+    calls = []
+
+    async def interfere(query, current, users):
+        calls.append(current["users_version"])
+        if len(calls) == 1:
+            mongo_db.teams.update_one(
+                {"id": "t"}, {"$set": {"users": ["x"]}, "$inc": {"users_version": 1}}
+            )
+        return await write(query, current, users)
+
+    monkeypatch.setattr(embedded, "_users_write", interfere)
+    asyncio.run(embedded._users_apply(query={"id": "t"}, users=["a", "b"]))
+    assert calls == [1, 3]
+    assert sorted(mongo_db.teams.find_one({"id": "t"})["users"]) == ["a", "b"]
+
+
+def test_concurrent_member_update_gives_up(teams, members, mongo_db, monkeypatch):
+    mongo_db.teams.insert_one({"id": "t", "deleting": False})
+    add = members.add
+
+    async def interfere(team, users):
+        await add(team=team, users=users)
+        mongo_db.team_members.delete_many({"team": team})
+        mongo_db.teams.update_one({"id": "t"}, {"$inc": {"users_version": 1}})
+
+    monkeypatch.setattr(members, "add", interfere)
+    with pytest.raises(ConflictError):
+        asyncio.run(teams._users_apply(query={"id": "t"}, users=["a"]))
+
+
+def test_member_team_lookup_is_exact_or_anchored(members, mongo_db):
+    asyncio.run(members.add(team="t1", users=["alice", "bob"]))
+    asyncio.run(members.add(team="t2", users=["alicia", "malice"]))
+    assert asyncio.run(members.teams(users="alice")) == ["t1"]
+    assert sorted(asyncio.run(members.teams(users="bob,malice"))) == ["t1", "t2"]
+    assert sorted(asyncio.run(members.teams(users="^ali"))) == ["t1", "t2"]
+    assert asyncio.run(members.teams(users="^mal")) == ["t2"]
@@ -0,0 +1,148 @@
+import asyncio
+import types
+
+import pytest
+
+from dummy_project.crud.common import mongo_session
+from dummy_project.crud.credentials import CrudCredentials
+from dummy_project.crud.teams import CrudTeams
+from dummy_project.crud.users import CrudUsers
+from dummy_project.errors import BackendError
+from dummy_project.userdelete import UserDeletion
+
+
+class FakeSession:
+    cluster_time = None
+    operation_time = None
+
+    def __init__(self, mongo_db):
+        self.in_transaction = False
+        self.mongo_db = mongo_db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def with_transaction(self, callback):
+        snapshot = {
+            name: list(self.mongo_db[name].find())
+            for name in self.mongo_db.list_collection_names()
+        }
+        self.in_transaction = True
+        try:
+            await callback(self)
+        except Exception:
+            for name, docs in snapshot.items():
+                self.mongo_db[name].delete_many({})
+                if docs:
+                    self.mongo_db[name].insert_many(docs)
+            raise
+        finally:
+            self.in_transaction = False
+
+
+class FakeClient:
+    def __init__(self, mongo_db, topology):
+        self.mongo_db = mongo_db
+        self.sessions = 0
+        self.topology_description = types.SimpleNamespace(topology_type_name=topology)
+
+    async def start_session(self, causal_consistency=True):
+        self.sessions += 1
+        return FakeSession(self.mongo_db)
+
+
+@pytest.fixture
+def populated(mongo_db):
+    mongo_db.users.insert_one({"id": "a", "deleting": False})
+    mongo_db.users_credentials.insert_many(
+        [{"id": "c1", "owner": "a"}, {"id": "c2", "owner": "b"}]
+    )
+    mongo_db.teams.insert_one({"id": "t", "deleting": False, "users": ["a", "b"]})
+    return mongo_db
+
+
+def deletion(log, metrics, collection, mongo_db, topology):
+    return UserDeletion(
+        log=log,
+        metrics=metrics,
+        client=FakeClient(mongo_db, topology),
+        crud_teams=CrudTeams(log=log, coll=collection("teams")),
+        crud_users=CrudUsers(log=log, coll=collection("users"), crud_ldap=None),
+        crud_users_credentials=CrudCredentials(
+            log=log, coll=collection("users_credentials")
+        ),
+    )
+
+
+async def fail(**kwargs):
+    raise BackendError
+
+
+def assert_deleted(mongo_db):
+    assert mongo_db.users.find_one({"id": "a"}) is None
+    assert [doc["id"] for doc in mongo_db.users_credentials.find()] == ["c2"]
+    assert mongo_db.teams.find_one({"id": "t"})["users"] == ["b"]
+
+
+@pytest.mark.parametrize(
+    "topology, transaction",
+    [("ReplicaSetWithPrimary", True), ("Single", False)],
+)
+def test_delete_cascades(log, metrics, collection, populated, topology, transaction):
+    user_deletion = deletion(log, metrics, collection, populated, topology)
+    result = asyncio.run(user_deletion.delete(_id="a"))
+    assert result.transaction is transaction
+    assert set(result.stages) >= {"credentials", "teams", "user", "total"}
+    assert ("mark" in result.stages) is not transaction
+    assert user_deletion.client.sessions == int(transaction)
+    assert_deleted(populated)
+
+
+def test_concurrent_stages_get_their_own_sessions(log, metrics, collection, populated):
+    user_deletion = deletion(log, metrics, collection, populated, "Single")
+
+    async def scenario():
+        mongo_session.set(FakeSession(populated))
+        return await user_deletion.delete(_id="a")
+
+    result = asyncio.run(scenario())
+    assert result.transaction is False
+    assert user_deletion.client.sessions == 2
+    assert_deleted(populated)
+
+
+def test_failed_transaction_leaves_user_untouched(
+    log, metrics, collection, populated, monkeypatch
+):
+    user_deletion = deletion(
+        log, metrics, collection, populated, "ReplicaSetWithPrimary"
+    )
+    monkeypatch.setattr(user_deletion.crud_teams, "delete_user_from_teams", fail)
+    with pytest.raises(BackendError):
+        asyncio.run(user_deletion.delete(_id="a"))
+    assert populated.users.find_one({"id": "a"})["deleting"] is False
+    assert populated.users_credentials.count_documents({"owner": "a"}) == 1
+
+
+def test_failed_concurrent_delete_is_left_for_the_reaper(
+    log, metrics, collection, populated, monkeypatch
+):
+    user_deletion = deletion(log, metrics, collection, populated, "Single")
+    delete_user_from_teams = user_deletion.crud_teams.delete_user_from_teams
+    monkeypatch.setattr(user_deletion.crud_teams, "delete_user_from_teams", fail)
+    with pytest.raises(BackendError):
+        asyncio.run(user_deletion.delete(_id="a"))
+    user = populated.users.find_one({"id": "a"})
+    assert user["deleting"] is True
+    assert "deleting_since" in user
+    assert populated.users_credentials.count_documents({"owner": "a"}) == 0
+    assert asyncio.run(user_deletion.crud_users.deleting(grace=0, limit=10)) == ["a"]
+
+    monkeypatch.setattr(
+        user_deletion.crud_teams, "delete_user_from_teams", delete_user_from_teams
+    )
+    asyncio.run(user_deletion.delete(_id="a"))
+    assert_deleted(populated)
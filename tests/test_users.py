@@ -0,0 +1,87 @@
+import asyncio
+
+import pymongo
+import pytest
+
+from dummy_project.crud.users import CrudUsers
+from dummy_project.model.users import UserPost
+from dummy_project.model.users import UserPut
+
+
+class RecordingCollection:
+    name = "users"
+
+    def __init__(self, before):
+        self.before = before
+        self.commands = []
+        self.kwargs = None
+
+    async def find_one_and_update(self, **kwargs):
+        self.commands.append("find_one_and_update")
+        self.kwargs = kwargs
+        return self.before
+
+
+@pytest.fixture
+def coll(collection):
+    return collection("users")
+
+
+@pytest.fixture
+def users(log, coll):
+    return CrudUsers(log=log, coll=coll, crud_ldap=None)
+
+
+def test_create_is_a_single_command(users, coll, mongo_db):
+    result = asyncio.run(
+        users.create(
+            _id="a",
+            payload=UserPost(email="a@example.com", name="A", password="secret"),
+            fields=["id", "email", "backend"],
+        )
+    )
+    assert result.model_dump(exclude_none=True) == {
+        "id": "a",
+        "email": "a@example.com",
+        "backend": "internal",
+    }
+    assert coll.commands == ["insert_one"]
+    assert mongo_db.users.find_one({"id": "a"})["password"] != "secret"
+
+
+@pytest.mark.parametrize("backend, changed", [("internal", True), ("ldap", False)])
+def test_update_is_a_single_command(users, coll, mongo_db, backend, changed):
+    mongo_db.users.insert_one(
+        {"id": "a", "backend": backend, "password": "old", "deleting": False}
+    )
+    result = asyncio.run(
+        users.update(
+            _id="a",
+            payload=UserPut(email="b@example.com", password="new"),
+            fields=["id", "email"],
+        )
+    )
+    assert result.email == "b@example.com"
+    assert coll.commands == ["find_one_and_update"]
+    assert (mongo_db.users.find_one({"id": "a"})["password"] != "old") is changed
+
+
+@pytest.mark.parametrize(
+    "before, previous", [(None, None), ({"backend": "internal"}, "internal")]
+)
+def test_upsert_external_is_a_single_command(log, before, previous):
+    coll = RecordingCollection(before)
+    users = CrudUsers(log=log, coll=coll, crud_ldap=None)
+    result = asyncio.run(
+        users.upsert_external(
+            _id="a",
+            payload=UserPut(email="a@example.com", name="A"),
+            backend="oauth:github",
+            backend_override=False,
+        )
+    )
+    assert result == previous
+    assert coll.commands == ["find_one_and_update"]
+    assert coll.kwargs["upsert"] is True
+    assert coll.kwargs["projection"] == {"backend": 1}
+    assert coll.kwargs["return_document"] == pymongo.ReturnDocument.BEFORE